@@ -0,0 +1,486 @@
+# Python env   :
+# -*- coding: utf-8 -*-
+# @Time    : 2024/6/16 14:10
+# @Author  : 李清水
+# @File    : Archive.py
+# @Description : 定义了压缩归档存储类ArchiveFileIOClass和读取类ArchiveReader
+#                样本按块编码：index和时间戳用二阶差分，传感器数值用一阶差分，再经zigzag变换和varint变长编码，
+#                每块单独用zlib（安装了zstandard时可用zstd）压缩；文件末尾的块索引支持按块随机读取
+
+# 日志输出相关库
+import logging
+# 块头和块索引打包/解包
+import struct
+# CRC校验和zlib压缩
+import zlib
+# 时间操作相关
+import time
+# 具体实现需要的依赖库
+import numpy as np
+
+# zstandard为可选依赖，未安装时只能使用zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 文件格式：
+#   文件头    MAGIC(4B) | VERSION(1B)
+#   块        块头 | 压缩后的数据
+#   块头      压缩后长度(4B) | 行数(4B) | 压缩方式(1B) | 数值编码(1B) | CRC32(4B) |
+#            首/末INDEX(int64) | 首/末时间戳(int64，单位us)
+#   块数据    三段长度(3x4B) | INDEX二阶差分 | 时间戳二阶差分 | 数值差分（或原始float64）
+#   块索引    每块一项：块偏移(8B) | 块头
+#   尾部      块数(4B) | 块索引CRC32(4B) | END_MAGIC(4B)
+ARCHIVE_MAGIC   = b'SARC'
+ARCHIVE_VERSION = 1
+ARCHIVE_END     = b'AEND'
+BLOCK_HEADER    = struct.Struct('<IIBBIqqqq')
+BLOCK_STREAMS   = struct.Struct('<III')
+INDEX_ENTRY     = struct.Struct('<Q')
+TRAILER         = struct.Struct('<II4s')
+# 压缩方式
+CODEC_ZLIB, CODEC_ZSTD = (0, 1)
+# 数值编码：VALUE_VARINT - 整数差分varint，VALUE_RAW - 原始float64（数值不是整数时）
+VALUE_VARINT, VALUE_RAW = (0, 1)
+# 按整数差分编码的数值绝对值上限，保证转换为int64和相邻差分都不溢出
+VARINT_VALUE_LIMIT = 2.0 ** 62
+# 解码后各列的数据类型
+BLOCK_DTYPES = (("index", np.int64), ("timestamp", np.float64), ("value", np.float64))
+
+
+def ZigZagEncode(values):
+    '''
+    zigzag变换：把有符号整数映射为无符号整数，绝对值小的数映射后也小
+    :param values: int64数组
+    :return: uint64数组
+    '''
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def ZigZagDecode(values):
+    '''
+    zigzag逆变换
+    :param values: uint64数组
+    :return: int64数组
+    '''
+    values = np.asarray(values, dtype=np.uint64)
+    return ((values >> np.uint64(1)).view(np.int64)) ^ -((values & np.uint64(1)).view(np.int64))
+
+
+def EncodeVarint(values) -> bytes:
+    '''
+    varint变长编码（向量化）：每字节保存7位，最高位为1表示后面还有字节
+    :param values: uint64数组
+    :return: 编码后的字节串
+    '''
+    values = np.asarray(values, dtype=np.uint64)
+    if values.shape[0] == 0:
+        return b''
+    # 每个数需要的字节数
+    nbytes = np.ones(values.shape[0], dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += values >= np.uint64(1 << (7 * k))
+    offsets = np.empty(values.shape[0], dtype=np.int64)
+    offsets[0] = 0
+    np.cumsum(nbytes[:-1], out=offsets[1:])
+    out = np.empty(int(offsets[-1] + nbytes[-1]), dtype=np.uint8)
+    for k in range(int(nbytes.max())):
+        mask = nbytes > k
+        chunk = ((values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)).astype(np.uint8)
+        # 不是最后一个字节时置最高位
+        chunk |= np.where(nbytes[mask] > k + 1, 0x80, 0).astype(np.uint8)
+        out[offsets[mask] + k] = chunk
+    return out.tobytes()
+
+
+def DecodeVarint(data, count: int):
+    '''
+    varint解码（向量化）
+    :param data: 编码后的字节串
+    :param count: 数的个数
+    :return: uint64数组
+    '''
+    if count == 0:
+        return np.empty(0, dtype=np.uint64)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)[:count]
+    if ends.shape[0] != count:
+        raise ValueError("Truncated varint data")
+    starts = np.empty(count, dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts + 1
+    values = np.zeros(count, dtype=np.uint64)
+    for k in range(int(lengths.max())):
+        mask = lengths > k
+        values[mask] |= (raw[starts[mask] + k] & 0x7F).astype(np.uint64) << np.uint64(7 * k)
+    return values
+
+
+def DeltaOfDelta(values):
+    '''
+    二阶差分，第一个值保存在块头中
+    :param values: int64数组，长度不小于1
+    :return: int64数组，长度为len(values)-1
+    '''
+    delta = np.diff(values)
+    if delta.shape[0] == 0:
+        return delta
+    return np.concatenate((delta[:1], np.diff(delta)))
+
+
+def UndoDeltaOfDelta(first: int, dod):
+    '''
+    二阶差分的逆运算
+    :param first: 第一个值
+    :param dod: 二阶差分
+    :return: int64数组
+    '''
+    values = np.empty(dod.shape[0] + 1, dtype=np.int64)
+    values[0] = first
+    np.cumsum(np.cumsum(dod), out=values[1:])
+    values[1:] += first
+    return values
+
+
+def Compress(data: bytes, codec: int, level: int) -> bytes:
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, level)
+
+
+def Decompress(data: bytes, codec: int) -> bytes:
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ImportError("This archive block is zstd-compressed, install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def EncodeBlock(index, timestamp, value, codec: int = CODEC_ZLIB, level: int = 6) -> bytes:
+    '''
+    编码一个块
+    :param index: int64数组
+    :param timestamp: float64数组，单位s，按us取整保存
+    :param value: float64数组
+    :param codec: 压缩方式
+    :param level: 压缩级别
+    :return: 块头和压缩后的数据
+    '''
+    index = np.asarray(index, dtype=np.int64)
+    micros = np.rint(np.asarray(timestamp, dtype=np.float64) * 1e6).astype(np.int64)
+    value = np.asarray(value, dtype=np.float64)
+    indexstream = EncodeVarint(ZigZagEncode(DeltaOfDelta(index)))
+    timestream = EncodeVarint(ZigZagEncode(DeltaOfDelta(micros)))
+    # NaN、inf和超出范围的值转换为int64的结果没有定义（并产生RuntimeWarning），这样的块直接保存原始float64
+    integral = None
+    if np.all(np.abs(value) < VARINT_VALUE_LIMIT):
+        integral = value.astype(np.int64)
+    if integral is not None and np.array_equal(integral, value):
+        valuemode = VALUE_VARINT
+        valuestream = EncodeVarint(ZigZagEncode(np.diff(integral, prepend=0)))
+    else:
+        valuemode = VALUE_RAW
+        valuestream = value.astype("<f8").tobytes()
+    payload = Compress(BLOCK_STREAMS.pack(len(indexstream), len(timestream), len(valuestream)) +
+                       indexstream + timestream + valuestream, codec, level)
+    header = BLOCK_HEADER.pack(len(payload), index.shape[0], codec, valuemode, zlib.crc32(payload),
+                               int(index[0]), int(index[-1]), int(micros[0]), int(micros[-1]))
+    return header + payload
+
+
+def DecodeBlock(header: tuple, payload: bytes) -> dict:
+    '''
+    解码一个块
+    :param header: 解包后的块头
+    :param payload: 压缩后的数据
+    :return: 字典，index(int64)、timestamp(float64，单位s)、value(float64)
+    '''
+    length, rows, codec, valuemode, crc, firstindex, _, firsttime, _ = header
+    if zlib.crc32(payload) != crc:
+        raise ValueError("Archive block checksum mismatch")
+    data = Decompress(payload, codec)
+    indexlength, timelength, valuelength = BLOCK_STREAMS.unpack_from(data)
+    offset = BLOCK_STREAMS.size
+    indexstream = data[offset:offset + indexlength]
+    offset += indexlength
+    timestream = data[offset:offset + timelength]
+    offset += timelength
+    valuestream = data[offset:offset + valuelength]
+    index = UndoDeltaOfDelta(firstindex, ZigZagDecode(DecodeVarint(indexstream, rows - 1)))
+    micros = UndoDeltaOfDelta(firsttime, ZigZagDecode(DecodeVarint(timestream, rows - 1)))
+    if valuemode == VALUE_VARINT:
+        value = np.cumsum(ZigZagDecode(DecodeVarint(valuestream, rows))).astype(np.float64)
+    else:
+        value = np.frombuffer(valuestream, dtype="<f8").astype(np.float64)
+    return {"index": index, "timestamp": micros / 1e6, "value": value}
+
+
+class ArchiveFileIOClass:
+    '''
+    压缩归档存储类，接口与FileIOClass相同
+
+    样本先写入内存缓冲区，每满blockrows行编码压缩为一块追加到文件，
+    关闭时写出最后不满的一块和块索引；流式写入，内存占用只与blockrows有关。
+    '''
+    def __init__(self, path: str, blockrows: int = 65536, codec: int = None, level: int = 6):
+        '''
+        初始化方法，新建归档文件，已有内容会被覆盖
+        :param path: 文件路径
+        :param blockrows: 每块的行数
+        :param codec: 压缩方式，为None时安装了zstandard则用CODEC_ZSTD，否则用CODEC_ZLIB
+        :param level: 压缩级别
+        '''
+        if codec is None:
+            codec = CODEC_ZLIB if zstandard is None else CODEC_ZSTD
+        if codec == CODEC_ZSTD and zstandard is None:
+            raise ImportError("CODEC_ZSTD requires the zstandard package")
+        self.path       = path
+        self.blockrows  = blockrows
+        self.codec      = codec
+        self.level      = level
+        # 累计写入的行数
+        self.rowcount   = 0
+        self.buffers    = {"index": np.empty(blockrows, dtype=np.int64),
+                           "timestamp": np.empty(blockrows, dtype=np.float64),
+                           "value": np.empty(blockrows, dtype=np.float64)}
+        self.bufferfill = 0
+        # 每块在文件中的偏移和块头
+        self.blocks     = []
+        self.file       = open(path, "wb", buffering=1 << 20)
+        self.file.write(ARCHIVE_MAGIC + bytes([ARCHIVE_VERSION]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.CloseFile()
+        return False
+
+    @property
+    def closed(self) -> bool:
+        return self.file is None
+
+    def WriteFile(self, index, data, timestamp=None) -> None:
+        '''
+        批量写入传感器数据
+        :param index: 传感器索引序列
+        :param data: 传感器数据序列
+        :param timestamp: 时间戳序列或单个时间戳，为None时为当前时间
+        :return: None
+        '''
+        if self.closed:
+            raise ValueError("Archive is closed", self.path)
+        index = np.asarray(index, dtype=np.int64)
+        data = np.asarray(data, dtype=np.float64)
+        timestamp = np.asarray(time.time() if timestamp is None else timestamp, dtype=np.float64)
+        count = index.shape[0]
+        start = 0
+        while start < count:
+            size = min(count - start, self.blockrows - self.bufferfill)
+            fill = self.bufferfill
+            self.buffers["index"][fill:fill + size] = index[start:start + size]
+            self.buffers["value"][fill:fill + size] = data[start:start + size]
+            self.buffers["timestamp"][fill:fill + size] = timestamp if timestamp.ndim == 0 else timestamp[start:start + size]
+            self.bufferfill += size
+            start += size
+            if self.bufferfill == self.blockrows:
+                self.__WriteBlock()
+        self.rowcount += count
+
+    def __WriteBlock(self) -> None:
+        '''
+        编码压缩缓冲区中的数据，作为一块写入文件，私有方法
+        :return: None
+        '''
+        if self.bufferfill == 0:
+            return
+        fill = self.bufferfill
+        block = EncodeBlock(self.buffers["index"][:fill], self.buffers["timestamp"][:fill],
+                            self.buffers["value"][:fill], self.codec, self.level)
+        self.blocks.append((self.file.tell(), block[:BLOCK_HEADER.size]))
+        self.file.write(block)
+        self.bufferfill = 0
+
+    def Flush(self) -> None:
+        '''
+        将缓冲区中不满一块的数据也写为一块并刷新文件，频繁调用会降低压缩率
+        :return: None
+        '''
+        if not self.closed:
+            self.__WriteBlock()
+            self.file.flush()
+
+    def CloseFile(self) -> None:
+        '''
+        写出最后一块和块索引并关闭文件，可以重复调用
+        :return: None
+        '''
+        if self.closed:
+            return
+        self.__WriteBlock()
+        footer = b''.join(INDEX_ENTRY.pack(offset) + header for offset, header in self.blocks)
+        self.file.write(footer + TRAILER.pack(len(self.blocks), zlib.crc32(footer), ARCHIVE_END))
+        self.file.close()
+        self.file = None
+
+
+class ArchiveReader:
+    '''
+    压缩归档读取类
+
+    打开时读取文件末尾的块索引；没有块索引（写入时中断）时顺序读取块头，跳过块数据。
+    可以按块随机读取、逐块流式读取，或按index范围只解码相关的块。
+    '''
+    def __init__(self, path: str):
+        '''
+        初始化方法
+        :param path: 文件路径
+        '''
+        self.path = path
+        self.file = open(path, "rb")
+        if self.file.read(len(ARCHIVE_MAGIC) + 1)[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+            raise ValueError("Not an archive file", path)
+        # 每块在文件中的偏移和解包后的块头
+        self.blocks = self.__ReadIndex()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+        return False
+
+    def __ReadIndex(self) -> list:
+        '''
+        读取块索引，私有方法
+        :return: [(偏移, 块头), ...]
+        '''
+        f = self.file
+        size = f.seek(0, 2)
+        entrysize = INDEX_ENTRY.size + BLOCK_HEADER.size
+        if size >= len(ARCHIVE_MAGIC) + 1 + TRAILER.size:
+            f.seek(size - TRAILER.size)
+            count, crc, magic = TRAILER.unpack(f.read(TRAILER.size))
+            footerstart = size - TRAILER.size - count * entrysize
+            if magic == ARCHIVE_END and footerstart >= len(ARCHIVE_MAGIC) + 1:
+                f.seek(footerstart)
+                footer = f.read(count * entrysize)
+                if zlib.crc32(footer) == crc:
+                    return [(INDEX_ENTRY.unpack_from(footer, i * entrysize)[0],
+                             BLOCK_HEADER.unpack_from(footer, i * entrysize + INDEX_ENTRY.size)) for i in range(count)]
+        # 没有块索引：顺序读取块头，最后一块不完整时忽略
+        logging.warning("Archive %s has no block index, scanning block headers", self.path)
+        blocks = []
+        offset = len(ARCHIVE_MAGIC) + 1
+        while offset + BLOCK_HEADER.size <= size:
+            f.seek(offset)
+            header = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+            if offset + BLOCK_HEADER.size + header[0] > size:
+                break
+            blocks.append((offset, header))
+            offset += BLOCK_HEADER.size + header[0]
+        return blocks
+
+    def __len__(self) -> int:
+        return sum(header[1] for _, header in self.blocks)
+
+    def ReadBlock(self, position: int) -> dict:
+        '''
+        读取并解码一块
+        :param position: 块序号
+        :return: 字典，index、timestamp、value
+        '''
+        offset, header = self.blocks[position]
+        self.file.seek(offset + BLOCK_HEADER.size)
+        return DecodeBlock(header, self.file.read(header[0]))
+
+    def __iter__(self):
+        '''
+        逐块流式读取
+        :return: 生成器，每块一个字典
+        '''
+        for position in range(len(self.blocks)):
+            yield self.ReadBlock(position)
+
+    def ReadRange(self, start: int = None, stop: int = None) -> dict:
+        '''
+        按index范围读取，只解码首/末INDEX与范围相交的块，要求INDEX递增
+        :param start: 下界，为None时不限制
+        :param stop: 上界（不包含），为None时不限制
+        :return: 字典，index、timestamp、value
+        '''
+        parts = []
+        for position, (_, header) in enumerate(self.blocks):
+            firstindex, lastindex = header[5], header[6]
+            if (start is not None and lastindex < start) or (stop is not None and firstindex >= stop):
+                continue
+            block = self.ReadBlock(position)
+            mask = np.ones(block["index"].shape[0], dtype=bool)
+            if start is not None:
+                mask &= block["index"] >= start
+            if stop is not None:
+                mask &= block["index"] < stop
+            parts.append({name: values[mask] for name, values in block.items()})
+        return {name: np.concatenate([part[name] for part in parts]) if parts else np.empty(0, dtype=dtype)
+                for name, dtype in BLOCK_DTYPES}
+
+    def Close(self) -> None:
+        self.file.close()
+
+
+if __name__ == "__main__":
+    # 与CSV对比大小和读取速度，数据与传感器相同：int(sin*10 + 噪声)，每1000个样本一个时间戳
+    import os
+    import csv
+    import tempfile
+    from FileIO import FileIOClass
+
+    count, batch = 2000000, 1000
+    tempdir = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    index = np.arange(count, dtype=np.int64)
+    data = (np.sin(index * 0.1) * 10 + rng.uniform(0, 5, count)).astype(np.int64)
+
+    csvpath = os.path.join(tempdir, "samples.csv")
+    with FileIOClass(csvpath) as fileio:
+        for i in range(0, count, batch):
+            fileio.WriteFile(index[i:i + batch].tolist(), data[i:i + batch].tolist())
+
+    results = []
+    codecs = [("zlib", CODEC_ZLIB)] + ([("zstd", CODEC_ZSTD)] if zstandard is not None else [])
+    for name, codec in codecs:
+        archivepath = os.path.join(tempdir, "samples.%s.sarc" % name)
+        start = time.perf_counter()
+        with ArchiveFileIOClass(archivepath, codec=codec) as archive:
+            now = time.time()
+            for i in range(0, count, batch):
+                archive.WriteFile(index[i:i + batch], data[i:i + batch], now + i * 1e-3)
+        writetime = time.perf_counter() - start
+        start = time.perf_counter()
+        with ArchiveReader(archivepath) as reader:
+            values = np.concatenate([block["value"] for block in reader])
+        readtime = time.perf_counter() - start
+        with ArchiveReader(archivepath) as reader:
+            start = time.perf_counter()
+            result = reader.ReadRange(1500000, 1500100)
+            rangetime = time.perf_counter() - start
+        results.append((name, os.path.getsize(archivepath), writetime, readtime, rangetime,
+                        np.array_equal(values, data) and np.array_equal(result["index"], index[1500000:1500100])))
+
+    start = time.perf_counter()
+    with open(csvpath, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        csvvalues = np.array([int(row[1]) for row in reader])
+    csvread = time.perf_counter() - start
+
+    csvsize = os.path.getsize(csvpath)
+    print("csv        : %8.2f MB, read %6.3f s (%5.1f M rows/s)" % (csvsize / 1e6, csvread, count / csvread / 1e6))
+    for name, size, writetime, readtime, rangetime, ok in results:
+        print("archive %-4s: %8.2f MB (%5.1fx smaller, %.2f bytes/sample incl. timestamp), write %6.3f s, "
+              "read %6.3f s (%5.1f M rows/s), 100-row range %.2f ms, roundtrip %s" %
+              (name, size / 1e6, csvsize / size, size / count, writetime, readtime, count / readtime / 1e6,
+               rangetime * 1e3, ok))
@@ -0,0 +1,378 @@
+# Python env   :
+# -*- coding: utf-8 -*-
+# @Time    : 2024/6/3 14:25
+# @Author  : 李清水
+# @File    : AsyncSerial.py
+# @Description : 定义了基于asyncio的串口传输类AsyncSerialClass和主机类AsyncMasterClass
+#                直接使用非阻塞文件描述符和loop.add_reader/add_writer，
+#                一个事件循环即可同时驱动大量串口，仅支持Linux等类Unix系统
+
+# 异步IO相关库
+import asyncio
+# 串口底层配置相关库
+import os
+import termios
+import tty
+# 双端队列，缓存已解码的帧
+from collections import deque
+# 日志输出相关库
+import logging
+# 帧协议编码解码
+from Frame import EncodeFrame, EncodeLines, FrameDecoder, LineDecoder, FRAME_DATA, FRAME_CMD
+
+# 每次从文件描述符读取的最大字节数
+READ_SIZE = 65536
+# 已解码但未被读取的帧超过该数量时暂停读取，形成背压
+MAX_PENDING_FRAMES = 65536
+
+class AsyncSerialClass:
+    '''
+    异步串口传输类
+
+    打开串口后将文件描述符设置为非阻塞，并用loop.add_reader注册可读回调：
+    数据到达时由事件循环调用回调，一次读出全部数据并解码为帧，放入队列，再唤醒等待的read_frame；
+    写入时先直接os.write，写不完的部分用loop.add_writer在可写时继续发送。
+
+    read_frame/write_frame都支持超时，并且可以被取消。
+    帧统一表示为(帧类型, 帧序号, 数值元组)，文本协议下每一行为一个FRAME_DATA帧。
+    '''
+    # 类变量：
+    #   ASCII_PROTOCOL  - 文本协议，每个数值一行  -0
+    #   BINARY_PROTOCOL - 二进制帧协议           -1
+    ASCII_PROTOCOL, BINARY_PROTOCOL = (0, 1)
+
+    def __init__(self, devport: str = "/dev/ttyUSB0", devbaudrate: int = 115200,
+                 protocol: int = ASCII_PROTOCOL, timeout: float = 0.3):
+        '''
+        初始化方法
+        :param devport: 串口设备路径
+        :param devbaudrate: 波特率
+        :param protocol: 通信协议
+        :param timeout: read_frame/write_frame的默认超时时间，单位s，None表示一直等待
+        '''
+        self.port       = devport
+        self.baudrate   = devbaudrate
+        self.timeout    = timeout
+        # 文件描述符，打开后有效
+        self.fd         = None
+        # 事件循环
+        self.__loop     = None
+        # 通信协议和对应的解码器
+        self.__protocol = protocol
+        self.__decoder  = FrameDecoder() if protocol == AsyncSerialClass.BINARY_PROTOCOL else LineDecoder()
+        # 已解码、等待读取的帧
+        self.__frames   = deque()
+        # 等待新帧到达的Future
+        self.__waiter   = None
+        # 是否暂停了读取（背压）
+        self.__paused   = False
+        # 待发送的数据和等待发送完成的Future
+        self.__txbuffer = bytearray()
+        self.__drainer  = None
+        # 串口出错或被对端关闭时记录的异常
+        self.__error    = None
+
+    @property
+    def devstate(self) -> bool:
+        return self.fd is not None
+
+    @property
+    def protocol(self) -> int:
+        return self.__protocol
+
+    def SetProtocol(self, protocol: int) -> None:
+        '''
+        切换通信协议，丢弃旧协议下未解码的数据
+        :param protocol: 通信协议
+        :return: None
+        '''
+        if protocol not in (AsyncSerialClass.ASCII_PROTOCOL, AsyncSerialClass.BINARY_PROTOCOL):
+            raise ValueError("Invalid protocol", protocol)
+        self.__protocol = protocol
+        self.__decoder  = FrameDecoder() if protocol == AsyncSerialClass.BINARY_PROTOCOL else LineDecoder()
+
+    async def OpenSerial(self) -> None:
+        '''
+        打开串口，设置为原始模式和非阻塞，并注册可读回调
+        :return: None
+        '''
+        self.__loop = asyncio.get_running_loop()
+        fd = os.open(self.port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            if os.isatty(fd):
+                # 原始模式：不做行缓冲和字符转换
+                tty.setraw(fd)
+                attrs = termios.tcgetattr(fd)
+                speed = getattr(termios, "B%d" % self.baudrate, None)
+                if speed is not None:
+                    attrs[4] = attrs[5] = speed
+                termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        except Exception:
+            os.close(fd)
+            raise
+        self.fd = fd
+        self.__error = None
+        self.__loop.add_reader(fd, self.__OnReadable)
+        logging.info("AsyncSerialClass-OpenSerial %s", self.port)
+
+    def CloseSerial(self) -> None:
+        '''
+        关闭串口，等待中的read_frame/write_frame会收到ConnectionError
+        :return: None
+        '''
+        if self.fd is None:
+            return
+        self.__loop.remove_reader(self.fd)
+        self.__loop.remove_writer(self.fd)
+        os.close(self.fd)
+        self.fd = None
+        self.__SetError(ConnectionError("serial closed", self.port))
+        logging.info("AsyncSerialClass-CloseSerial %s", self.port)
+
+    def __SetError(self, error) -> None:
+        '''
+        记录异常并唤醒所有等待者，私有方法
+        :param error: 异常对象
+        :return: None
+        '''
+        if self.__error is None:
+            self.__error = error
+        for future in (self.__waiter, self.__drainer):
+            if future is not None and not future.done():
+                future.set_exception(self.__error)
+
+    def __OnReadable(self) -> None:
+        '''
+        可读回调：读出已到达的数据，解码后放入帧队列，私有方法
+        :return: None
+        '''
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            # 例如pty对端关闭时返回EIO
+            self.__loop.remove_reader(self.fd)
+            self.__SetError(e)
+            return
+        if not data:
+            self.__loop.remove_reader(self.fd)
+            self.__SetError(ConnectionError("serial EOF", self.port))
+            return
+        self.__decoder.feed(data)
+        if self.__protocol == AsyncSerialClass.BINARY_PROTOCOL:
+            self.__frames.extend(self.__decoder.frames())
+        else:
+            self.__frames.extend((FRAME_DATA, 0, (value,)) for value in self.__decoder.values())
+        if self.__frames:
+            if self.__waiter is not None and not self.__waiter.done():
+                self.__waiter.set_result(None)
+            # 读取方处理不过来时暂停读取，数据留在内核缓冲区中
+            if len(self.__frames) >= MAX_PENDING_FRAMES:
+                self.__loop.remove_reader(self.fd)
+                self.__paused = True
+
+    def __OnWritable(self) -> None:
+        '''
+        可写回调：继续发送剩余数据，发送完成后唤醒等待者，私有方法
+        :return: None
+        '''
+        try:
+            sent = os.write(self.fd, self.__txbuffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self.__loop.remove_writer(self.fd)
+            self.__SetError(e)
+            return
+        del self.__txbuffer[:sent]
+        if not self.__txbuffer:
+            self.__loop.remove_writer(self.fd)
+            if self.__drainer is not None and not self.__drainer.done():
+                self.__drainer.set_result(None)
+
+    def pending(self) -> int:
+        '''
+        返回已解码、尚未读取的帧数
+        :return: int
+        '''
+        return len(self.__frames)
+
+    async def read_frame(self, timeout: float = -1):
+        '''
+        读取一帧
+        :param timeout: 超时时间，单位s，-1表示使用默认超时，None表示一直等待
+        :return: (帧类型, 帧序号, 数值元组)，超时时返回None
+        '''
+        if timeout == -1:
+            timeout = self.timeout
+        while not self.__frames:
+            if self.__error is not None:
+                raise self.__error
+            self.__waiter = self.__loop.create_future()
+            try:
+                await asyncio.wait_for(self.__waiter, timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self.__waiter = None
+        frame = self.__frames.popleft()
+        if self.__paused and len(self.__frames) < MAX_PENDING_FRAMES // 2:
+            self.__paused = False
+            self.__loop.add_reader(self.fd, self.__OnReadable)
+        return frame
+
+    def read_frames(self) -> list:
+        '''
+        不等待，取出所有已解码的帧
+        :return: 帧列表
+        '''
+        frames = list(self.__frames)
+        self.__frames.clear()
+        if self.__paused:
+            self.__paused = False
+            self.__loop.add_reader(self.fd, self.__OnReadable)
+        return frames
+
+    async def write_frame(self, values, frametype: int = FRAME_DATA, seq: int = 0, timeout: float = -1) -> None:
+        '''
+        写入数值，二进制帧协议下编码为一帧，文本协议下每个数值一行
+        :param values: 整数序列
+        :param frametype: 帧类型
+        :param seq: 帧序号
+        :param timeout: 等待发送完成的超时时间，单位s，-1表示使用默认超时，None表示一直等待
+        :return: None
+        '''
+        if self.__error is not None:
+            raise self.__error
+        if timeout == -1:
+            timeout = self.timeout
+        if self.__protocol == AsyncSerialClass.BINARY_PROTOCOL:
+            data = EncodeFrame(frametype, values, seq)
+        else:
+            data = EncodeLines(values)
+        if self.__txbuffer:
+            # 前面还有数据没发送完，排在后面
+            self.__txbuffer += data
+        else:
+            try:
+                sent = os.write(self.fd, data)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            if sent == len(data):
+                return
+            self.__txbuffer += data[sent:]
+            self.__loop.add_writer(self.fd, self.__OnWritable)
+        if self.__drainer is None or self.__drainer.done():
+            self.__drainer = self.__loop.create_future()
+        # shield：超时或取消只影响本次等待，剩余数据仍会继续发送
+        await asyncio.wait_for(asyncio.shield(self.__drainer), timeout)
+
+
+class AsyncMasterClass(AsyncSerialClass):
+    '''
+    异步主机类，与MasterClass的收发方法对应，所有收发操作都是协程
+    '''
+    # 类变量：
+    #   START_CMD       - 开启命令      -0
+    #   STOP_CMD        - 关闭命令      -1
+    #   SENDID_CMD      - 发送ID命令    -2
+    #   SENDVALUE_CMD   - 发送数据命令   -3
+    #   BINARY_CMD      - 切换二进制帧协议命令 -4
+    START_CMD, STOP_CMD, SENDID_CMD, SENDVALUE_CMD, BINARY_CMD = (0, 1, 2, 3, 4)
+
+    async def StartMaster(self) -> None:
+        await self.OpenSerial()
+        logging.info("START ASYNC MASTER : %s", self.port)
+
+    def StopMaster(self) -> None:
+        self.CloseSerial()
+        logging.info("CLOSE ASYNC MASTER : %s", self.port)
+
+    async def SendSensorCMD(self, cmd: int, *args, seq: int = 0) -> None:
+        '''
+        主机发送命令，二进制帧协议下可以携带参数
+        :param cmd: 命令
+        :param args: 命令参数
+        :param seq: 帧序号
+        :return: None
+        '''
+        if self.protocol == AsyncSerialClass.BINARY_PROTOCOL:
+            await self.write_frame((cmd,) + args, FRAME_CMD, seq)
+        else:
+            await self.write_frame((cmd,))
+
+    async def RecvSensorValue(self, timeout: float = -1) -> int:
+        '''
+        接收一个传感器数据
+        :param timeout: 超时时间，单位s
+        :return: 传感器数据，超时返回-1
+        '''
+        frame = await self.read_frame(timeout)
+        return frame[2][0] if frame is not None and frame[2] else -1
+
+    async def RecvSensorID(self, timeout: float = -1) -> int:
+        '''
+        发送SENDID_CMD命令并接收传感器ID号
+        :param timeout: 超时时间，单位s
+        :return: 传感器ID号，超时返回-1
+        '''
+        await self.SendSensorCMD(self.SENDID_CMD)
+        return await self.RecvSensorValue(timeout)
+
+    async def NegotiateBinary(self, timeout: float = -1) -> bool:
+        '''
+        发送BINARY_CMD命令，收到传感器的确认后双方切换为二进制帧协议
+        :param timeout: 超时时间，单位s
+        :return: bool，是否切换成功
+        '''
+        await self.SendSensorCMD(self.BINARY_CMD)
+        ack = await self.RecvSensorValue(timeout)
+        if ack == self.BINARY_CMD:
+            self.SetProtocol(AsyncSerialClass.BINARY_PROTOCOL)
+            return True
+        return False
+
+
+if __name__ == "__main__":
+    # 用pty对模拟多个串口：每个端口的另一端返回递增的数据，一个事件循环同时轮询所有端口
+    import time
+
+    async def FakeSensor(fd, count):
+        # 模拟传感器：每收到一行命令就回复一个数据
+        loop = asyncio.get_running_loop()
+        decoder = LineDecoder()
+        value = 0
+        while value < count:
+            ready = loop.create_future()
+            loop.add_reader(fd, ready.set_result, None)
+            await ready
+            loop.remove_reader(fd)
+            decoder.feed(os.read(fd, READ_SIZE))
+            replies = []
+            for cmd in decoder.values():
+                value += 1
+                replies.append(value)
+            os.write(fd, EncodeLines(replies))
+
+    async def PollMaster(master, count):
+        await master.StartMaster()
+        for _ in range(count):
+            await master.SendSensorCMD(master.SENDVALUE_CMD)
+            await master.RecvSensorValue()
+        master.StopMaster()
+
+    async def Main(ports, count):
+        tasks = []
+        for _ in range(ports):
+            sensorfd, masterfd = os.openpty()
+            tty.setraw(sensorfd)
+            os.set_blocking(sensorfd, False)
+            tasks.append(FakeSensor(sensorfd, count))
+            tasks.append(PollMaster(AsyncMasterClass(os.ttyname(masterfd)), count))
+        start = time.perf_counter()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        print("%d ports, %d round trips : %.2f s, %.0f samples/s" % (ports, ports * count, elapsed, ports * count / elapsed))
+
+    asyncio.run(Main(200, 100))
@@ -0,0 +1,364 @@
+# Python env   :
+# -*- coding: utf-8 -*-
+# @Time    : 2024/5/24 09:48
+# @Author  : 李清水
+# @File    : Buffer.py
+# @Description : 定义了RingStore类，固定容量的样本环形存储，
+#                供MasterProcess、PlotThread保存采样数据，内存占用不随运行时间增长
+#                定义了SharedRingBuffer类，基于共享内存的单生产者/单消费者环形缓冲区，
+#                MasterProcess将样本直接写入共享内存，PlotThread零拷贝地批量读取
+
+# 具体实现需要的依赖库
+import os
+import numpy as np
+from array import array
+# 进程间共享内存
+from multiprocessing import shared_memory
+
+# 溢写到磁盘时每批写入的样本数
+SPILL_CHUNK = 4096
+
+
+class RingStore:
+    '''
+    固定容量的样本环形存储类
+
+    只保留最近capacity个样本，写满后覆盖最旧的样本；
+    底层是一个长度为2*capacity的float64数组，每个样本同时写入slot和slot+capacity两个位置（镜像），
+    因此任意时刻按时间顺序排列的数据都是一段连续内存，view()可以零拷贝地返回给滤波、绘图和统计使用。
+
+    可选地将被覆盖的旧样本以float64原始二进制追加写入spillpath，之后可用np.fromfile/np.memmap读取。
+
+    支持len()、下标/切片读取、下标/切片赋值和迭代，下标为按时间顺序的逻辑下标，
+    因此可以直接作为DateProcessClass的DateList使用。
+    '''
+    def __init__(self, capacity: int = 100000, spillpath: str = None):
+        '''
+        初始化方法
+        :param capacity: 保留的样本个数
+        :param spillpath: 旧样本溢写文件路径，为None时直接丢弃旧样本
+        '''
+        if capacity < 1:
+            raise ValueError("capacity must be >= 1", capacity)
+        self.capacity   = capacity
+        self.spillpath  = spillpath
+        # 镜像缓冲区
+        self.__buffer   = np.zeros(2 * capacity, dtype=np.float64)
+        # 下一个写入的slot
+        self.__pos      = 0
+        # 当前保存的样本个数
+        self.__count    = 0
+        # 累计写入的样本总数，包括已被覆盖的样本
+        self.total      = 0
+        # 等待溢写的旧样本
+        self.__pending  = array('d')
+        # 溢写文件对象，第一次溢写时才打开，便于对象在进程间传递
+        self.__spillfile = None
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def __getitem__(self, key):
+        return self.view()[key]
+
+    def __setitem__(self, key, value) -> None:
+        # 将逻辑下标转换为slot，两个镜像位置都要写入
+        slots = (np.arange(self.__count)[key] + self.__pos - self.__count) % self.capacity
+        self.__buffer[slots] = value
+        self.__buffer[slots + self.capacity] = value
+
+    def append(self, value) -> None:
+        '''
+        追加一个样本，O(1)
+        :param value: 样本值
+        :return: None
+        '''
+        pos = self.__pos
+        buffer = self.__buffer
+        if self.__count == self.capacity:
+            if self.spillpath is not None:
+                self.__Spill(buffer[pos:pos + 1])
+        else:
+            self.__count += 1
+        buffer[pos] = value
+        buffer[pos + self.capacity] = value
+        pos += 1
+        self.__pos = 0 if pos == self.capacity else pos
+        self.total += 1
+
+    def extend(self, values) -> None:
+        '''
+        批量追加样本，按连续的slot分段做向量化写入
+        :param values: 样本序列
+        :return: None
+        '''
+        values = np.asarray(values, dtype=np.float64).ravel()
+        capacity = self.capacity
+        buffer = self.__buffer
+        start = 0
+        while start < values.shape[0]:
+            pos = self.__pos
+            size = min(capacity - pos, values.shape[0] - start)
+            # 本段中会覆盖的旧样本个数，它们位于本段slot的末尾
+            overwrite = max(0, self.__count + size - capacity)
+            if overwrite and self.spillpath is not None:
+                self.__Spill(buffer[pos + size - overwrite:pos + size])
+            chunk = values[start:start + size]
+            buffer[pos:pos + size] = chunk
+            buffer[pos + capacity:pos + capacity + size] = chunk
+            self.__count = min(capacity, self.__count + size)
+            pos += size
+            self.__pos = 0 if pos == capacity else pos
+            start += size
+        self.total += values.shape[0]
+
+    def view(self, last: int = None):
+        '''
+        按时间顺序返回保存的样本，零拷贝
+        返回的数组与内部缓冲区共享内存，之后的写入可能改变其内容，需要长期保存时请copy()
+        :param last: 只返回最近last个样本，为None时返回全部
+        :return: 一维float64数组视图
+        '''
+        count = self.__count if last is None else min(last, self.__count)
+        end = self.__pos + self.capacity
+        return self.__buffer[end - count:end]
+
+    def tolist(self) -> list:
+        return self.view().tolist()
+
+    def clear(self) -> None:
+        '''
+        清空保存的样本，累计样本总数total同时清零
+        :return: None
+        '''
+        self.__pos = 0
+        self.__count = 0
+        self.total = 0
+
+    def __Spill(self, values) -> None:
+        '''
+        将即将被覆盖的旧样本放入待溢写缓冲，攒够一批后写入文件，私有方法
+        :param values: 旧样本
+        :return: None
+        '''
+        self.__pending.frombytes(values.tobytes())
+        if len(self.__pending) >= SPILL_CHUNK:
+            self.FlushSpill()
+
+    def FlushSpill(self) -> None:
+        '''
+        将待溢写的旧样本写入文件
+        :return: None
+        '''
+        if not self.__pending:
+            return
+        if self.__spillfile is None:
+            self.__spillfile = open(self.spillpath, "ab")
+        self.__pending.tofile(self.__spillfile)
+        self.__spillfile.flush()
+        del self.__pending[:]
+
+    def close(self) -> None:
+        '''
+        写出剩余的待溢写样本并关闭溢写文件
+        :return: None
+        '''
+        self.FlushSpill()
+        if self.__spillfile is not None:
+            self.__spillfile.close()
+            self.__spillfile = None
+
+    def __getstate__(self):
+        # 文件对象不能序列化，传递给子进程前先写出待溢写数据
+        self.FlushSpill()
+        state = self.__dict__.copy()
+        state["_RingStore__spillfile"] = None
+        return state
+
+
+class SharedRingBuffer:
+    '''
+    基于multiprocessing.shared_memory的单生产者/单消费者环形缓冲区类
+
+    共享内存的布局为：
+        head（uint64，独占一个64字节缓存行） —— 生产者累计写入的行数，只由生产者修改
+        tail（uint64，独占一个64字节缓存行） —— 消费者累计读取的行数，只由消费者修改
+        数据区 capacity x columns 的float64数组，默认三列为原始值、滤波值、时间戳
+    head、tail只增不减，行号为计数对capacity取余；两个计数各自只有一个写入方，因此不需要加锁。
+    生产者先写数据再更新head，消费者先读数据再更新tail。
+
+    平台假设：本类只在x86/x86-64（TSO内存模型）上保证正确。head/tail的更新没有内存屏障也没有加锁，
+    依赖两点：对齐的8字节写入是原子的；同一核心的写入对其他核心按程序顺序可见（数据先于head、读取先于tail）。
+    在ARM等弱内存序的平台上，消费者可能先看到新的head再看到对应的数据，
+    需要在外部用multiprocessing.Lock等同步原语保护head/tail的更新和读取后再使用。
+
+    消费者通过view()零拷贝地取得一段连续的行，处理完后调用advance()释放；
+    对象按共享内存名称序列化，可以作为参数传递给子进程，子进程中自动重新连接。
+    '''
+    # 默认列：原始值、滤波值、时间戳
+    RAW, FILTERED, TIMESTAMP = (0, 1, 2)
+    # head、tail各占一个缓存行，避免生产者和消费者互相使对方的缓存行失效
+    HEADER_SIZE = 128
+
+    def __init__(self, capacity: int = 65536, columns: int = 3, name: str = None, create: bool = True):
+        '''
+        初始化方法
+        :param capacity: 可保存的行数
+        :param columns: 每行的float64个数
+        :param name: 共享内存名称，为None时自动生成
+        :param create: True时创建共享内存，False时连接名称为name的已有共享内存
+        '''
+        if capacity < 1 or columns < 1:
+            raise ValueError("capacity and columns must be >= 1", capacity, columns)
+        self.capacity   = capacity
+        self.columns    = columns
+        self.owner      = create
+        # 创建共享内存的进程号，fork出的子进程继承本对象但不负责释放共享内存
+        self.pid        = os.getpid()
+        # 缓冲区满时未能写入的行数，只由生产者修改
+        self.overruns   = 0
+        size = SharedRingBuffer.HEADER_SIZE + capacity * columns * 8
+        self.shm        = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.__Attach()
+        if create:
+            self.__counters[:] = 0
+
+    def __Attach(self) -> None:
+        '''
+        在共享内存上建立head/tail和数据区的ndarray视图，私有方法
+        :return: None
+        '''
+        buf = self.shm.buf
+        # 每个缓存行的前8字节为计数
+        self.__counters = np.ndarray((2,), dtype=np.uint64, buffer=buf, strides=(64,))
+        self.__data     = np.ndarray((self.capacity, self.columns), dtype=np.float64,
+                                     buffer=buf, offset=SharedRingBuffer.HEADER_SIZE)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def head(self) -> int:
+        return int(self.__counters[0])
+
+    @property
+    def tail(self) -> int:
+        return int(self.__counters[1])
+
+    def __len__(self) -> int:
+        # 可读的行数
+        counters = self.__counters
+        return int(counters[0] - counters[1])
+
+    def free(self) -> int:
+        '''
+        返回可写入的行数
+        :return: int
+        '''
+        return self.capacity - len(self)
+
+    def push(self, row) -> bool:
+        '''
+        生产者写入一行
+        :param row: columns个数值
+        :return: bool，缓冲区已满时返回False，该行被丢弃
+        '''
+        counters = self.__counters
+        head = int(counters[0])
+        if head - int(counters[1]) >= self.capacity:
+            self.overruns += 1
+            return False
+        self.__data[head % self.capacity] = row
+        counters[0] = head + 1
+        return True
+
+    def extend(self, rows) -> int:
+        '''
+        生产者批量写入，空间不足时只写入能容纳的前若干行
+        :param rows: 形状为(n, columns)的数组
+        :return: 实际写入的行数
+        '''
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, self.columns)
+        counters = self.__counters
+        head = int(counters[0])
+        count = min(rows.shape[0], self.capacity - (head - int(counters[1])))
+        self.overruns += rows.shape[0] - count
+        written = 0
+        while written < count:
+            pos = (head + written) % self.capacity
+            size = min(self.capacity - pos, count - written)
+            self.__data[pos:pos + size] = rows[written:written + size]
+            written += size
+        counters[0] = head + count
+        return count
+
+    def view(self, maxcount: int = None):
+        '''
+        消费者取得从tail开始的一段连续的可读行，零拷贝
+        数据跨越缓冲区末尾时只返回到末尾为止的部分，advance后再次调用可取得剩余部分；
+        返回的数组在advance之前不会被生产者覆盖
+        :param maxcount: 最多返回的行数，为None时不限制
+        :return: 形状为(n, columns)的float64数组视图
+        '''
+        counters = self.__counters
+        tail = int(counters[1])
+        count = int(counters[0]) - tail
+        if maxcount is not None:
+            count = min(count, maxcount)
+        pos = tail % self.capacity
+        return self.__data[pos:pos + min(count, self.capacity - pos)]
+
+    def advance(self, count: int) -> None:
+        '''
+        消费者释放已经处理完的count行
+        :param count: 行数，不超过len()
+        :return: None
+        '''
+        if count > len(self):
+            raise ValueError("advance beyond head", count, len(self))
+        self.__counters[1] = int(self.__counters[1]) + count
+
+    def read(self, maxcount: int = None):
+        '''
+        消费者取出所有可读行的副本并释放
+        :param maxcount: 最多读取的行数，为None时不限制
+        :return: 形状为(n, columns)的float64数组
+        '''
+        count = len(self) if maxcount is None else min(len(self), maxcount)
+        result = np.empty((count, self.columns), dtype=np.float64)
+        done = 0
+        while done < count:
+            block = self.view(count - done)
+            result[done:done + block.shape[0]] = block
+            self.advance(block.shape[0])
+            done += block.shape[0]
+        return result
+
+    def close(self) -> None:
+        '''
+        断开与共享内存的连接，创建方进程同时释放共享内存
+        :return: None
+        '''
+        # 先释放引用共享内存的ndarray，否则close会因为缓冲区仍被引用而失败
+        self.__counters = None
+        self.__data = None
+        self.shm.close()
+        if self.owner and self.pid == os.getpid():
+            self.shm.unlink()
+
+    def __getstate__(self):
+        # 只传递共享内存名称和形状，子进程中重新连接
+        return {"name": self.shm.name, "capacity": self.capacity, "columns": self.columns}
+
+    def __setstate__(self, state):
+        self.capacity   = state["capacity"]
+        self.columns    = state["columns"]
+        self.owner      = False
+        self.pid        = os.getpid()
+        self.overruns   = 0
+        self.shm        = shared_memory.SharedMemory(name=state["name"])
+        self.__Attach()
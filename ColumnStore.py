@@ -0,0 +1,429 @@
+# Python env   :
+# -*- coding: utf-8 -*-
+# @Time    : 2024/6/14 10:40
+# @Author  : 李清水
+# @File    : ColumnStore.py
+# @Description : 定义了列式二进制存储类ColumnFileIOClass和读取类ColumnReader
+#                样本按列保存为定长二进制文件（index int64、value float64、timestamp float64、sensor int32），
+#                每个块的每列一个文件，可直接用np.memmap零拷贝读取；
+#                目录清单catalog.json记录每个块的行数和index/timestamp的最小/最大值，按范围查询时只读取相关的块
+
+# 日志输出相关库
+import logging
+# 文件和目录操作
+import os
+# 目录清单
+import json
+# 时间操作相关
+import time
+# 具体实现需要的依赖库
+import numpy as np
+
+# 列名和数据类型，文件中均为小端序
+COLUMNS = (("index", "<i8"), ("value", "<f8"), ("timestamp", "<f8"), ("sensor", "<i4"))
+# 按范围查询时可用的列，目录清单中记录这些列的最小/最大值和是否有序
+RANGE_COLUMNS = ("index", "timestamp")
+CATALOG_NAME = "catalog.json"
+CATALOG_VERSION = 1
+
+
+def ChunkPath(path: str, chunkid: int, column: str) -> str:
+    '''
+    返回一个块中一列的文件路径
+    :param path: 存储目录
+    :param chunkid: 块编号
+    :param column: 列名
+    :return: 文件路径
+    '''
+    return os.path.join(path, "chunk_%08d.%s" % (chunkid, column))
+
+
+def CommittedRows(path: str, chunkid: int) -> int:
+    '''
+    返回一个块中已经写入文件的完整行数，即各列文件中最短的完整行数
+    列文件按列依次追加，写了一半的行只出现在部分列的末尾，不会被计入
+    :param path: 存储目录
+    :param chunkid: 块编号
+    :return: 行数，列文件不存在时为0
+    '''
+    rows = None
+    for name, dtype in COLUMNS:
+        filepath = ChunkPath(path, chunkid, name)
+        size = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+        count = size // np.dtype(dtype).itemsize
+        rows = count if rows is None else min(rows, count)
+    return rows
+
+
+class ColumnFileIOClass:
+    '''
+    列式二进制存储类，接口与FileIOClass相同
+
+    样本先写入内存中的列缓冲区，缓冲区满或按刷新策略刷新时追加到当前块的列文件；
+    当前块写满chunkrows行或关闭时封存，写入目录清单，封存的块不再修改。
+    打开已有目录时继续追加：未封存的块按各列中最短的完整行数截断后继续写入。
+    '''
+    def __init__(self, path: str, chunkrows: int = 1 << 20, bufferrows: int = 65536,
+                 flushrows: int = 65536, flushinterval: float = 1000):
+        '''
+        初始化方法
+        :param path: 存储目录，不存在时创建
+        :param chunkrows: 每个块的最大行数
+        :param bufferrows: 内存列缓冲区的行数
+        :param flushrows: 每写入多少行刷新一次，为0时不按行数刷新
+        :param flushinterval: 距离上次刷新超过多少毫秒时刷新，为0时不按时间刷新
+        '''
+        self.path          = path
+        self.chunkrows     = chunkrows
+        self.bufferrows    = bufferrows
+        self.flushrows     = flushrows
+        self.flushinterval = flushinterval / 1000
+        self.pendingrows   = 0
+        self.flushtime     = time.monotonic()
+        # 累计写入的行数
+        self.rowcount      = 0
+        # 内存列缓冲区及其中的行数
+        self.buffers       = {name: np.empty(bufferrows, dtype=dtype) for name, dtype in COLUMNS}
+        self.bufferfill    = 0
+        # 当前块的编号、已写入文件的行数、列文件和统计信息
+        self.chunkid       = 0
+        self.chunkfill     = 0
+        self.files         = None
+        self.stats         = None
+        os.makedirs(path, exist_ok=True)
+        self.catalog       = self.__LoadCatalog()
+        self.__OpenChunk()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.CloseFile()
+        return False
+
+    @property
+    def closed(self) -> bool:
+        return self.files is None
+
+    def __LoadCatalog(self) -> dict:
+        '''
+        读取目录清单，不存在时新建，私有方法
+        :return: 目录清单字典
+        '''
+        catalogpath = os.path.join(self.path, CATALOG_NAME)
+        if os.path.exists(catalogpath):
+            with open(catalogpath, encoding="utf-8") as f:
+                catalog = json.load(f)
+            if catalog.get("version") != CATALOG_VERSION:
+                raise ValueError("Unsupported catalog version", catalog.get("version"))
+            return catalog
+        return {"version": CATALOG_VERSION, "columns": dict(COLUMNS), "chunks": []}
+
+    def __SaveCatalog(self) -> None:
+        '''
+        写入目录清单，先写临时文件再替换，读取方不会看到写了一半的清单，私有方法
+        :return: None
+        '''
+        catalogpath = os.path.join(self.path, CATALOG_NAME)
+        with open(catalogpath + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.catalog, f)
+        os.replace(catalogpath + ".tmp", catalogpath)
+
+    def __OpenChunk(self) -> None:
+        '''
+        打开当前块的列文件，上次未封存的块按完整行数截断后继续追加，私有方法
+        :return: None
+        '''
+        chunks = self.catalog["chunks"]
+        self.chunkid = chunks[-1]["id"] + 1 if chunks else 0
+        rows = CommittedRows(self.path, self.chunkid)
+        self.files = {}
+        for name, dtype in COLUMNS:
+            f = open(ChunkPath(self.path, self.chunkid, name), "ab")
+            f.truncate(rows * np.dtype(dtype).itemsize)
+            self.files[name] = f
+        self.chunkfill = rows
+        self.stats = {name: None for name in RANGE_COLUMNS}
+        if rows:
+            # 重新计算截断后已有数据的统计信息
+            for name in RANGE_COLUMNS:
+                self.__UpdateStats(name, np.fromfile(ChunkPath(self.path, self.chunkid, name),
+                                                     dtype=dict(COLUMNS)[name]))
+            logging.info("ColumnStore resume chunk %d with %d rows", self.chunkid, rows)
+
+    def __UpdateStats(self, name: str, values) -> None:
+        '''
+        用新写入的一段数据更新当前块一列的最小/最大值和是否有序，私有方法
+        :param name: 列名
+        :param values: 新数据
+        :return: None
+        '''
+        if values.shape[0] == 0:
+            return
+        low, high = values.min().item(), values.max().item()
+        ordered = bool(np.all(values[1:] >= values[:-1]))
+        stats = self.stats[name]
+        if stats is None:
+            self.stats[name] = [low, high, ordered, values[-1].item()]
+        else:
+            stats[2] = stats[2] and ordered and values[0].item() >= stats[3]
+            stats[0], stats[1], stats[3] = min(stats[0], low), max(stats[1], high), values[-1].item()
+
+    def __WriteBuffer(self) -> None:
+        '''
+        将内存列缓冲区追加到当前块的列文件，写满的块封存，私有方法
+        :return: None
+        '''
+        start = 0
+        while start < self.bufferfill:
+            size = min(self.bufferfill - start, self.chunkrows - self.chunkfill)
+            for name, _ in COLUMNS:
+                values = self.buffers[name][start:start + size]
+                self.files[name].write(values.tobytes())
+                if name in self.stats:
+                    self.__UpdateStats(name, values)
+            self.chunkfill += size
+            start += size
+            if self.chunkfill >= self.chunkrows:
+                self.__SealChunk()
+                self.__OpenChunk()
+        self.bufferfill = 0
+
+    def __SealChunk(self) -> None:
+        '''
+        封存当前块：关闭列文件，在目录清单中记录行数和统计信息，私有方法
+        没有写入任何行的块不记录，同时删除它的空列文件
+        :return: None
+        '''
+        for f in self.files.values():
+            f.close()
+        self.files = None
+        if self.chunkfill == 0:
+            for name, _ in COLUMNS:
+                os.remove(ChunkPath(self.path, self.chunkid, name))
+            return
+        entry = {"id": self.chunkid, "rows": self.chunkfill}
+        for name in RANGE_COLUMNS:
+            low, high, ordered, _ = self.stats[name]
+            entry[name] = [low, high]
+            entry[name + "_sorted"] = ordered
+        self.catalog["chunks"].append(entry)
+        self.__SaveCatalog()
+
+    def WriteFile(self, index, data, timestamp=None, sensorid=0) -> None:
+        '''
+        批量写入传感器数据
+        :param index: 传感器索引序列
+        :param data: 传感器数据序列
+        :param timestamp: 时间戳序列或单个时间戳，为None时为当前时间
+        :param sensorid: 传感器ID序列或单个ID
+        :return: None
+        '''
+        if self.closed:
+            raise ValueError("ColumnStore is closed", self.path)
+        index = np.asarray(index, dtype=np.int64)
+        count = index.shape[0]
+        columns = (("index", index), ("value", data),
+                   ("timestamp", time.time() if timestamp is None else timestamp), ("sensor", sensorid))
+        start = 0
+        while start < count:
+            size = min(count - start, self.bufferrows - self.bufferfill)
+            fill = self.bufferfill
+            for name, values in columns:
+                values = np.asarray(values)
+                self.buffers[name][fill:fill + size] = values if values.ndim == 0 else values[start:start + size]
+            self.bufferfill += size
+            start += size
+            if self.bufferfill == self.bufferrows:
+                self.__WriteBuffer()
+        self.pendingrows += count
+        self.rowcount    += count
+        if self.flushrows and self.pendingrows >= self.flushrows:
+            self.Flush()
+        elif self.flushinterval and time.monotonic() - self.flushtime >= self.flushinterval:
+            self.Flush()
+
+    def Flush(self) -> None:
+        '''
+        将内存列缓冲区写入文件
+        :return: None
+        '''
+        if not self.closed:
+            self.__WriteBuffer()
+            for f in self.files.values():
+                f.flush()
+        self.pendingrows = 0
+        self.flushtime   = time.monotonic()
+
+    def Sync(self) -> None:
+        '''
+        刷新缓冲区并将当前块的列文件同步到磁盘（fsync）
+        :return: None
+        '''
+        self.Flush()
+        if not self.closed:
+            for f in self.files.values():
+                os.fsync(f.fileno())
+
+    def CloseFile(self) -> None:
+        '''
+        刷新缓冲区并封存当前块，可以重复调用
+        :return: None
+        '''
+        if not self.closed:
+            self.Flush()
+            self.__SealChunk()
+
+
+class ColumnReader:
+    '''
+    列式二进制存储读取类
+
+    每个块的每列用np.memmap映射，不复制数据；
+    按index或timestamp范围查询时先用目录清单排除不相关的块，
+    块内有序的列用二分查找，无序时才逐行比较。
+    默认只读取目录清单中已封存的块；写入方仍在写的当前块只有在includeopen=True时才读取，
+    其中只包含打开读取方时已经刷新到文件的完整行，之后写入的行需要重新创建读取方才能看到。
+    '''
+    def __init__(self, path: str, includeopen: bool = False):
+        '''
+        初始化方法，读取目录清单
+        :param path: 存储目录
+        :param includeopen: 是否同时读取未封存的当前块中已刷新的行
+        '''
+        self.path = path
+        catalogpath = os.path.join(path, CATALOG_NAME)
+        if includeopen and not os.path.exists(catalogpath):
+            # 还没有封存过块时没有目录清单
+            self.catalog = {"version": CATALOG_VERSION, "columns": dict(COLUMNS), "chunks": []}
+        else:
+            with open(catalogpath, encoding="utf-8") as f:
+                self.catalog = json.load(f)
+        self.columns = self.catalog["columns"]
+        self.chunks = list(self.catalog["chunks"])
+        if includeopen:
+            self.__AddOpenChunk()
+
+    def __AddOpenChunk(self) -> None:
+        '''
+        将未封存的当前块中已刷新的完整行作为最后一个块加入，统计信息由数据计算，私有方法
+        :return: None
+        '''
+        chunkid = self.chunks[-1]["id"] + 1 if self.chunks else 0
+        rows = CommittedRows(self.path, chunkid)
+        if not rows:
+            return
+        entry = {"id": chunkid, "rows": rows, "open": True}
+        self.chunks.append(entry)
+        arrays = self.Chunk(len(self.chunks) - 1)
+        for name in RANGE_COLUMNS:
+            values = arrays[name]
+            entry[name] = [values.min().item(), values.max().item()]
+            entry[name + "_sorted"] = bool(np.all(values[1:] >= values[:-1]))
+
+    def __len__(self) -> int:
+        return sum(chunk["rows"] for chunk in self.chunks)
+
+    def Chunk(self, position: int) -> dict:
+        '''
+        映射一个块的所有列
+        :param position: 块在目录清单中的位置
+        :return: 字典，列名 -> np.memmap
+        '''
+        chunk = self.chunks[position]
+        return {name: np.memmap(ChunkPath(self.path, chunk["id"], name), dtype=dtype, mode="r",
+                                shape=(chunk["rows"],))
+                for name, dtype in self.columns.items()}
+
+    def Column(self, name: str):
+        '''
+        读取所有块的一列
+        :param name: 列名
+        :return: 只有一个块时为np.memmap，否则为拼接后的数组
+        '''
+        arrays = [self.Chunk(position)[name] for position in range(len(self.chunks))]
+        if len(arrays) == 1:
+            return arrays[0]
+        return np.concatenate(arrays) if arrays else np.empty(0, dtype=self.columns[name])
+
+    def ReadRange(self, start=None, stop=None, column: str = "index") -> dict:
+        '''
+        按范围查询，返回start <= column < stop的行
+        :param start: 下界，为None时不限制
+        :param stop: 上界（不包含），为None时不限制
+        :param column: 查询的列，index或timestamp
+        :return: 字典，列名 -> 数组；结果只在一个块内时为np.memmap的切片
+        '''
+        if column not in RANGE_COLUMNS:
+            raise ValueError("Range queries are supported on", RANGE_COLUMNS)
+        parts = []
+        for position, chunk in enumerate(self.chunks):
+            low, high = chunk[column]
+            if (start is not None and high < start) or (stop is not None and low >= stop):
+                continue
+            arrays = self.Chunk(position)
+            key = arrays[column]
+            if chunk[column + "_sorted"]:
+                first = 0 if start is None else int(np.searchsorted(key, start, "left"))
+                last = key.shape[0] if stop is None else int(np.searchsorted(key, stop, "left"))
+                parts.append({name: values[first:last] for name, values in arrays.items()})
+            else:
+                mask = np.ones(key.shape[0], dtype=bool)
+                if start is not None:
+                    mask &= key >= start
+                if stop is not None:
+                    mask &= key < stop
+                parts.append({name: values[mask] for name, values in arrays.items()})
+        if len(parts) == 1:
+            return parts[0]
+        return {name: np.concatenate([part[name] for part in parts]) if parts else np.empty(0, dtype=dtype)
+                for name, dtype in self.columns.items()}
+
+
+if __name__ == "__main__":
+    # 对比CSV与列式二进制存储：写入、全量读取、按index范围查询
+    import csv
+    import tempfile
+    from FileIO import FileIOClass
+
+    count, batch = 2000000, 1000
+    tempdir = tempfile.mkdtemp()
+    index = np.arange(count, dtype=np.int64)
+    data = np.random.default_rng(0).standard_normal(count)
+
+    csvpath = os.path.join(tempdir, "samples.csv")
+    start = time.perf_counter()
+    with FileIOClass(csvpath) as fileio:
+        for i in range(0, count, batch):
+            fileio.WriteFile(index[i:i + batch].tolist(), data[i:i + batch].tolist())
+    csvwrite = time.perf_counter() - start
+
+    storepath = os.path.join(tempdir, "samples")
+    start = time.perf_counter()
+    with ColumnFileIOClass(storepath, chunkrows=1 << 18) as store:
+        for i in range(0, count, batch):
+            store.WriteFile(index[i:i + batch], data[i:i + batch], sensorid=1)
+    binwrite = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(csvpath, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        csvvalues = np.array([float(row[1]) for row in reader])
+    csvread = time.perf_counter() - start
+    start = time.perf_counter()
+    reader = ColumnReader(storepath)
+    binvalues = reader.Column("value")
+    binread = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = reader.ReadRange(1500000, 1500100)
+    query = time.perf_counter() - start
+
+    print("write  csv %6.2f s, binary %6.3f s" % (csvwrite, binwrite))
+    print("read   csv %6.2f s, binary %6.3f s" % (csvread, binread))
+    print("range query of 100 rows in %d chunks : %.3f ms" % (len(reader.chunks), query * 1e3))
+    print("size   csv %6.1f MB, binary %6.1f MB" % (os.path.getsize(csvpath) / 1e6,
+          sum(os.path.getsize(os.path.join(storepath, name)) for name in os.listdir(storepath)) / 1e6))
+    print("values equal :", np.allclose(csvvalues, binvalues), "range ok :",
+          np.array_equal(result["index"], np.arange(1500000, 1500100)))
@@ -9,33 +9,37 @@
 from typing import List
 # 具体实现需要的依赖库
 import math
-import matplotlib.pyplot as plt
 import random
-# 引入枚举类
-from enum import Enum
+import threading
+# 滤波器类、滤波器类型枚举类及注册表
+from Filter import FilterType, FilterRegistry, CreateFilter, MovingAverageArray, MovingAverageFilter
+# 增量统计
+from Statistics import RunningStatistics
 
 
-# 全局变量，记录三个周期的采样值
-FileterLength   = 3
-DataList        = [0] * FileterLength
-def AverageFilter(value):
+# 滤波器对象按(线程, 数据流)保存，替代原来的全局变量DataList/FileterLength
+# 多个传感器线程同时调用AverageFilter时互不干扰，也不需要加锁；
+# 同一线程或事件循环中处理多路传感器时，每路传感器用不同的stream区分
+_AverageFilterLocal = threading.local()
+def AverageFilter(value, FilterLength: int = 3, stream=None):
     '''
     平均值滤波函数，实现三个周期的传感器采样值计算平均值
+    滤波状态按线程和stream隔离，同一线程内相同stream的连续调用构成一个数据流；
+    也可以由调用方为每路传感器创建MovingAverageFilter，或使用MultiChannelAverageFilter一次更新所有通道
     :param value: 当前采样值
+    :param FilterLength: 对多少个点做数据滤波，同一数据流中必须保持不变
+    :param stream: 数据流标识，可以是任意可哈希对象，如传感器ID
     :return: 滤波后的传感器数值
     '''
-    global DataList
-    # 临时变量，存储列表中数据之和
-    sum = 0
-    for i in range(FileterLength-1):
-        # 实现列表的移位操作
-        DataList[i] = DataList[i+1]
-        # 实现列表求和
-        sum += DataList[i]
-    DataList[FileterLength-1] = value
-    sum += DataList[FileterLength-1]
-    average = sum / len(DataList)
-    return average
+    filters = getattr(_AverageFilterLocal, "filters", None)
+    if filters is None:
+        filters = _AverageFilterLocal.filters = {}
+    filterobj = filters.get(stream)
+    if filterobj is None:
+        filterobj = filters[stream] = MovingAverageFilter(FilterLength)
+    elif filterobj.FilterLength != FilterLength:
+        raise ValueError("FilterLength changed for an existing stream", stream, filterobj.FilterLength, FilterLength)
+    return filterobj.push(value)
 
 AverageFilter.description = ("The average value filter function realizes the calculation of the average value "
                              "of the sensor sample value for three periods")
@@ -105,10 +109,7 @@ AverageFilter.description = ("The average value filter function realizes the cal
 #         pass
 
 
-# 滤波器类型枚举类
-class FilterType(Enum):
-    AVERAGEFILTER = 0
-    LPFFILTER = 1
+# 滤波器类型枚举类FilterType已移至Filter.py，与滤波器注册表放在一起
 
 # # 创建一个具体类来继承于DateProcessInterface
 # class DateProcessClass(DateProcessInterface):
@@ -144,9 +145,15 @@ class FilterType(Enum):
 #         min_value = min(self.DateList)
 #         return int(min_value)
 
-# 导入接口相关的第三方拓展库
-from zope.interface import Interface
-from zope.interface.declarations import implementer
+# 导入接口相关的第三方拓展库，zope.interface为可选依赖
+# 未安装时接口只作为文档，implementer不做任何声明
+try:
+    from zope.interface import Interface
+    from zope.interface.declarations import implementer
+except ImportError:
+    Interface = object
+    def implementer(*interfaces):
+        return lambda cls: cls
 
 # 定义接口
 class DateProcessInterface(Interface):
@@ -165,6 +172,15 @@ class DateProcessInterface(Interface):
         '''
         pass
 
+    def SetFilter(self, filtertype: FilterType, **params) -> None:
+        '''
+        抽象方法，运行时选择滤波器
+        :param filtertype: 滤波器类型
+        :param params: 滤波器参数
+        :return: None
+        '''
+        pass
+
     def DateCalMax(self) -> int:
         '''
         抽象方法，计算数据最大值
@@ -182,45 +198,106 @@ class DateProcessInterface(Interface):
 # 使用具体类继承接口
 @implementer(DateProcessInterface)
 class DateProcessClass():
-    def __init__(self, DateList: List[int], FilterLength: int):
+    def __init__(self, DateList: List[int], FilterLength: int,
+                 filtertype: FilterType = FilterType.AVERAGEFILTER, statwindow: int = 10, **params):
         self.DateList = DateList
         self.FilterLength = FilterLength
-        self.TempList = [0] * (self.FilterLength)
+        # 已经完成滤波的数据个数，DateList为RingStore时按累计写入总数计
+        self.__filtertotal = 0
+        # 滤波后数据的增量统计，statwindow为窗口最大/最小值的窗口长度
+        self.statistics = RunningStatistics(statwindow)
+        # 增量流式滤波器，默认为滑动平均，替代原来TempList逐个移位的实现
+        self.SetFilter(filtertype, **params)
+
+    def SetFilter(self, filtertype: FilterType, **params) -> None:
+        '''
+        运行时选择滤波器，不复制DateList中的数据：
+        已经滤波的数据保持不变，之后追加的数据使用新的滤波器
+        :param filtertype: 滤波器类型
+        :param params: 滤波器参数，基于窗口的滤波器默认使用FilterLength
+        :return: None
+        '''
+        cls = FilterRegistry.get(filtertype)
+        if cls is not None and cls.WINDOWED:
+            params.setdefault("FilterLength", self.FilterLength)
+        self.__filter = CreateFilter(filtertype, **params)
+        self.__filterparams = params
+        self.filtertype = filtertype
 
     def DateFilter(self) -> List:
-        # 遍历DateList
-        for index, value in enumerate(self.DateList):
-            # 把每个值都当成传入的新的传感器的值
-            NowValue = value
-            # 表示列表求和的变量
-            sum = 0
-            for i in range(self.FilterLength - 1):
-                # 实现列表的移位操作
-                self.TempList[i] = self.TempList[i + 1]
-                # 实现列表求和
-                sum += self.TempList[i]
-            self.TempList[self.FilterLength - 1] = NowValue
-            sum += self.TempList[self.FilterLength - 1]
-            # 求平均值
-            average = sum / self.FilterLength
-            # 将计算得到的平均值替换原始值
-            self.DateList[index] = average
-        # 计算完成后将TempList中元素清零
-        self.TempList = [0] * (self.FilterLength)
-        return average,self.DateList
+        '''
+        数据滤波，滤波结果原地替换DateList中的原始值，DateList可以是list或RingStore
+        只处理上次调用之后新追加的数据，每个新样本O(1)，
+        多次调用的结果与对整个列表做一次补零滑动平均相同
+        :return: 最新的滤波值, 滤波后的DateList
+        '''
+        # 只对新追加的数据滤波，并将平均值替换原始值
+        start = self.__UnfilteredStart()
+        if start < len(self.DateList):
+            newdata = self.__filter.process(self.DateList[start:])
+            self.DateList[start:] = newdata
+            self.__filtertotal = self.__Total()
+            # 滤波结果同时送入增量统计
+            self.statistics.update(newdata)
+        return self.__filter.value, self.DateList
+
+    def __Total(self) -> int:
+        '''
+        DateList累计写入的数据个数，私有方法
+        list为当前长度，RingStore为包括已被覆盖数据在内的total
+        :return: int
+        '''
+        return getattr(self.DateList, "total", len(self.DateList))
+
+    def __UnfilteredStart(self) -> int:
+        '''
+        返回DateList中尚未滤波数据的起始下标，私有方法
+        列表被清空或截短时，从头开始重新滤波和统计
+        :return: int
+        '''
+        total = self.__Total()
+        if total < self.__filtertotal:
+            self.__filter.reset()
+            self.statistics.reset()
+            self.__filtertotal = 0
+        return max(0, len(self.DateList) - (total - self.__filtertotal))
+
+    def DateFilterArray(self, data=None):
+        '''
+        向量化滤波模式，用于离线处理大批量数据，不修改DateList
+        滑动平均滤波时补零预热方式与DateFilter一致
+        :param data: NumPy数组或支持缓冲区协议的对象，为None时处理DateList
+        :return: 滤波后的float64数组
+        '''
+        if data is None:
+            data = self.DateList
+        if self.filtertype is FilterType.AVERAGEFILTER:
+            return MovingAverageArray(data, self.__filterparams["FilterLength"])
+        # 其他滤波器使用一个新的滤波器对象逐点处理
+        import numpy as np
+        return CreateFilter(self.filtertype, **self.__filterparams).process(np.asarray(data))
 
     def DateCalMax(self) -> int:
-        max_value = max(self.DateList)
+        # 已滤波部分的最大值由增量统计O(1)给出，只需扫描尚未滤波的新数据
+        tail = self.DateList[self.__UnfilteredStart():]
+        if self.statistics.count == 0:
+            return int(max(tail))
+        max_value = max(self.statistics.maximum, max(tail)) if len(tail) else self.statistics.maximum
         return int(max_value)
 
     def DateCalMin(self) -> int:
-        min_value = min(self.DateList)
+        # 已滤波部分的最小值由增量统计O(1)给出，只需扫描尚未滤波的新数据
+        tail = self.DateList[self.__UnfilteredStart():]
+        if self.statistics.count == 0:
+            return int(min(tail))
+        min_value = min(self.statistics.minimum, min(tail)) if len(tail) else self.statistics.minimum
         return int(min_value)
 
-print(type(DateProcessInterface))
-print(type(DateProcessClass), DateProcessClass.__bases__)
-
 if __name__ == '__main__':
+    # 曲线绘图相关库，只有运行本文件时才需要
+    import matplotlib.pyplot as plt
+    print(type(DateProcessInterface))
+    print(type(DateProcessClass), DateProcessClass.__bases__)
     # 创建l的索引列表，主要提供给plot函数作为x轴坐标
     index = [x for x in range(0, 100)]
     # 生成一个正弦序列
@@ -234,7 +311,7 @@ if __name__ == '__main__':
     s = DateProcessClass(signal.copy(), 10)
     print(type(s))
     # 进行数据滤波
-    filtersignal = s.DateFilter()
+    _, filtersignal = s.DateFilter()
     # 曲线绘图
     plt.plot(index, signal, 'b')
     plt.plot(index, filtersignal, 'r')
@@ -0,0 +1,152 @@
+# Python env   :
+# -*- coding: utf-8 -*-
+# @Time    : 2024/6/11 16:18
+# @Author  : 李清水
+# @File    : Decimate.py
+# @Description : 定义了曲线抽取函数MinMaxDecimate和滑动窗口绘图数据类SlidingWindow
+#                只绘制最近window个样本，点数过多时按区间保留最小/最大值，
+#                每帧的计算量只与窗口长度有关，与运行时间无关
+
+# 具体实现需要的依赖库
+import numpy as np
+# 固定容量的环形存储
+from Buffer import RingStore
+
+
+# maxpoints的最小值：区间数为maxpoints//2-2（首尾不足一个区间的部分各占一个区间），至少要有一个区间
+MIN_MAXPOINTS = 6
+
+
+def DecimateBinSize(n: int, maxpoints: int) -> int:
+    '''
+    计算min/max抽取的区间长度，使n个样本抽取后的点数不超过maxpoints
+    :param n: 样本个数
+    :param maxpoints: 输出的最大点数，不少于MIN_MAXPOINTS
+    :return: 区间长度
+    '''
+    if maxpoints < MIN_MAXPOINTS:
+        raise ValueError("maxpoints must be >= %d" % MIN_MAXPOINTS, maxpoints)
+    return max(1, -(-n // (maxpoints // 2 - 2)))
+
+
+def MinMaxDecimate(data, maxpoints: int, start: int = 0, binsize: int = None):
+    '''
+    min/max（峰值检测）抽取：把数据分成若干区间，每个区间只保留最小值和最大值两个点，
+    并按它们在区间中出现的先后顺序排列，窄的尖峰不会因为抽取而消失
+    区间按样本的绝对下标对齐，窗口滑动时已有区间的抽取结果不变，曲线不会抖动
+    :param data: 一维数组
+    :param maxpoints: 输出的最大点数，不少于MIN_MAXPOINTS
+    :param start: data[0]的绝对下标
+    :param binsize: 区间长度，为None时按maxpoints计算
+    :return: (x, y)，x为绝对下标，点数不超过maxpoints时原样返回
+    '''
+    if maxpoints < MIN_MAXPOINTS:
+        raise ValueError("maxpoints must be >= %d" % MIN_MAXPOINTS, maxpoints)
+    data = np.asarray(data)
+    n = data.shape[0]
+    if n <= maxpoints:
+        return np.arange(start, start + n, dtype=np.float64), data
+    if binsize is None:
+        binsize = DecimateBinSize(n, maxpoints)
+    # 窗口首尾不足一个区间的部分也各保留最小/最大值
+    head = min(n, (-start) % binsize)
+    full = (n - head) // binsize
+    segments = []
+    if head:
+        segments.append((start, data[:head].reshape(1, head)))
+    if full:
+        segments.append((start + head, data[head:head + full * binsize].reshape(full, binsize)))
+    tail = head + full * binsize
+    if tail < n:
+        segments.append((start + tail, data[tail:].reshape(1, n - tail)))
+
+    xs, ys = [], []
+    for offset, block in segments:
+        imin = block.argmin(axis=1)
+        imax = block.argmax(axis=1)
+        first = np.minimum(imin, imax)
+        second = np.maximum(imin, imax)
+        rows = np.arange(block.shape[0])
+        base = offset + rows * block.shape[1]
+        x = np.empty(2 * block.shape[0], dtype=np.float64)
+        y = np.empty(2 * block.shape[0], dtype=np.float64)
+        x[0::2] = base + first
+        x[1::2] = base + second
+        y[0::2] = block[rows, first]
+        y[1::2] = block[rows, second]
+        xs.append(x)
+        ys.append(y)
+    return np.concatenate(xs), np.concatenate(ys)
+
+
+class SlidingWindow:
+    '''
+    滑动窗口绘图数据类
+
+    绑定一个RingStore，每帧只取最近window个样本（零拷贝视图），
+    样本数超过maxpoints时用MinMaxDecimate抽取；区间长度在初始化时按window确定，
+    因此窗口写满后每帧输出的点数和计算量都是固定的。
+    样本通过RingStore的append/extend增量追加，不需要重新转换历史数据。
+    '''
+    def __init__(self, store: RingStore = None, window: int = 10000, maxpoints: int = 2000):
+        '''
+        初始化方法
+        :param store: 样本存储，为None时新建一个容量为window的RingStore
+        :param window: 显示的样本个数
+        :param maxpoints: 每帧绘制的最大点数
+        '''
+        self.store      = RingStore(window) if store is None else store
+        self.window     = window
+        self.maxpoints  = maxpoints
+        # 区间长度，保证窗口写满时输出点数不超过maxpoints
+        self.binsize    = DecimateBinSize(window, maxpoints)
+        # 预先分配的下标数组，不抽取时用于生成x
+        self.__index    = np.arange(min(window, maxpoints), dtype=np.float64)
+
+    def append(self, value) -> None:
+        self.store.append(value)
+
+    def extend(self, values) -> None:
+        self.store.extend(values)
+
+    def Render(self):
+        '''
+        计算当前帧需要绘制的数据
+        返回的x、y都是新数组，不与RingStore或上一帧共享内存，可以直接交给无界面模式缓存或导出；
+        不抽取时最多复制maxpoints个点
+        :return: (x, y)，x为样本的绝对下标
+        '''
+        data = self.store.view(self.window)
+        n = data.shape[0]
+        start = self.store.total - n
+        if n <= self.maxpoints:
+            return self.__index[:n] + start, data.copy()
+        return MinMaxDecimate(data, self.maxpoints, start, self.binsize)
+
+
+if __name__ == "__main__":
+    # 对比：每帧setData整个历史列表 与 滑动窗口+抽取 的每帧耗时
+    import time
+
+    window, maxpoints = 10000, 2000
+    history = []
+    store = RingStore(100000)
+    sliding = SlidingWindow(store, window, maxpoints)
+    rng = np.random.default_rng(0)
+    for total in (10000, 100000, 1000000):
+        block = rng.standard_normal(total - len(history))
+        history.extend(block.tolist())
+        store.extend(block)
+        start = time.perf_counter()
+        for _ in range(20):
+            np.asarray(history, dtype=np.float64)
+        full = (time.perf_counter() - start) / 20
+        start = time.perf_counter()
+        for _ in range(20):
+            x, y = sliding.Render()
+        windowed = (time.perf_counter() - start) / 20
+        print("history %8d : full list %8.3f ms/frame, sliding window %6.3f ms/frame, %d points" %
+              (total, full * 1e3, windowed * 1e3, len(y)))
+    # 抽取后保留窗口内的最大/最小值
+    data = store.view(window)
+    print("peak preserved :", y.max() == data.max() and y.min() == data.min())
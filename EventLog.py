@@ -0,0 +1,336 @@
+# Python env   :
+# -*- coding: utf-8 -*-
+# @Time    : 2024/6/7 10:05
+# @Author  : 李清水
+# @File    : EventLog.py
+# @Description : 定义了结构化事件日志类EventLog和事件类Event
+#                SerialClass、SensorClass、MasterClass、PlotClass热路径上的日志改为事件，
+#                只有打开事件日志并且事件级别满足要求时才编码输出，关闭时的开销只有一次属性判断
+
+# 日志级别
+import logging
+# 二进制数据打包/解包
+import struct
+# JSON-lines格式
+import json
+# 多线程写入时保护缓冲区
+from threading import Lock
+# 退出时写出缓冲区
+import atexit
+# 时间操作相关
+import time
+
+# 二进制格式：
+#   文件头        MAGIC(4B) | VERSION(1B)
+#   事件定义记录  0xFFFF(2B) | LEN(2B) | LEN字节的JSON {"id","name","fields","format","level"}
+#   事件记录      ID(2B) | TIMESTAMP(float64) | 按事件定义format打包的字段
+EVENT_MAGIC     = b'EVLG'
+EVENT_VERSION   = 1
+EVENT_HEADER    = struct.Struct('<Hd')
+EVENT_DEFINE    = struct.Struct('<HH')
+EVENT_DEFINE_ID = 0xFFFF
+# 缓冲区超过该字节数时写入文件
+FLUSH_SIZE      = 65536
+
+
+class Event:
+    '''
+    事件类，由EventLog.RegisterEvent创建
+
+    热路径上的用法：
+        if EV_SENSOR_SEND.enabled:
+            EV_SENSOR_SEND.emit(sensorid, data)
+    enabled为False时不会调用emit，也不会构造任何字符串或元组
+    '''
+    __slots__ = ('log', 'id', 'name', 'fields', 'format', 'level', 'enabled', 'struct', 'template')
+
+    def __init__(self, log, id: int, name: str, fields: tuple, format: str, level: int):
+        '''
+        初始化方法
+        :param log: 所属的EventLog对象
+        :param id: 事件编号
+        :param name: 事件名称
+        :param fields: 字段名元组
+        :param format: 字段的struct格式字符，每个字段一个字符
+        :param level: 事件级别，与logging的级别相同
+        '''
+        if len(format) != len(fields):
+            raise ValueError("format must have one character per field", format, fields)
+        self.log        = log
+        self.id         = id
+        self.name       = name
+        self.fields     = tuple(fields)
+        self.format     = format
+        self.level      = level
+        self.enabled    = False
+        # 事件头和字段一次打包
+        self.struct     = struct.Struct(EVENT_HEADER.format + format)
+        # JSON-lines模板，只含整数字段时直接用%格式化，含浮点字段时用json.dumps
+        if all(char in 'bBhHiIlLqQ?' for char in format):
+            self.template = ('{"t":%r,"event":"' + name + '"' +
+                             ''.join(',"%s":%%d' % field for field in fields) + '}\n')
+        else:
+            self.template = None
+
+    def emit(self, *values) -> None:
+        '''
+        记录一次事件
+        :param values: 按fields顺序排列的字段值
+        :return: None
+        '''
+        self.log.Write(self, values)
+
+
+class EventLog:
+    '''
+    结构化事件日志类
+
+    事件先注册（名称、字段、格式、级别），记录时只保存时间戳和字段值，
+    不格式化成可读字符串；可选紧凑的二进制格式或JSON-lines格式，
+    记录追加到内存缓冲区，超过FLUSH_SIZE字节或关闭时才写入文件。
+    未打开或事件级别低于日志级别时，事件的enabled为False，调用处直接跳过。
+    '''
+    # 类变量：
+    #   JSONL_FORMAT  - JSON-lines格式，每个事件一行  -0
+    #   BINARY_FORMAT - 二进制格式                    -1
+    JSONL_FORMAT, BINARY_FORMAT = (0, 1)
+
+    def __init__(self, level: int = logging.DEBUG):
+        '''
+        初始化方法
+        :param level: 日志级别，低于该级别的事件不记录
+        '''
+        self.level      = level
+        self.path       = None
+        self.format     = EventLog.JSONL_FORMAT
+        # 已注册的事件，下标为事件编号
+        self.events     = []
+        self.__file     = None
+        self.__buffer   = bytearray()
+        self.__lock     = Lock()
+
+    @property
+    def opened(self) -> bool:
+        return self.__file is not None
+
+    def RegisterEvent(self, name: str, fields: tuple = (), format: str = None, level: int = logging.DEBUG) -> Event:
+        '''
+        注册一个事件
+        :param name: 事件名称
+        :param fields: 字段名元组
+        :param format: 字段的struct格式字符，为None时所有字段为int32
+        :param level: 事件级别
+        :return: Event对象
+        '''
+        if len(self.events) >= EVENT_DEFINE_ID:
+            raise ValueError("too many events")
+        event = Event(self, len(self.events), name, fields, 'i' * len(fields) if format is None else format, level)
+        self.events.append(event)
+        if self.opened:
+            self.__Define(event)
+            event.enabled = event.level >= self.level
+        return event
+
+    def SetLevel(self, level: int) -> None:
+        '''
+        设置日志级别，更新每个事件的enabled
+        :param level: 日志级别
+        :return: None
+        '''
+        self.level = level
+        opened = self.opened
+        for event in self.events:
+            event.enabled = opened and event.level >= level
+
+    def Open(self, path: str, format: int = JSONL_FORMAT) -> None:
+        '''
+        打开事件日志文件，已有内容会被覆盖
+        :param path: 文件路径
+        :param format: JSONL_FORMAT或BINARY_FORMAT
+        :return: None
+        '''
+        self.Close()
+        self.path = path
+        self.format = format
+        if format == EventLog.BINARY_FORMAT:
+            self.__file = open(path, "wb")
+            self.__buffer += EVENT_MAGIC + bytes([EVENT_VERSION])
+        else:
+            self.__file = open(path, "w", encoding="utf-8")
+        for event in self.events:
+            self.__Define(event)
+        self.SetLevel(self.level)
+        atexit.register(self.Close)
+
+    def Close(self) -> None:
+        '''
+        写出缓冲区并关闭文件，之后所有事件的enabled为False
+        :return: None
+        '''
+        if self.__file is None:
+            return
+        for event in self.events:
+            event.enabled = False
+        self.Flush()
+        self.__file.close()
+        self.__file = None
+        atexit.unregister(self.Close)
+
+    def __Define(self, event: Event) -> None:
+        '''
+        写入事件定义，私有方法
+        :param event: Event对象
+        :return: None
+        '''
+        definition = {"id": event.id, "name": event.name, "fields": list(event.fields),
+                      "format": event.format, "level": event.level}
+        with self.__lock:
+            if self.format == EventLog.BINARY_FORMAT:
+                data = json.dumps(definition).encode()
+                self.__buffer += EVENT_DEFINE.pack(EVENT_DEFINE_ID, len(data)) + data
+            else:
+                self.__buffer += (json.dumps({"define": definition}) + "\n").encode()
+
+    def Write(self, event: Event, values: tuple) -> None:
+        '''
+        编码一条事件记录并追加到缓冲区，由Event.emit调用
+        :param event: Event对象
+        :param values: 字段值元组
+        :return: None
+        '''
+        timestamp = time.time()
+        if self.format == EventLog.BINARY_FORMAT:
+            record = event.struct.pack(event.id, timestamp, *values)
+        elif event.template is not None:
+            record = (event.template % ((timestamp,) + values)).encode()
+        else:
+            record = (json.dumps(dict(zip(event.fields, values), t=timestamp, event=event.name)) + "\n").encode()
+        with self.__lock:
+            self.__buffer += record
+            if len(self.__buffer) >= FLUSH_SIZE:
+                self.__WriteBuffer()
+
+    def __WriteBuffer(self) -> None:
+        '''
+        将缓冲区写入文件，调用时需持有锁，私有方法
+        :return: None
+        '''
+        if self.__file is None or not self.__buffer:
+            return
+        if self.format == EventLog.BINARY_FORMAT:
+            self.__file.write(self.__buffer)
+        else:
+            self.__file.write(self.__buffer.decode())
+        self.__buffer.clear()
+
+    def Flush(self) -> None:
+        '''
+        将缓冲区写入文件
+        :return: None
+        '''
+        with self.__lock:
+            self.__WriteBuffer()
+            if self.__file is not None:
+                self.__file.flush()
+
+
+def ReadEvents(path: str):
+    '''
+    读取事件日志文件，自动识别二进制格式和JSON-lines格式
+    :param path: 文件路径
+    :return: 生成器，每个事件为字典{"t", "event", 字段名: 字段值}
+    '''
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(EVENT_MAGIC):
+        for line in data.decode("utf-8").splitlines():
+            record = json.loads(line)
+            if "define" not in record:
+                yield record
+        return
+    offset = len(EVENT_MAGIC) + 1
+    # 事件编号 -> (名称, 字段名, Struct)
+    definitions = {}
+    while offset < len(data):
+        (id,) = struct.unpack_from('<H', data, offset)
+        if id == EVENT_DEFINE_ID:
+            _, length = EVENT_DEFINE.unpack_from(data, offset)
+            offset += EVENT_DEFINE.size
+            definition = json.loads(data[offset:offset + length])
+            definitions[definition["id"]] = (definition["name"], definition["fields"],
+                                             struct.Struct(EVENT_HEADER.format + definition["format"]))
+            offset += length
+            continue
+        name, fields, recordstruct = definitions[id]
+        values = recordstruct.unpack_from(data, offset)
+        offset += recordstruct.size
+        record = {"t": values[1], "event": name}
+        record.update(zip(fields, values[2:]))
+        yield record
+
+
+# 各模块共用的事件日志对象，默认不打开，所有事件的enabled为False
+eventlog = EventLog()
+
+
+if __name__ == "__main__":
+    # 对比每个样本的日志开销：立即格式化的字符串、延迟格式化的logging、事件（关闭/打开）
+    import os
+    import tempfile
+
+    count = 200000
+    tempdir = tempfile.mkdtemp()
+    sensorid, data = 3, 42
+
+    logger = logging.getLogger("bench")
+    logger.propagate = False
+    logger.addHandler(logging.NullHandler())
+
+    def Bench(name, func, baseline=0.0):
+        start = time.perf_counter()
+        func()
+        pertime = (time.perf_counter() - start) / count * 1e9
+        print("%-40s : %8.1f ns/sample, overhead %8.1f ns" % (name, pertime, pertime - baseline))
+        return pertime
+
+    def Baseline():
+        for i in range(count):
+            pass
+    def EagerDisabled():
+        for i in range(count):
+            logger.info("Sensor %d send data  %d" % (sensorid, i))
+    def LazyDisabled():
+        for i in range(count):
+            logger.info("Sensor %d send data  %d", sensorid, i)
+    def EagerEnabled():
+        for i in range(count):
+            logger.info("Sensor %d send data  %d" % (sensorid, i))
+
+    ev = eventlog.RegisterEvent("SensorSendData", ("sensorid", "data"))
+    def EventGuarded():
+        for i in range(count):
+            if ev.enabled:
+                ev.emit(sensorid, i)
+
+    baseline = Bench("empty loop", Baseline)
+    logger.setLevel(logging.WARNING)
+    Bench("logging eager %-format, disabled", EagerDisabled, baseline)
+    Bench("logging lazy args, disabled", LazyDisabled, baseline)
+    Bench("event, disabled", EventGuarded, baseline)
+    logger.setLevel(logging.INFO)
+    filehandler = logging.FileHandler(os.path.join(tempdir, "bench.log"))
+    logger.addHandler(filehandler)
+    Bench("logging eager %-format, FileHandler", EagerEnabled, baseline)
+    logger.removeHandler(filehandler)
+    filehandler.close()
+    eventlog.Open(os.path.join(tempdir, "events.jsonl"), EventLog.JSONL_FORMAT)
+    Bench("event, JSON-lines", EventGuarded, baseline)
+    eventlog.Close()
+    eventlog.Open(os.path.join(tempdir, "events.bin"), EventLog.BINARY_FORMAT)
+    Bench("event, binary", EventGuarded, baseline)
+    eventlog.Close()
+
+    for name in ("bench.log", "events.jsonl", "events.bin"):
+        print("%-14s : %6.2f MB" % (name, os.path.getsize(os.path.join(tempdir, name)) / 1e6))
+    records = list(ReadEvents(os.path.join(tempdir, "events.bin")))
+    print("binary records read back : %d, last %s" % (len(records), records[-1]))
@@ -5,69 +5,462 @@
 # @Author  : 李清水
 # @File    : FileIO.py
 # @Description : 定义了FileIOClass的属性和方法
+#                文件以追加模式打开并一直保持打开，数据经大缓冲区批量写入，
+#                按行数、时间间隔和关闭时三种策略刷新到磁盘
+#                定义了后台写文件类AsyncFileIOClass，由单独的写线程批量提交，采集线程不等待磁盘
 
 # 日志输出相关库
 import logging
 # 文件读写相关库
 import csv
+# 时间操作相关，按时间间隔刷新
+import time
+# 文件同步到磁盘
+import os
+# 后台写线程及其有界队列
+from threading import Thread, Condition
+from collections import deque
+# 溢出的数据暂存到临时文件
+import pickle
+import tempfile
+# 退出时写完队列中的数据
+import atexit
 # 使用typing模块提供的复合注解功能
 from typing import List
 
-# 日志设置
-LOG_FORMAT="%(asctime)s-%(levelname)s-%(message)s"
-logging.basicConfig(filename='my.log',level=logging.DEBUG,format=LOG_FORMAT)
 
 class FileIOClass:
-    def __init__(self,path:str="G:\\Python面向对象编程\\Demo\\file.csv"):
+    def __init__(self,path:str="G:\\Python面向对象编程\\Demo\\file.csv",buffersize:int=1<<20,flushrows:int=10000,flushinterval:float=1000):
         '''
-        初始化csv文件和列标题
+        以追加模式打开csv文件，文件为空时写入列标题，打开失败时记录日志后抛出原来的异常
+        文件在CloseFile之前一直保持打开，可以多次调用WriteFile
         :param path: 文件路径和文件名
+        :param buffersize: 写缓冲区大小，单位字节
+        :param flushrows: 每写入多少行刷新一次，为0时不按行数刷新
+        :param flushinterval: 距离上次刷新超过多少毫秒时刷新，为0时不按时间刷新；
+                              只在写入时检查，停止写入后剩余的数据要等下次写入、Flush或CloseFile，
+                              由AsyncFileIOClass包装时写线程空闲时也会按该间隔刷新
         '''
-        self.path   = path
+        self.path          = path
+        self.flushrows     = flushrows
+        self.flushinterval = flushinterval / 1000
+        # 上次刷新之后写入的行数和上次刷新的时间
+        self.pendingrows   = 0
+        self.flushtime     = time.monotonic()
+        # 累计写入的行数
+        self.rowcount      = 0
+        self.csvFile       = None
+        self.writer        = None
+        # rowname为列名，index-索引，data-数据
+        self.rowname = ['index', 'data']
         try:
             # path为输出路径和文件名，newline=''是为了不出现空行
-            self.csvFile = open(path, "w+", newline='')
-            # rowname为列名，index-索引，data-数据
-            self.rowname = ['index', 'data']
+            self.csvFile = open(path, "a", newline='', buffering=buffersize)
             # 返回一个writer对象，将用户的数据在给定的文件型对象上转换为带分隔符的字符串
             self.writer = csv.writer(self.csvFile)
-            # 写入csv文件的列标题
-            self.writer.writerow(self.rowname)
-        except (FileNotFoundError, IOError) as e:
-            print("Could not open file",e.__class__.__name__)
-            print("The exception arguments were", e.args)
-            logging.info("Could not open file")
+            # 新文件写入csv文件的列标题，追加到已有文件时不重复写入
+            if self.csvFile.tell() == 0:
+                self.writer.writerow(self.rowname)
+        except (FileNotFoundError, IOError):
+            # 记录后继续抛出，打开失败的对象不能再用于写入
+            logging.exception("Could not open file %s", path)
+            raise
         except KeyboardInterrupt:
-            print("Cancell the file operation")
             logging.info("Cancell the file operation")
-        finally:
-                self.CloseFile()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.CloseFile()
+        return False
+
+    @property
+    def closed(self) -> bool:
+        return self.csvFile is None or self.csvFile.closed
 
     def WriteFile(self,index:List[int],data:List[int])->None:
         '''
+        批量写入传感器数据，每个索引和数据组成一行
         :param index: 传感器索引列表
         :param data:  传感器数据列表
         :return:
         '''
-        writedatalist = []
+        self.WriteRows(zip(index, data))
+
+    def WriteRows(self,rows)->None:
+        '''
+        用writerows批量写入多行，写入后按刷新策略决定是否刷新
+        文件已关闭时抛出ValueError，写入失败时记录日志后抛出原来的异常
+        :param rows: 可迭代对象，每个元素为一行
+        :return:
+        '''
+        if self.closed:
+            # 文件没有打开或已经关闭
+            raise ValueError("File is closed", self.path)
         try:
-            for i in range(len(data)):
-                writedatalist.append([index[i],data[i]])
-                # 将列表中的每个元素将被写入CSV文件的一列中
-                self.writer.writerow(writedatalist[i])
-        except (FileNotFoundError, IOError):
-            print("Could not open file")
-            logging.info("Could not open file")
+            if not isinstance(rows, (list, tuple)):
+                rows = list(rows)
+            self.writer.writerows(rows)
+            self.pendingrows += len(rows)
+            self.rowcount    += len(rows)
+            if self.flushrows and self.pendingrows >= self.flushrows:
+                self.Flush()
+            elif self.flushinterval and time.monotonic() - self.flushtime >= self.flushinterval:
+                self.Flush()
+        except (FileNotFoundError, IOError) as e:
+            # 记录后继续抛出，调用方（包括AsyncFileIOClass的写线程）需要知道这批数据没有写入
+            logging.error("Could not write file %s : %s", self.path, e)
+            raise
         except KeyboardInterrupt:
-            print("Cancell the file operation")
             logging.info("Cancell the file operation")
-        finally:
-                self.CloseFile()
+            raise
+
+    def Flush(self)->None:
+        '''
+        将缓冲区中的数据写入文件
+        :return: None
+        '''
+        if not self.closed:
+            self.csvFile.flush()
+        self.pendingrows = 0
+        self.flushtime   = time.monotonic()
+
+    def Sync(self)->None:
+        '''
+        刷新缓冲区并将文件同步到磁盘（fsync）
+        :return: None
+        '''
+        self.Flush()
+        if not self.closed:
+            os.fsync(self.csvFile.fileno())
 
     def CloseFile(self)->None:
         '''
-        关闭文件
+        刷新缓冲区并关闭文件，可以重复调用；刷新失败时文件同样被关闭，再抛出异常
         :return: None
         '''
-        self.csvFile.close()
+        if not self.closed:
+            try:
+                self.Flush()
+            finally:
+                self.csvFile.close()
+
+
+class AsyncFileIOClass:
+    '''
+    后台写文件类
+
+    包装一个FileIOClass（或接口相同的ColumnFileIOClass），WriteFile只把数据放入有界队列就返回，
+    由单独的写线程取出队列中已有的所有批次（最多groupsize个）一起写入，再按持久性级别提交一次，
+    多个批次共用一次flush/fsync（组提交）。队列满时的处理策略：
+        BLOCK_POLICY       —— 等待写线程腾出空间
+        DROP_OLDEST_POLICY —— 丢弃队列中最旧的批次
+        SPILL_POLICY       —— 暂存到临时文件，写线程按顺序补写
+    持久性级别：
+        NONE_DURABILITY    —— 只写入文件对象，由被包装对象的刷新策略决定何时写入文件
+        FLUSH_DURABILITY   —— 每次提交后flush到操作系统
+        FSYNC_DURABILITY   —— 每次提交后fsync到磁盘
+    NONE_DURABILITY下被包装对象有flushinterval时，写线程空闲等待期间也按该间隔刷新未刷新的行，
+    数据停止到达后不会一直留在缓冲区中
+    '''
+    # 类变量：
+    #   BLOCK_POLICY        - 阻塞等待    -0
+    #   DROP_OLDEST_POLICY  - 丢弃最旧的  -1
+    #   SPILL_POLICY        - 溢出到文件  -2
+    BLOCK_POLICY, DROP_OLDEST_POLICY, SPILL_POLICY = (0, 1, 2)
+    # 类变量：
+    #   NONE_DURABILITY     - 不主动刷新  -0
+    #   FLUSH_DURABILITY    - flush       -1
+    #   FSYNC_DURABILITY    - fsync       -2
+    NONE_DURABILITY, FLUSH_DURABILITY, FSYNC_DURABILITY = (0, 1, 2)
+
+    def __init__(self,fileio,maxsize:int=1024,policy:int=BLOCK_POLICY,durability:int=FLUSH_DURABILITY,groupsize:int=256,spillpath:str=None):
+        '''
+        初始化方法，启动写线程
+        :param fileio: 被包装的写文件对象，需要WriteFile、Flush、Sync和CloseFile方法
+        :param maxsize: 队列中最多保存的批次个数
+        :param policy: 队列满时的处理策略
+        :param durability: 每次提交的持久性级别
+        :param groupsize: 每次提交最多写入的批次个数
+        :param spillpath: SPILL_POLICY的暂存文件路径，为None时使用匿名临时文件
+        '''
+        if policy not in (AsyncFileIOClass.BLOCK_POLICY, AsyncFileIOClass.DROP_OLDEST_POLICY, AsyncFileIOClass.SPILL_POLICY):
+            raise ValueError("Invalid policy", policy)
+        self.fileio     = fileio
+        self.maxsize    = maxsize
+        self.policy     = policy
+        self.durability = durability
+        self.groupsize  = groupsize
+        # 队列中的每个元素为(入队时间, WriteFile的参数, 关键字参数)
+        self.__queue    = deque()
+        self.__cond     = Condition()
+        self.__running  = True
+        # 暂存文件、其中尚未补写的批次个数和读取位置
+        self.__spillfile  = None
+        self.__spillpath  = spillpath
+        self.__spillcount = 0
+        self.__spillread  = 0
+        # 写线程已经取出、正在写入的批次个数
+        self.__inflight   = 0
+        # 运行指标：已提交的批次数、提交次数、丢弃和暂存的批次数、队列最大深度、
+        #          最近一次提交的写入耗时(s)、数据从入队到提交的最近/最大延迟(s)
+        self.written    = 0
+        self.commits    = 0
+        self.dropped    = 0
+        self.spilled    = 0
+        self.maxdepth   = 0
+        self.writetime  = 0.0
+        self.latency    = 0.0
+        self.maxlatency = 0.0
+        # 写文件异常，写线程遇到异常后停止，之后的WriteFile会抛出该异常
+        self.error      = None
+        self.__thread   = Thread(target=self.__Run, name="FileWriter", daemon=True)
+        self.__thread.start()
+        atexit.register(self.CloseFile)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.CloseFile()
+        return False
+
+    @property
+    def depth(self) -> int:
+        '''
+        队列中等待写入的批次个数，包括暂存到文件的批次
+        :return: int
+        '''
+        return len(self.__queue) + self.__spillcount
+
+    def WriteFile(self,*args,**kwargs)->None:
+        '''
+        将一批数据放入队列，参数与被包装对象的WriteFile相同
+        调用后不要再修改传入的列表或数组，写线程写入时才读取
+        :return: None
+        '''
+        item = (time.perf_counter(), args, kwargs)
+        with self.__cond:
+            if self.error is not None:
+                raise self.error
+            if not self.__running:
+                raise ValueError("AsyncFileIOClass is closed")
+            if self.__spillcount or len(self.__queue) >= self.maxsize:
+                if self.policy == AsyncFileIOClass.BLOCK_POLICY:
+                    while len(self.__queue) >= self.maxsize and self.error is None:
+                        self.__cond.wait()
+                    if self.error is not None:
+                        raise self.error
+                elif self.policy == AsyncFileIOClass.DROP_OLDEST_POLICY:
+                    self.__queue.popleft()
+                    self.dropped += 1
+                else:
+                    # 开始暂存后新数据也写入暂存文件，保证写入顺序不变
+                    self.__Spill(item)
+                    return
+            self.__queue.append(item)
+            self.maxdepth = max(self.maxdepth, len(self.__queue))
+            if len(self.__queue) == 1:
+                self.__cond.notify_all()
+
+    def __Spill(self,item)->None:
+        '''
+        将一批数据追加到暂存文件，调用时需持有锁，私有方法
+        :param item: 队列元素
+        :return: None
+        '''
+        if self.__spillfile is None:
+            if self.__spillpath is None:
+                self.__spillfile = tempfile.TemporaryFile()
+            else:
+                self.__spillfile = open(self.__spillpath, "w+b")
+        self.__spillfile.seek(0, os.SEEK_END)
+        pickle.dump(item, self.__spillfile, pickle.HIGHEST_PROTOCOL)
+        self.__spillcount += 1
+        self.spilled += 1
+        if self.__spillcount == 1 and not self.__queue:
+            self.__cond.notify_all()
+
+    def __TakeGroup(self) -> list:
+        '''
+        等待并取出一组批次：先取内存队列，内存队列为空时按顺序读回暂存的批次，私有方法
+        :return: 批次列表，关闭且没有剩余数据时为空列表
+        '''
+        with self.__cond:
+            while self.__running and not self.__queue and not self.__spillcount:
+                timeout = self.__IdleFlushTimeout()
+                if timeout is not None and timeout <= 0:
+                    self.__IdleFlush()
+                    continue
+                self.__cond.wait(timeout)
+            if self.error is not None:
+                return []
+            group = []
+            while self.__queue and len(group) < self.groupsize:
+                group.append(self.__queue.popleft())
+            if not group and self.__spillcount:
+                self.__spillfile.flush()
+                self.__spillfile.seek(self.__spillread)
+                while self.__spillcount and len(group) < self.groupsize:
+                    group.append(pickle.load(self.__spillfile))
+                    self.__spillcount -= 1
+                self.__spillread = self.__spillfile.tell()
+                if self.__spillcount == 0:
+                    self.__spillfile.seek(0)
+                    self.__spillfile.truncate()
+                    self.__spillread = 0
+            self.__inflight = len(group)
+            # 唤醒等待空间的WriteFile
+            self.__cond.notify_all()
+            return group
+
+    def __IdleFlushTimeout(self):
+        '''
+        计算写线程空闲时距离下次按时间刷新还有多少秒，调用时需持有锁，私有方法
+        :return: 秒数，被包装对象没有未刷新的行或不按时间刷新时为None
+        '''
+        interval = getattr(self.fileio, "flushinterval", 0)
+        if not interval or not getattr(self.fileio, "pendingrows", 0):
+            return None
+        return self.fileio.flushtime + interval - time.monotonic()
+
+    def __IdleFlush(self)->None:
+        '''
+        写线程空闲时刷新被包装对象，调用时需持有锁，私有方法
+        :return: None
+        '''
+        try:
+            self.fileio.Flush()
+        except Exception as e:
+            logging.error("FileWriter stopped: %r", e)
+            self.error = e
+            self.__running = False
+            self.__cond.notify_all()
+
+    def __Run(self)->None:
+        '''
+        写线程：组提交队列中的数据，私有方法
+        :return: None
+        '''
+        while True:
+            group = self.__TakeGroup()
+            if not group:
+                return
+            start = time.perf_counter()
+            try:
+                for _, args, kwargs in group:
+                    self.fileio.WriteFile(*args, **kwargs)
+                if self.durability == AsyncFileIOClass.FSYNC_DURABILITY:
+                    self.fileio.Sync()
+                elif self.durability == AsyncFileIOClass.FLUSH_DURABILITY:
+                    self.fileio.Flush()
+            except Exception as e:
+                logging.error("FileWriter stopped: %r", e)
+                with self.__cond:
+                    self.error = e
+                    self.__running = False
+                    self.__cond.notify_all()
+                return
+            now = time.perf_counter()
+            with self.__cond:
+                self.writetime  = now - start
+                self.latency    = now - group[0][0]
+                self.maxlatency = max(self.maxlatency, self.latency)
+                self.written   += len(group)
+                self.commits   += 1
+                self.__inflight = 0
+                self.__cond.notify_all()
+
+    def Metrics(self) -> dict:
+        '''
+        返回后台写线程的运行指标
+        :return: 字典
+        '''
+        return {"depth": self.depth, "maxdepth": self.maxdepth, "written": self.written,
+                "commits": self.commits, "dropped": self.dropped, "spilled": self.spilled,
+                "writetime": self.writetime, "latency": self.latency, "maxlatency": self.maxlatency}
+
+    def Flush(self)->None:
+        '''
+        等待队列中已有的数据全部写入并刷新
+        :return: None
+        '''
+        with self.__cond:
+            while (self.__queue or self.__spillcount or self.__inflight) and self.error is None:
+                self.__cond.wait()
+            if self.error is not None:
+                raise self.error
+            # 持有锁时写线程不会开始新的一组，可以安全地刷新
+            self.fileio.Flush()
+
+    def CloseFile(self)->None:
+        '''
+        写完队列中剩余的数据，停止写线程并关闭被包装的文件，可以重复调用
+        :return: None
+        '''
+        with self.__cond:
+            self.__running = False
+            self.__cond.notify_all()
+        self.__thread.join()
+        if self.__spillfile is not None:
+            self.__spillfile.close()
+            self.__spillfile = None
+        try:
+            self.fileio.CloseFile()
+        finally:
+            atexit.unregister(self.CloseFile)
+
+
+if __name__ == "__main__":
+    # 对比：逐行writerow并且每次写入都重新打开文件 与 持久句柄+writerows批量写入
+    import os
+    import tempfile
+
+    count, batch = 1000000, 1000
+    tempdir = tempfile.mkdtemp()
+    index = list(range(count))
+    data = [i % 100 for i in range(count)]
+
+    path = os.path.join(tempdir, "rowbyrow.csv")
+    start = time.perf_counter()
+    for i in range(0, count, batch):
+        with open(path, "a", newline='') as f:
+            writer = csv.writer(f)
+            for j in range(i, i + batch):
+                writer.writerow([index[j], data[j]])
+    rowbyrow = time.perf_counter() - start
+
+    path = os.path.join(tempdir, "batched.csv")
+    start = time.perf_counter()
+    with FileIOClass(path) as fileio:
+        for i in range(0, count, batch):
+            fileio.WriteFile(index[i:i + batch], data[i:i + batch])
+    batched = time.perf_counter() - start
+
+    print("reopen + writerow   : %6.2f s, %8.2f M rows/min" % (rowbyrow, count / rowbyrow * 60 / 1e6))
+    print("persistent writerows: %6.2f s, %8.2f M rows/min" % (batched, count / batched * 60 / 1e6))
+    with open(path, newline='') as f:
+        print("rows written :", sum(1 for _ in f) - 1)
 
+    # 对比：采集路径上每个样本同步写入并fsync 与 放入后台写线程的队列（组提交，每次提交fsync）
+    count = 2000
+    path = os.path.join(tempdir, "sync.csv")
+    with FileIOClass(path) as fileio:
+        start = time.perf_counter()
+        for i in range(count):
+            fileio.WriteFile((i,), (i % 100,))
+            fileio.Sync()
+        synctime = time.perf_counter() - start
+    path = os.path.join(tempdir, "async.csv")
+    with AsyncFileIOClass(FileIOClass(path), durability=AsyncFileIOClass.FSYNC_DURABILITY) as writer:
+        start = time.perf_counter()
+        for i in range(count):
+            writer.WriteFile((i,), (i % 100,))
+        asynctime = time.perf_counter() - start
+        writer.Flush()
+        metrics = writer.Metrics()
+    print("sync write+fsync   : %8.1f us/sample" % (synctime / count * 1e6))
+    print("async enqueue      : %8.1f us/sample, %d commits, max latency %.1f ms" %
+          (asynctime / count * 1e6, metrics["commits"], metrics["maxlatency"] * 1e3))
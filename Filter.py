@@ -0,0 +1,645 @@
+# Python env   :
+# -*- coding: utf-8 -*-
+# @Time    : 2024/5/20 10:12
+# @Author  : 李清水
+# @File    : Filter.py
+# @Description : 定义了流式滤波器类，供DateProcessClass、MasterProcess等复用
+#                本模块只依赖标准库，NumPy仅在向量化批处理时才导入，
+#                工作进程导入时不会加载绘图等重量级依赖
+
+# 使用typing模块提供的复合注解功能
+from typing import List, Iterable
+# 具体实现需要的依赖库
+import math
+import heapq
+import sys
+import array
+from collections import deque
+# 引入枚举类
+from enum import Enum
+# 抽象基类
+from abc import ABC, abstractmethod
+
+# 向量化滤波时分块处理的长度：
+#   限制前缀和的数值范围（减小浮点误差），同时让临时数组留在缓存中
+ARRAY_BLOCK_SIZE = 1 << 16
+# memoryview中可以按数值处理的struct格式字符
+NUMERIC_FORMATS = set("bBhHiIlLqQnNefd")
+
+
+def IsBufferObject(obj) -> bool:
+    '''
+    判断对象是否可以走NumPy向量化路径：NumPy数组、array.array或一维数值memoryview；
+    bytes、bytearray等其他对象按普通可迭代对象处理
+    :param obj: 待判断的对象
+    :return: bool
+    '''
+    if isinstance(obj, array.array):
+        return True
+    if isinstance(obj, memoryview):
+        return obj.ndim == 1 and obj.format.lstrip("@=<>!") in NUMERIC_FORMATS
+    # 未导入NumPy时不可能是NumPy数组，避免为了判断类型而导入NumPy
+    np = sys.modules.get("numpy")
+    return np is not None and isinstance(obj, np.ndarray)
+
+
+def MovingAverageArray(data, FilterLength: int, method: str = "cumsum"):
+    '''
+    向量化的补零滑动平均滤波，结果与DateProcessClass.DateFilter逐点计算一致
+    :param data: 一维NumPy数组或支持缓冲区协议的对象
+    :param FilterLength: 对多少个点做数据滤波
+    :param method: "cumsum"-分块前缀和，O(n)；"convolve"-卷积，适合滤波长度较小的情况
+    :return: 滤波后的float64数组
+    '''
+    import numpy as np
+
+    if FilterLength < 1:
+        raise ValueError("FilterLength must be >= 1", FilterLength)
+    x = np.asarray(data)
+    if x.ndim != 1:
+        raise ValueError("data must be one-dimensional", x.shape)
+    n = x.shape[0]
+    length = FilterLength
+    out = np.empty(n, dtype=np.float64)
+
+    if method == "convolve":
+        # 取完整卷积的前n个点，即为补零后的滑动和
+        out[:] = np.convolve(x.astype(np.float64, copy=False), np.ones(length), "full")[:n]
+        out /= length
+        return out
+    if method != "cumsum":
+        raise ValueError("unknown method", method)
+
+    # 整数数据用int64求前缀和，结果是精确的
+    acc = np.int64 if x.dtype.kind in "biu" else np.float64
+    block = max(ARRAY_BLOCK_SIZE, length)
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        # 每块向前多取FilterLength-1个点，块内前缀和只依赖本块数据
+        low = max(0, start - length + 1)
+        prefix = np.cumsum(x[low:stop], dtype=acc)
+        # 对i∈[start,stop)：窗口和 = prefix[i-low] - prefix[i-length-low]（下标越界时减0）
+        window = prefix[start - low:].astype(np.float64)
+        first = max(start, low + length)
+        if first < stop:
+            window[first - start:] -= prefix[first - length - low:stop - length - low]
+        np.divide(window, length, out=out[start:stop])
+    return out
+
+
+# 滤波器类型枚举类
+class FilterType(Enum):
+    AVERAGEFILTER = 0
+    LPFFILTER     = 1
+    MEDIANFILTER  = 2
+    EMAFILTER     = 3
+    KALMANFILTER  = 4
+
+
+# 滤波器注册表：FilterType -> 滤波器类
+FilterRegistry = {}
+
+def RegisterFilter(filtertype: FilterType):
+    '''
+    类装饰器，将滤波器类注册到FilterRegistry中
+    :param filtertype: 滤波器类型
+    :return: 装饰器
+    '''
+    def decorator(cls):
+        FilterRegistry[filtertype] = cls
+        cls.filtertype = filtertype
+        return cls
+    return decorator
+
+def CreateFilter(filtertype: FilterType, **params):
+    '''
+    根据滤波器类型创建滤波器对象
+    :param filtertype: 滤波器类型
+    :param params: 传给滤波器类初始化方法的参数
+    :return: 滤波器对象
+    '''
+    try:
+        cls = FilterRegistry[filtertype]
+    except KeyError:
+        raise ValueError("Unregistered filter type", filtertype) from None
+    return cls(**params)
+
+
+class StreamFilter(ABC):
+    '''
+    流式滤波器基类，定义了所有滤波器共同的接口：
+        push    —— 输入一个采样值，返回滤波后的数值
+        process —— 对一批数据滤波，状态延续到下一次调用
+        reset   —— 清空滤波器状态
+    '''
+    # 是否为基于窗口的滤波器，为True时初始化方法接收FilterLength参数
+    WINDOWED = False
+
+    def __init__(self):
+        # 最近一次滤波输出
+        self.value = 0
+
+    @abstractmethod
+    def reset(self) -> None:
+        '''
+        抽象方法，清空滤波器状态
+        :return: None
+        '''
+        pass
+
+    @abstractmethod
+    def push(self, sample) -> float:
+        '''
+        抽象方法，输入一个采样值，返回滤波后的数值
+        :param sample: 当前采样值
+        :return: 滤波后的数值
+        '''
+        pass
+
+    def process(self, samples: Iterable):
+        '''
+        对一批数据逐点滤波
+        :param samples: 采样值序列
+        :return: 滤波后的数值列表，输入为缓冲区对象时返回float64数组
+        '''
+        push = self.push
+        if IsBufferObject(samples):
+            import numpy as np
+            data = np.asarray(samples)
+            return np.fromiter((push(sample) for sample in data.tolist()),
+                               dtype=np.float64, count=data.shape[0])
+        return [push(sample) for sample in samples]
+
+
+@RegisterFilter(FilterType.AVERAGEFILTER)
+class MovingAverageFilter(StreamFilter):
+    '''
+    滑动平均滤波器类（增量式）
+
+    使用环形缓冲区保存最近FilterLength个采样值，并维护一个滑动和：
+        新样本进入时，加上新值、减去被挤出的旧值，
+        因此每个样本的计算量为O(1)，与滤波器长度和历史数据量无关。
+
+    预热阶段与原DateFilter一致：缓冲区初始全为0，
+    即前FilterLength-1个输出按"补零"方式计算平均值。
+    滑动和每转一圈重新求和一次，避免长时间运行时的浮点累计误差。
+    '''
+    WINDOWED = True
+
+    def __init__(self, FilterLength: int = 3):
+        '''
+        初始化方法
+        :param FilterLength: 对多少个点做数据滤波
+        '''
+        if FilterLength < 1:
+            raise ValueError("FilterLength must be >= 1", FilterLength)
+        super().__init__()
+        self.FilterLength = FilterLength
+        # 环形缓冲区，初始化为0，对应补零预热
+        self.__buffer = [0] * FilterLength
+        # 下一个写入位置
+        self.__pos = 0
+        # 缓冲区内数据之和
+        self.__sum = 0
+
+    def reset(self) -> None:
+        '''
+        清空滤波器状态，恢复到初始的补零状态
+        :return: None
+        '''
+        self.__buffer = [0] * self.FilterLength
+        self.__pos = 0
+        self.__sum = 0
+        self.value = 0
+
+    def push(self, sample) -> float:
+        '''
+        输入一个新的采样值，返回滤波后的数值，O(1)
+        :param sample: 当前采样值
+        :return: 滤波后的数值
+        '''
+        pos = self.__pos
+        # 滑动和：加上新值，减去被覆盖的旧值
+        self.__sum += sample - self.__buffer[pos]
+        self.__buffer[pos] = sample
+        pos += 1
+        if pos == self.FilterLength:
+            pos = 0
+            # 每转一圈重新求和一次（均摊O(1)），避免浮点累计误差
+            self.__sum = sum(self.__buffer)
+        self.__pos = pos
+        self.value = self.__sum / self.FilterLength
+        return self.value
+
+    def process(self, samples: Iterable) -> List[float]:
+        '''
+        对一批数据做一次O(n)的滤波，滤波器状态会延续到下一次调用
+        :param samples: 采样值序列，NumPy数组等缓冲区对象会走向量化路径
+        :return: 滤波后的数值列表，输入为缓冲区对象时返回float64数组
+        '''
+        if IsBufferObject(samples):
+            return self.__ProcessArray(samples)
+        # 将属性取为局部变量，减少循环中的属性查找
+        buffer = self.__buffer
+        length = self.FilterLength
+        pos    = self.__pos
+        total  = self.__sum
+        result = []
+        append = result.append
+        for sample in samples:
+            total += sample - buffer[pos]
+            buffer[pos] = sample
+            pos += 1
+            if pos == length:
+                pos = 0
+                total = sum(buffer)
+            append(total / length)
+        self.__pos = pos
+        self.__sum = total
+        if result:
+            self.value = result[-1]
+        return result
+
+    def __ProcessArray(self, samples):
+        '''
+        向量化批量滤波，私有方法
+        把缓冲区中最近FilterLength-1个历史值拼接在新数据前面，
+        使结果与逐点调用push完全一致
+        :param samples: 支持缓冲区协议的一维数据
+        :return: 滤波后的float64数组
+        '''
+        import numpy as np
+
+        x = np.asarray(samples)
+        if x.shape[0] == 0:
+            return np.empty(0, dtype=np.float64)
+        length = self.FilterLength
+        # 按时间顺序排列的历史数据
+        history = self.__buffer[self.__pos:] + self.__buffer[:self.__pos]
+        joined = np.concatenate((np.asarray(history[1:]), x))
+        result = MovingAverageArray(joined, length)[length - 1:]
+        # 更新环形缓冲区，使后续push/process能继续衔接
+        self.__buffer = joined[-length:].tolist()
+        self.__pos = 0
+        self.__sum = sum(self.__buffer)
+        self.value = float(result[-1])
+        return result
+
+
+class MultiChannelAverageFilter:
+    '''
+    多通道滑动平均滤波器类（向量化）
+
+    所有通道的环形缓冲区保存在一个预先分配的二维数组中（通道数 x FilterLength），
+    每个通道有独立的写入位置和滑动和：
+        push        —— 一次输入所有通道在同一时刻的采样值，整体O(通道数)的向量运算
+        PushChannel —— 只更新某一个通道，各通道状态互不影响，
+                       不同传感器线程各自更新自己的通道时不需要加锁
+        process     —— 对(通道数 x n)的数据块批量滤波
+    预热阶段与MovingAverageFilter一致，按补零方式计算
+    '''
+    def __init__(self, channels: int, FilterLength: int = 3):
+        '''
+        初始化方法
+        :param channels: 通道数，即传感器个数
+        :param FilterLength: 对多少个点做数据滤波
+        '''
+        import numpy as np
+
+        if channels < 1:
+            raise ValueError("channels must be >= 1", channels)
+        if FilterLength < 1:
+            raise ValueError("FilterLength must be >= 1", FilterLength)
+        self.channels = channels
+        self.FilterLength = FilterLength
+        # 所有通道的环形缓冲区
+        self.__buffer = np.zeros((channels, FilterLength), dtype=np.float64)
+        # 每个通道的下一个写入位置
+        self.__pos = np.zeros(channels, dtype=np.intp)
+        # 每个通道缓冲区内数据之和
+        self.__sum = np.zeros(channels, dtype=np.float64)
+        # 通道下标，push时用于花式索引
+        self.__rows = np.arange(channels)
+        # 最近一次各通道的滤波输出
+        self.value = np.zeros(channels, dtype=np.float64)
+
+    def reset(self) -> None:
+        '''
+        清空所有通道的滤波器状态
+        :return: None
+        '''
+        self.__buffer.fill(0)
+        self.__pos.fill(0)
+        self.__sum.fill(0)
+        self.value.fill(0)
+
+    def push(self, samples):
+        '''
+        输入所有通道同一时刻的采样值
+        :param samples: 长度为通道数的序列
+        :return: 各通道滤波后的数值（内部数组，下次调用时会被更新）
+        '''
+        import numpy as np
+
+        samples = np.asarray(samples, dtype=np.float64)
+        rows, pos, buffer = self.__rows, self.__pos, self.__buffer
+        # 滑动和：加上新值，减去被覆盖的旧值
+        self.__sum += samples - buffer[rows, pos]
+        buffer[rows, pos] = samples
+        pos += 1
+        wrapped = pos == self.FilterLength
+        if wrapped.any():
+            pos[wrapped] = 0
+            # 转完一圈的通道重新求和，避免浮点累计误差
+            self.__sum[wrapped] = buffer[wrapped].sum(axis=1)
+        np.divide(self.__sum, self.FilterLength, out=self.value)
+        return self.value
+
+    def PushChannel(self, channel: int, sample) -> float:
+        '''
+        只更新一个通道，只读写该通道自己的缓冲区、写入位置和滑动和
+        :param channel: 通道下标
+        :param sample: 该通道的采样值
+        :return: 该通道滤波后的数值
+        '''
+        row = self.__buffer[channel]
+        pos = int(self.__pos[channel])
+        total = float(self.__sum[channel]) + sample - row[pos]
+        row[pos] = sample
+        pos += 1
+        if pos == self.FilterLength:
+            pos = 0
+            total = float(row.sum())
+        self.__pos[channel] = pos
+        self.__sum[channel] = total
+        value = total / self.FilterLength
+        self.value[channel] = value
+        return value
+
+    def process(self, block):
+        '''
+        对多通道数据块批量滤波，状态延续到下一次调用
+        :param block: 形状为(通道数, n)的数组
+        :return: 形状为(通道数, n)的float64数组
+        '''
+        import numpy as np
+
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim != 2 or block.shape[0] != self.channels:
+            raise ValueError("block must have shape (channels, n)", block.shape)
+        n = block.shape[1]
+        if n == 0:
+            return np.empty((self.channels, 0), dtype=np.float64)
+        length = self.FilterLength
+        # 将各通道按时间顺序排列的最近FilterLength-1个历史值拼接在数据块前面
+        order = (self.__pos[:, None] + np.arange(length)) % length
+        history = np.take_along_axis(self.__buffer, order, axis=1)[:, 1:]
+        joined = np.concatenate((history, block), axis=1)
+        prefix = np.zeros((self.channels, joined.shape[1] + 1), dtype=np.float64)
+        np.cumsum(joined, axis=1, out=prefix[:, 1:])
+        result = (prefix[:, length:] - prefix[:, :-length]) / length
+        # 更新环形缓冲区，使后续调用能继续衔接
+        self.__buffer[:] = joined[:, -length:]
+        self.__pos.fill(0)
+        self.__sum[:] = self.__buffer.sum(axis=1)
+        self.value[:] = result[:, -1]
+        return result
+
+
+@RegisterFilter(FilterType.EMAFILTER)
+class ExponentialMovingAverage(StreamFilter):
+    '''
+    指数滑动平均滤波器：y = y + alpha * (x - y)，每个样本O(1)
+    第一个样本直接作为初始输出，避免从0开始的上升过程
+    '''
+    def __init__(self, alpha: float = None, span: int = None):
+        '''
+        初始化方法，alpha和span二选一
+        :param alpha: 平滑系数，范围(0,1]，越大跟随越快
+        :param span: 等效窗口长度，alpha = 2 / (span + 1)
+        '''
+        if alpha is None:
+            alpha = 2 / ((span if span is not None else 3) + 1)
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]", alpha)
+        super().__init__()
+        self.alpha = alpha
+        # 是否已经收到第一个样本
+        self.__started = False
+
+    def reset(self) -> None:
+        self.value = 0
+        self.__started = False
+
+    def push(self, sample) -> float:
+        if self.__started:
+            self.value += self.alpha * (sample - self.value)
+        else:
+            self.value = float(sample)
+            self.__started = True
+        return self.value
+
+
+@RegisterFilter(FilterType.LPFFILTER)
+class LowPassFilter(ExponentialMovingAverage):
+    '''
+    一阶IIR低通滤波器（RC低通的离散化），由截止频率和采样频率计算平滑系数：
+        RC = 1 / (2 * pi * cutoff)，dt = 1 / samplerate，alpha = dt / (RC + dt)
+    '''
+    def __init__(self, cutoff: float = 0.5, samplerate: float = 2.0):
+        '''
+        初始化方法
+        :param cutoff: 截止频率，单位Hz
+        :param samplerate: 采样频率，单位Hz
+        '''
+        if cutoff <= 0 or samplerate <= 0:
+            raise ValueError("cutoff and samplerate must be positive", cutoff, samplerate)
+        rc = 1 / (2 * math.pi * cutoff)
+        dt = 1 / samplerate
+        super().__init__(alpha=dt / (rc + dt))
+        self.cutoff = cutoff
+        self.samplerate = samplerate
+
+
+@RegisterFilter(FilterType.MEDIANFILTER)
+class MedianFilter(StreamFilter):
+    '''
+    滑动中值滤波器，使用双堆加延迟删除实现，每个样本O(log FilterLength)：
+        low  —— 大顶堆（存相反数），保存窗口中较小的一半
+        high —— 小顶堆，保存窗口中较大的一半
+    被移出窗口的值先记入delayed，等到它出现在堆顶时再真正弹出
+    预热阶段窗口中样本不足FilterLength个时，对已有样本求中值
+    '''
+    WINDOWED = True
+
+    def __init__(self, FilterLength: int = 3):
+        '''
+        初始化方法
+        :param FilterLength: 对多少个点做中值滤波
+        '''
+        if FilterLength < 1:
+            raise ValueError("FilterLength must be >= 1", FilterLength)
+        super().__init__()
+        self.FilterLength = FilterLength
+        self.reset()
+
+    def reset(self) -> None:
+        self.value = 0
+        # 按到达顺序保存窗口内样本，用于确定被移出的值
+        self.__window = deque()
+        self.__low = []
+        self.__high = []
+        # 两个堆中有效元素的个数
+        self.__lowsize = 0
+        self.__highsize = 0
+        # 待删除的值及其次数
+        self.__delayed = {}
+
+    def __Prune(self, heap, sign) -> None:
+        '''
+        弹出堆顶所有已被标记删除的元素，私有方法
+        :param heap: 堆
+        :param sign: low堆为-1，high堆为1
+        :return: None
+        '''
+        delayed = self.__delayed
+        while heap:
+            top = sign * heap[0]
+            count = delayed.get(top)
+            if not count:
+                break
+            if count == 1:
+                del delayed[top]
+            else:
+                delayed[top] = count - 1
+            heapq.heappop(heap)
+
+    def __Balance(self) -> None:
+        '''
+        保持low比high多0个或1个有效元素，私有方法
+        :return: None
+        '''
+        if self.__lowsize > self.__highsize + 1:
+            heapq.heappush(self.__high, -heapq.heappop(self.__low))
+            self.__lowsize -= 1
+            self.__highsize += 1
+            self.__Prune(self.__low, -1)
+        elif self.__lowsize < self.__highsize:
+            heapq.heappush(self.__low, -heapq.heappop(self.__high))
+            self.__lowsize += 1
+            self.__highsize -= 1
+            self.__Prune(self.__high, 1)
+
+    def push(self, sample) -> float:
+        # 插入新样本
+        if not self.__low or sample <= -self.__low[0]:
+            heapq.heappush(self.__low, -sample)
+            self.__lowsize += 1
+        else:
+            heapq.heappush(self.__high, sample)
+            self.__highsize += 1
+        self.__window.append(sample)
+
+        # 窗口已满时，延迟删除最早的样本
+        if len(self.__window) > self.FilterLength:
+            old = self.__window.popleft()
+            self.__delayed[old] = self.__delayed.get(old, 0) + 1
+            if old <= -self.__low[0]:
+                self.__lowsize -= 1
+                if old == -self.__low[0]:
+                    self.__Prune(self.__low, -1)
+            else:
+                self.__highsize -= 1
+                if old == self.__high[0]:
+                    self.__Prune(self.__high, 1)
+        self.__Balance()
+
+        if (self.__lowsize + self.__highsize) % 2:
+            self.value = -self.__low[0]
+        else:
+            self.value = (-self.__low[0] + self.__high[0]) / 2
+        return self.value
+
+
+@RegisterFilter(FilterType.KALMANFILTER)
+class KalmanFilter(StreamFilter):
+    '''
+    一维卡尔曼滤波器，状态模型为随机游走：
+        预测：p = p + q
+        更新：k = p / (p + r)，x = x + k * (z - x)，p = (1 - k) * p
+    '''
+    def __init__(self, q: float = 0.01, r: float = 1.0, p0: float = 1.0):
+        '''
+        初始化方法
+        :param q: 过程噪声方差
+        :param r: 测量噪声方差
+        :param p0: 初始估计误差方差
+        '''
+        if q < 0 or r <= 0 or p0 < 0:
+            raise ValueError("invalid noise parameters", q, r, p0)
+        super().__init__()
+        self.q = q
+        self.r = r
+        self.p0 = p0
+        self.reset()
+
+    def reset(self) -> None:
+        self.value = 0
+        # 估计误差方差
+        self.p = self.p0
+        # 是否已经收到第一个样本
+        self.__started = False
+
+    def push(self, sample) -> float:
+        if not self.__started:
+            # 第一个样本直接作为初始估计
+            self.value = float(sample)
+            self.__started = True
+            return self.value
+        p = self.p + self.q
+        gain = p / (p + self.r)
+        self.value += gain * (sample - self.value)
+        self.p = (1 - gain) * p
+        return self.value
+
+
+if __name__ == '__main__':
+    # 对比原DateFilter的逐点移位实现、增量滤波器与向量化滤波的速度
+    import time
+    import numpy as np
+
+    def LegacyFilter(DateList, FilterLength):
+        # 原DateProcessClass.DateFilter的计算方式，每个样本O(FilterLength)
+        TempList = [0] * FilterLength
+        for index, value in enumerate(DateList):
+            sum = 0
+            for i in range(FilterLength - 1):
+                TempList[i] = TempList[i + 1]
+                sum += TempList[i]
+            TempList[FilterLength - 1] = value
+            sum += value
+            DateList[index] = sum / FilterLength
+        return DateList
+
+    total = 10_000_000
+    part  = 1_000_000
+    trace = (np.sin(np.arange(total) * 0.01) * 10 + np.random.uniform(0, 5, total)).astype(np.int64)
+
+    start = time.perf_counter()
+    vector = MovingAverageArray(trace, 10)
+    vectortime = time.perf_counter() - start
+
+    # 纯Python实现只取前100万个点，再按比例换算到1000万点
+    start = time.perf_counter()
+    legacy = LegacyFilter(trace[:part].tolist(), 10)
+    legacytime = (time.perf_counter() - start) * total / part
+
+    start = time.perf_counter()
+    MovingAverageFilter(10).process(trace[:part].tolist())
+    streamtime = (time.perf_counter() - start) * total / part
+
+    print("max error      :", float(np.max(np.abs(vector[:part] - legacy))))
+    print("vector  time   : %.3f s" % vectortime)
+    print("stream  time   : %.3f s (estimated)" % streamtime)
+    print("legacy  time   : %.3f s (estimated)" % legacytime)
+    print("speedup        : %.1fx" % (legacytime / vectortime))
@@ -0,0 +1,357 @@
+# Python env   :
+# -*- coding: utf-8 -*-
+# @Time    : 2024/5/27 16:20
+# @Author  : 李清水
+# @File    : Frame.py
+# @Description : 定义了串口二进制帧协议的编码函数和FrameDecoder解码类，以及文本协议的LineDecoder解码类，
+#                和传感器循环模式下按频率发送数据的LoopSend函数
+#                SerialClass、MasterProcess、SensorThread共用，只依赖标准库
+
+# 二进制数据打包/解包
+import struct
+# CRC校验
+from binascii import crc_hqx
+# 循环模式的发送时刻
+import time
+# 日志输出相关库
+import logging
+
+# 二进制帧格式（小端）：
+#   SYNC(1B) | TYPE(1B) | SEQ(1B) | LEN(1B) | PAYLOAD(LEN个int16) | CRC16(2B)
+#   CRC16为CRC-CCITT，初值0xFFFF，校验范围为TYPE到PAYLOAD
+# 与ASCII协议每个数值一行"数值\r\n"相比，解码不需要decode和int转换；
+# 一帧可以携带多个数值，批量发送时每个数值只占2字节
+FRAME_SYNC      = 0xA5
+FRAME_HEADER    = struct.Struct('<BBBB')
+FRAME_CRC       = struct.Struct('<H')
+# 一帧最多携带的数值个数
+FRAME_MAX_VALUES = 255
+# 帧类型：
+#   FRAME_DATA  - 传感器数据  -0
+#   FRAME_CMD   - 主机命令    -1
+#   FRAME_ID    - 传感器ID号  -2
+FRAME_DATA, FRAME_CMD, FRAME_ID = (0, 1, 2)
+FRAME_TYPE_MAX = FRAME_ID
+
+# 按数值个数缓存的载荷Struct对象
+_PayloadStructs = {}
+
+def PayloadStruct(count: int) -> struct.Struct:
+    '''
+    返回count个int16组成的载荷Struct对象，已创建的对象会被缓存
+    :param count: 数值个数
+    :return: struct.Struct
+    '''
+    payload = _PayloadStructs.get(count)
+    if payload is None:
+        payload = _PayloadStructs[count] = struct.Struct('<%dh' % count)
+    return payload
+
+def FrameSize(count: int) -> int:
+    '''
+    返回携带count个数值的帧长度
+    :param count: 数值个数
+    :return: 字节数
+    '''
+    return FRAME_HEADER.size + 2 * count + FRAME_CRC.size
+
+def FrameValue(value) -> int:
+    '''
+    检查并转换一个待发送的数值：二进制帧只能携带int16范围内的整数，
+    其他数据直接抛出ValueError，不在int()或struct打包时失败
+    :param value: 整数或表示整数的字符串
+    :return: int
+    '''
+    try:
+        result = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("Binary protocol only sends integer values", value) from None
+    if not -0x8000 <= result <= 0x7FFF:
+        raise ValueError("Value out of int16 range", result)
+    return result
+
+def EncodeFrame(frametype: int, values, seq: int = 0) -> bytes:
+    '''
+    将数值编码为一帧
+    :param frametype: 帧类型
+    :param values: int16范围内的整数序列
+    :param seq: 帧序号，0~255
+    :return: 编码后的字节串
+    '''
+    count = len(values)
+    if count > FRAME_MAX_VALUES:
+        raise ValueError("too many values for one frame", count)
+    frame = bytearray(FrameSize(count))
+    FRAME_HEADER.pack_into(frame, 0, FRAME_SYNC, frametype, seq & 0xFF, count)
+    PayloadStruct(count).pack_into(frame, FRAME_HEADER.size, *values)
+    FRAME_CRC.pack_into(frame, len(frame) - FRAME_CRC.size, crc_hqx(frame[1:-FRAME_CRC.size], 0xFFFF))
+    return bytes(frame)
+
+def EncodeFrames(frametype: int, values, seq: int = 0) -> bytes:
+    '''
+    将任意多个数值拆分为若干帧并拼接，便于一次write发送
+    :param frametype: 帧类型
+    :param values: int16范围内的整数序列
+    :param seq: 第一帧的帧序号，后续帧依次加1
+    :return: 编码后的字节串
+    '''
+    return b''.join(EncodeFrame(frametype, values[start:start + FRAME_MAX_VALUES], seq + i)
+                    for i, start in enumerate(range(0, len(values), FRAME_MAX_VALUES)))
+
+
+def EncodeLines(values) -> bytes:
+    '''
+    将任意多个数值按文本协议编码并拼接，便于一次write发送
+    :param values: 整数序列
+    :return: 编码后的字节串
+    '''
+    return b''.join([b'%d\r\n' % value for value in values])
+
+
+def RateFromArgs(args, rate):
+    '''
+    从START_CMD的命令参数中取出发送频率
+    参数来自串口，可以是任意int16，频率不大于0时（1/rate会除零或使发送时刻倒退）丢弃并保留当前频率
+    :param args: 命令参数元组，第一个参数为发送频率，没有参数时保留当前频率
+    :param rate: 当前发送频率
+    :return: 新的发送频率
+    '''
+    if not args:
+        return rate
+    if args[0] <= 0:
+        logging.warning("Invalid loop rate %s ignored, keep %s Hz", args[0], rate)
+        return rate
+    return args[0]
+
+
+def LoopSend(dev, makevalue, rate, batchinterval: float, binary: bool, running, command):
+    '''
+    循环模式：按rate频率持续主动发送数据，直到running()返回False
+    以time.perf_counter计算每个样本的发送时刻，按时刻累加而不是固定sleep，不会产生累计漂移；
+    一次唤醒时把已经到期的样本全部生成并合并为一次写入，频率较高时也不会落后
+    :param dev: 串口对象，需要write方法和in_waiting属性
+    :param makevalue: 生成一个样本的函数
+    :param rate: 发送频率，单位Hz，必须大于0
+    :param batchinterval: 两次写入的最小间隔，单位s
+    :param binary: 是否按二进制帧协议发送
+    :param running: 返回是否继续循环的函数
+    :param command: 有主机命令到达时调用，处理命令并返回当前的发送频率
+    :return: 最后的发送频率
+    '''
+    if rate <= 0:
+        raise ValueError("Loop rate must be positive", rate)
+    period    = 1 / rate
+    # 下一个样本的发送时刻
+    deadline  = time.perf_counter()
+    lastwrite = deadline - batchinterval
+    seq       = 0
+    while running():
+        now  = time.perf_counter()
+        wake = max(deadline, lastwrite + batchinterval)
+        if wake > now:
+            time.sleep(wake - now)
+            now = time.perf_counter()
+
+        # 计算到当前时刻为止到期的样本数
+        due = int((now - deadline) / period) + 1
+        # 落后超过1s时（例如串口写入阻塞），丢弃积压的样本，重新对齐时刻
+        if due > rate:
+            deadline = now
+            due = 1
+        values = [makevalue() for _ in range(due)]
+        if binary:
+            dev.write(EncodeFrames(FRAME_DATA, values, seq))
+            seq = (seq + (len(values) + FRAME_MAX_VALUES - 1) // FRAME_MAX_VALUES) & 0xFF
+        else:
+            dev.write(EncodeLines(values))
+        deadline += due * period
+        lastwrite = now
+
+        # 非阻塞地检查主机命令
+        if dev.in_waiting:
+            rate   = command()
+            period = 1 / rate
+    return rate
+
+
+class FrameDecoder:
+    '''
+    二进制帧解码类
+
+    接收到的字节追加到一个可重复使用的bytearray中，用struct.unpack_from按偏移量直接解码，
+    已解码的部分在下一次feed时一次性删除，不会为每一帧复制缓冲区。
+    遇到同步字节错误或CRC校验失败时，向后寻找下一个同步字节重新同步，并记录错误次数。
+    '''
+    def __init__(self):
+        # 接收缓冲区
+        self.buffer     = bytearray()
+        # 缓冲区中尚未解码数据的起始位置
+        self.__offset   = 0
+        # 丢弃的错误帧/字节计数
+        self.errors     = 0
+
+    def feed(self, data) -> None:
+        '''
+        追加接收到的字节
+        :param data: 字节串
+        :return: None
+        '''
+        if self.__offset:
+            del self.buffer[:self.__offset]
+            self.__offset = 0
+        self.buffer += data
+
+    def pending(self) -> int:
+        '''
+        返回缓冲区中尚未解码的字节数
+        :return: int
+        '''
+        return len(self.buffer) - self.__offset
+
+    def needed(self) -> int:
+        '''
+        返回解出下一帧至少还需要的字节数
+        :return: int
+        '''
+        buffer, offset = self.buffer, self.__offset
+        available = len(buffer) - offset
+        if available < FRAME_HEADER.size or buffer[offset] != FRAME_SYNC:
+            return max(1, FRAME_HEADER.size - available)
+        return max(1, FrameSize(buffer[offset + 3]) - available)
+
+    def next(self):
+        '''
+        解码下一帧
+        :return: (帧类型, 帧序号, 数值元组)，数据不足一帧时返回None
+        '''
+        buffer = self.buffer
+        offset = self.__offset
+        length = len(buffer)
+        while length - offset >= FRAME_HEADER.size:
+            if buffer[offset] != FRAME_SYNC:
+                # 丢弃到下一个同步字节
+                self.errors += 1
+                offset = buffer.find(FRAME_SYNC, offset + 1)
+                if offset < 0:
+                    offset = length
+                continue
+            sync, frametype, seq, count = FRAME_HEADER.unpack_from(buffer, offset)
+            if frametype > FRAME_TYPE_MAX:
+                # 未知帧类型，说明不是真正的帧头，立即重新同步
+                self.errors += 1
+                offset += 1
+                continue
+            size = FrameSize(count)
+            if length - offset < size:
+                break
+            end = offset + size - FRAME_CRC.size
+            if crc_hqx(buffer[offset + 1:end], 0xFFFF) != FRAME_CRC.unpack_from(buffer, end)[0]:
+                # 校验失败，跳过该同步字节重新同步
+                self.errors += 1
+                offset += 1
+                continue
+            values = PayloadStruct(count).unpack_from(buffer, offset + FRAME_HEADER.size)
+            self.__offset = offset + size
+            return frametype, seq, values
+        self.__offset = offset
+        return None
+
+    def frames(self) -> list:
+        '''
+        解码缓冲区中所有完整的帧
+        :return: (帧类型, 帧序号, 数值元组)列表
+        '''
+        result = []
+        frame = self.next()
+        while frame is not None:
+            result.append(frame)
+            frame = self.next()
+        return result
+
+
+class LineDecoder:
+    '''
+    文本协议解码类，每个数值一行"数值\r\n"
+
+    接收到的字节追加到缓冲区中，一次split切分出所有完整的行并直接用int()转换，
+    不需要逐行readline和decode；不完整的最后一行留在缓冲区中等待后续数据。
+    无法转换为整数的行被丢弃，并记录错误次数。
+    '''
+    def __init__(self):
+        # 接收缓冲区
+        self.buffer     = bytearray()
+        # 丢弃的错误行计数
+        self.errors     = 0
+
+    def feed(self, data) -> None:
+        '''
+        追加接收到的字节
+        :param data: 字节串
+        :return: None
+        '''
+        self.buffer += data
+
+    def __Convert(self, lines) -> list:
+        '''
+        将若干行转换为整数，私有方法
+        :param lines: 字节串列表
+        :return: 整数列表
+        '''
+        try:
+            # int()可以直接转换bytes，并忽略首尾的空白字符和\r
+            return list(map(int, lines))
+        except ValueError:
+            result = []
+            for line in lines:
+                try:
+                    result.append(int(line))
+                except ValueError:
+                    if line.strip():
+                        self.errors += 1
+            return result
+
+    def values(self) -> list:
+        '''
+        解码缓冲区中所有完整的行
+        :return: 整数列表
+        '''
+        buffer = self.buffer
+        end = buffer.rfind(b'\n')
+        if end < 0:
+            return []
+        lines = buffer[:end].split(b'\n')
+        del buffer[:end + 1]
+        return self.__Convert(lines)
+
+    def next(self):
+        '''
+        解码下一行
+        :return: 整数，缓冲区中没有完整的有效行时返回None
+        '''
+        buffer = self.buffer
+        end = buffer.find(b'\n')
+        while end >= 0:
+            line = buffer[:end]
+            del buffer[:end + 1]
+            value = self.__Convert([line])
+            if value:
+                return value[0]
+            end = buffer.find(b'\n')
+        return None
+
+
+def ReadFrame(dev, decoder: FrameDecoder):
+    '''
+    从串口对象读取一帧，每次只读取凑齐一帧所需的字节数（以及串口中已经到达的字节）
+    :param dev: serial.Serial对象
+    :param decoder: 该串口对应的FrameDecoder对象
+    :return: (帧类型, 帧序号, 数值元组)，超时时返回None
+    '''
+    frame = decoder.next()
+    while frame is None:
+        chunk = dev.read(max(decoder.needed(), dev.in_waiting))
+        if not chunk:
+            return None
+        decoder.feed(chunk)
+        frame = decoder.next()
+    return frame
@@ -0,0 +1,106 @@
+# Python env   :
+# -*- coding: utf-8 -*-
+# @Time    : 2024/6/13 15:20
+# @Author  : 李清水
+# @File    : ImportBudget.py
+# @Description : 导入开销检查脚本
+#                用python -X importtime在新的解释器中导入每个入口模块，
+#                检查累计导入时间是否超出预算，以及是否加载了Qt、pyqtgraph、matplotlib等重量级依赖
+
+# 子进程、命令行参数
+import subprocess
+import sys
+import os
+# 解析子进程输出
+import json
+
+# 入口模块 -> 导入时间预算（ms）
+# 预算按开发机上三次取最小值的实测时间留出约30%余量，其他机器可用--scale按比例放宽或收紧
+BUDGETS = {
+    "main"          : 250,
+    "Parallel"      : 250,
+    "MultiMaster"   : 260,
+    "Plot"          : 220,
+    "AsyncSerial"   : 110,
+    "LogPipeline"   : 70,
+    "Serial"        : 60,
+    "DateProcess"   : 80,
+    "FileIO"        : 40,
+}
+# 导入入口模块时不允许加载的模块（包括其子模块）
+FORBIDDEN = ("pyqtgraph", "PyQt5", "PyQt6", "PySide2", "PySide6", "matplotlib")
+# zope.interface只允许DateProcess作为可选依赖加载
+FORBIDDEN_EXCEPT = {"zope": ("DateProcess",)}
+# 每个模块测量的次数，取最小值
+REPEAT = 3
+# 入口模块所在目录，子进程在该目录下运行，从任何工作目录执行本脚本都能导入入口模块
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 子进程中执行的代码：导入模块后输出已加载的重量级模块和最大常驻内存
+PROBE = '''
+import sys, json, resource
+import {module}
+names = {names!r}
+loaded = sorted(name for name in sys.modules if name.split(".")[0] in names)
+print(json.dumps({{"loaded": loaded, "maxrss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+'''
+
+
+def MeasureImport(module: str):
+    '''
+    在新的解释器中导入一个模块
+    :param module: 模块名
+    :return: (累计导入时间ms, 加载的重量级模块列表, 最大常驻内存KB)
+    '''
+    names = FORBIDDEN + tuple(name for name, allowed in FORBIDDEN_EXCEPT.items() if module not in allowed)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, names=names)],
+                            capture_output=True, text=True, cwd=ROOT)
+    if result.returncode != 0:
+        raise RuntimeError("import %s failed:\n%s" % (module, result.stderr.strip().splitlines()[-1]))
+    # importtime的每一行：import time: self [us] | cumulative | imported package
+    cumulative = None
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if fields[2].strip() == module:
+            cumulative = int(fields[1]) / 1000
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    return cumulative, probe["loaded"], probe["maxrss"]
+
+
+def CheckBudgets(scale: float = 1.0) -> bool:
+    '''
+    检查所有入口模块
+    :param scale: 预算的缩放系数
+    :return: bool，是否全部满足预算
+    '''
+    ok = True
+    print("%-12s %10s %10s %10s  %s" % ("module", "time(ms)", "budget", "RSS(MB)", "result"))
+    for module, budget in BUDGETS.items():
+        budget *= scale
+        try:
+            measures = [MeasureImport(module) for _ in range(REPEAT)]
+        except RuntimeError as e:
+            ok = False
+            print("%-12s %s" % (module, e))
+            continue
+        cumulative = min(measure[0] for measure in measures)
+        loaded, maxrss = measures[0][1], min(measure[2] for measure in measures)
+        problems = []
+        if cumulative > budget:
+            problems.append("over budget")
+        if loaded:
+            problems.append("loaded " + ", ".join(loaded[:5]) + (" ..." if len(loaded) > 5 else ""))
+        ok = ok and not problems
+        print("%-12s %10.1f %10.1f %10.1f  %s" % (module, cumulative, budget, maxrss / 1024,
+                                                  "; ".join(problems) if problems else "ok"))
+    return ok
+
+
+if __name__ == "__main__":
+    # 用法：python ImportBudget.py [--scale 系数]
+    scale = 1.0
+    if "--scale" in sys.argv:
+        scale = float(sys.argv[sys.argv.index("--scale") + 1])
+    sys.exit(0 if CheckBudgets(scale) else 1)
@@ -0,0 +1,488 @@
+# Python env   :
+# -*- coding: utf-8 -*-
+# @Time    : 2024/6/6 15:40
+# @Author  : 李清水
+# @File    : LogPipeline.py
+# @Description : 定义了跨进程的非阻塞日志管道LogPipeline
+#                各进程/线程只通过QueueHandler把日志记录放入队列，
+#                由单独的写日志进程用QueueListener批量写入文件和控制台
+
+# 日志输出相关库
+import logging
+from logging.handlers import QueueHandler, QueueListener
+# 队列为空时的异常
+import queue as _queue
+# 多线程、多进程相关
+from threading import Thread
+from multiprocessing import Process, Queue
+from multiprocessing.util import Finalize, register_after_fork
+# 时间操作相关
+import time
+# fork后重建转发线程
+import os
+# 控制台输出
+import sys
+
+# 日志格式
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(processName)s - %(message)s"
+# 控制台输出只需要消息本身，与原来的print保持一致
+CONSOLE_FORMAT = "%(message)s"
+
+
+class BatchStreamHandler(logging.StreamHandler):
+    '''
+    批量刷新的流处理器
+
+    StreamHandler每写一条记录都会flush一次；本类只在累计batchsize条记录、
+    距上次刷新超过flushinterval秒或者队列暂时为空时才真正flush，减少系统调用和磁盘IO
+    '''
+    def __init__(self, stream=None, batchsize: int = 256, flushinterval: float = 0.5):
+        '''
+        初始化方法
+        :param stream: 输出流，为None时为sys.stderr
+        :param batchsize: 累计多少条记录后刷新
+        :param flushinterval: 最长刷新间隔，单位s
+        '''
+        logging.StreamHandler.__init__(self, stream)
+        self.batchsize      = batchsize
+        self.flushinterval  = flushinterval
+        # 未刷新的记录条数和上次刷新的时刻
+        self.pending        = 0
+        self.lastflush      = time.monotonic()
+
+    def flush(self) -> None:
+        # emit中调用的flush只做计数，达到条件时才真正刷新
+        self.pending += 1
+        if self.pending >= self.batchsize or time.monotonic() - self.lastflush >= self.flushinterval:
+            self.FlushBatch()
+
+    def FlushBatch(self) -> None:
+        '''
+        立即刷新所有未刷新的记录
+        :return: None
+        '''
+        self.acquire()
+        try:
+            if self.stream and hasattr(self.stream, "flush"):
+                self.stream.flush()
+        finally:
+            self.release()
+        self.pending = 0
+        self.lastflush = time.monotonic()
+
+
+class BatchFileHandler(BatchStreamHandler, logging.FileHandler):
+    '''
+    批量刷新的文件处理器，以追加方式写入日志文件
+    '''
+    def __init__(self, filename: str, batchsize: int = 256, flushinterval: float = 0.5, encoding: str = "utf-8"):
+        '''
+        初始化方法
+        :param filename: 日志文件路径
+        :param batchsize: 累计多少条记录后刷新
+        :param flushinterval: 最长刷新间隔，单位s
+        :param encoding: 文件编码
+        '''
+        logging.FileHandler.__init__(self, filename, mode="a", encoding=encoding)
+        self.batchsize      = batchsize
+        self.flushinterval  = flushinterval
+        self.pending        = 0
+        self.lastflush      = time.monotonic()
+
+    def close(self) -> None:
+        self.FlushBatch()
+        logging.FileHandler.close(self)
+
+
+class BatchQueueListener(QueueListener):
+    '''
+    批量刷新的队列监听器
+    队列中的元素是日志记录列表，每个列表为某个进程中一批连续的记录；
+    队列中还有数据时连续处理，队列暂时为空时先刷新所有处理器再阻塞等待，
+    因此高负载时按批写入，低负载时日志也不会滞留在缓冲区中
+    '''
+    def dequeue(self, block: bool):
+        try:
+            return self.queue.get_nowait()
+        except _queue.Empty:
+            if not block:
+                raise
+        for handler in self.handlers:
+            if isinstance(handler, BatchStreamHandler) and handler.pending:
+                handler.FlushBatch()
+        return self.queue.get()
+
+    def handle(self, batch) -> None:
+        for record in batch:
+            QueueListener.handle(self, record)
+
+    def enqueue_sentinel(self) -> None:
+        # 结束标志由LogPipeline.stop从生产者一侧放入，保证排在该进程的所有记录之后
+        pass
+
+
+class ForwardHandler(QueueHandler):
+    '''
+    只把记录原样放入进程内队列的QueueHandler
+    QueueHandler.prepare会在调用线程中复制记录并格式化消息，这里推迟到LogForwarder的后台线程中完成
+    '''
+    def prepare(self, record):
+        return record
+
+
+class LogForwarder:
+    '''
+    日志转发类，每个进程一个
+
+    ForwardHandler把记录放入进程内的queue.SimpleQueue，调用方只需一次无锁的put；
+    后台线程格式化消息后把连续的记录合并为列表，再整批放入跨进程的日志队列，
+    序列化和管道写入的次数按批计算，而不是每条记录一次。
+    消息在后台线程中格式化，作为参数传入的可变对象在记录后不应再修改。
+    '''
+    def __init__(self, logqueue, batchsize: int = 256):
+        '''
+        初始化方法
+        :param logqueue: 跨进程的日志队列
+        :param batchsize: 每批最多合并的记录条数
+        '''
+        self.logqueue   = logqueue
+        self.batchsize  = batchsize
+        # 进程内的记录队列
+        self.queue      = _queue.SimpleQueue()
+        # 格式化消息和异常信息，与QueueHandler.prepare的处理相同
+        self.formatter  = logging.Formatter()
+        self.__thread   = Thread(target=self.__Forward, name="LogForwarder", daemon=True)
+        self.__thread.start()
+        # 进程退出时先转发剩余记录，multiprocessing子进程退出时同样会调用
+        Finalize(self, self.stop, exitpriority=100)
+
+    def __Forward(self) -> None:
+        '''
+        转发线程，私有方法
+        :return: None
+        '''
+        get, getnowait, batchsize = self.queue.get, self.queue.get_nowait, self.batchsize
+        running = True
+        while running:
+            batch = [get()]
+            while len(batch) < batchsize:
+                try:
+                    batch.append(getnowait())
+                except _queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                running = False
+            for record in batch:
+                self.Prepare(record)
+            if batch:
+                self.logqueue.put(batch)
+
+    def Prepare(self, record) -> None:
+        '''
+        将消息参数合并到消息中，并去掉不能序列化的异常对象
+        :param record: 日志记录
+        :return: None
+        '''
+        msg = self.formatter.format(record)
+        record.message  = msg
+        record.msg      = msg
+        record.args     = None
+        record.exc_info = None
+        record.exc_text = None
+        record.stack_info = None
+
+    def stop(self) -> None:
+        '''
+        转发剩余的记录并停止转发线程
+        :return: None
+        '''
+        if self.__thread.is_alive():
+            self.queue.put(None)
+            self.__thread.join()
+
+
+def _MakeHandlers(filename: str, level: int, console: bool, batchsize: int, flushinterval: float) -> list:
+    '''
+    创建写文件和控制台的批量刷新处理器，私有函数
+    :param filename: 日志文件路径，为None时不写文件
+    :param level: 日志级别
+    :param console: 是否输出到控制台
+    :param batchsize: 累计多少条记录后刷新
+    :param flushinterval: 最长刷新间隔，单位s
+    :return: 处理器列表
+    '''
+    handlers = []
+    if filename is not None:
+        filehandler = BatchFileHandler(filename, batchsize, flushinterval)
+        filehandler.setFormatter(logging.Formatter(LOG_FORMAT))
+        filehandler.setLevel(level)
+        handlers.append(filehandler)
+    if console:
+        consolehandler = BatchStreamHandler(sys.stdout, batchsize=batchsize, flushinterval=flushinterval)
+        consolehandler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        consolehandler.setLevel(level)
+        handlers.append(consolehandler)
+    return handlers
+
+
+def _LogWriter(logqueue, filename: str, level: int, console: bool,
+               batchsize: int, flushinterval: float) -> None:
+    '''
+    写日志进程的入口，用BatchQueueListener把队列中的记录写入文件和控制台
+    :param logqueue: 日志队列
+    :param filename: 日志文件路径，为None时不写文件
+    :param level: 日志级别
+    :param console: 是否输出到控制台
+    :param batchsize: 累计多少条记录后刷新
+    :param flushinterval: 最长刷新间隔，单位s
+    :return: None
+    '''
+    handlers = _MakeHandlers(filename, level, console, batchsize, flushinterval)
+    listener = BatchQueueListener(logqueue, *handlers, respect_handler_level=True)
+    listener.start()
+    # 等待LogPipeline.stop放入的结束标志，之前的所有记录都处理完成后才返回
+    listener.stop()
+    for handler in handlers:
+        handler.close()
+
+
+class LocalLogWriter:
+    '''
+    进程内的写日志线程，没有启动LogPipeline时由DefaultLogging使用
+
+    记录同样经ForwardHandler和LogForwarder整批转发，只是由本进程的后台线程写入文件和控制台，
+    调用logging的热路径同样只有一次put
+    '''
+    def __init__(self, filename: str = "my.log", level: int = logging.INFO, console: bool = True,
+                 batchsize: int = 256, flushinterval: float = 0.5):
+        '''
+        初始化方法，参数与LogPipeline相同
+        '''
+        self.options    = dict(filename=filename, level=level, console=console,
+                               batchsize=batchsize, flushinterval=flushinterval)
+        self.queue      = _queue.Queue()
+        self.handlers   = _MakeHandlers(filename, level, console, batchsize, flushinterval)
+        self.listener   = BatchQueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        # 进程退出时在LogForwarder（exitpriority=100）之后停止，先转发的记录都会被写出
+        Finalize(self, self.stop, exitpriority=50)
+
+    def stop(self) -> None:
+        '''
+        写出队列中剩余的记录并停止写日志线程
+        :return: None
+        '''
+        if self.listener is None:
+            return
+        if _forwarder is not None and _forwarder.logqueue is self.queue:
+            ShutdownLogging()
+        self.queue.put(None)
+        self.listener.stop()
+        self.listener = None
+        for handler in self.handlers:
+            handler.close()
+
+
+# 当前进程的日志转发对象
+_forwarder = None
+# 当前进程的写日志线程，只有DefaultLogging会创建
+_localwriter = None
+
+def _AfterFork() -> None:
+    '''
+    fork得到的子进程中没有转发线程，重新创建日志转发对象，私有函数
+    :return: None
+    '''
+    global _forwarder, _localwriter
+    if _forwarder is None:
+        return
+    parent = _forwarder
+    logqueue = parent.logqueue
+    if _localwriter is not None and logqueue is _localwriter.queue:
+        # 进程内的写日志线程同样不会被fork，子进程重新创建
+        _localwriter = LocalLogWriter(**_localwriter.options)
+        logqueue = _localwriter.queue
+    _forwarder = LogForwarder(logqueue, parent.batchsize)
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, ForwardHandler) and handler.queue is parent.queue:
+            handler.queue = _forwarder.queue
+
+def _AfterProcessFork(_) -> None:
+    '''
+    multiprocessing子进程启动后会清空继承的退出处理，其中包括_AfterFork中注册的，
+    重新注册后子进程退出前剩余的记录同样会被写出，私有函数
+    :return: None
+    '''
+    if _forwarder is not None:
+        Finalize(_forwarder, _forwarder.stop, exitpriority=100)
+    if _localwriter is not None:
+        Finalize(_localwriter, _localwriter.stop, exitpriority=50)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_AfterFork)
+    register_after_fork(_AfterFork, _AfterProcessFork)
+
+def ConfigureLogging(logqueue, level: int = logging.INFO, batchsize: int = 256) -> None:
+    '''
+    将当前进程的根日志器改为只向日志队列发送记录，移除basicConfig等安装的其他处理器
+    fork方式启动的子进程自动继承该配置；spawn方式（Windows）启动的子进程需要在run()开始时调用一次
+    :param logqueue: 日志队列
+    :param level: 日志级别，低于该级别的记录在调用处直接丢弃，不会格式化也不会进入队列
+    :param batchsize: 每批最多合并的记录条数
+    :return: None
+    '''
+    global _forwarder
+    ShutdownLogging()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    _forwarder = LogForwarder(logqueue, batchsize)
+    root.addHandler(ForwardHandler(_forwarder.queue))
+    root.setLevel(level)
+
+def ShutdownLogging() -> None:
+    '''
+    移除当前进程的QueueHandler，并把尚未转发的记录放入日志队列
+    :return: None
+    '''
+    global _forwarder
+    if _forwarder is None:
+        return
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, QueueHandler) and handler.queue is _forwarder.queue:
+            root.removeHandler(handler)
+    _forwarder.stop()
+    _forwarder = None
+
+
+def DefaultLogging(filename: str = "my.log", level: int = logging.INFO, console: bool = True) -> None:
+    '''
+    根日志器还没有处理器时（没有启动LogPipeline，也没有其他日志配置），
+    改为经进程内的写日志线程写入文件和控制台；已经配置过时不做任何修改
+    只应在入口程序（__main__）中调用，库模块导入时不修改日志配置
+    :param filename: 日志文件路径，为None时不写文件
+    :param level: 日志级别
+    :param console: 是否输出到控制台
+    :return: None
+    '''
+    global _localwriter
+    if logging.getLogger().handlers:
+        return
+    _localwriter = LocalLogWriter(filename, level, console)
+    ConfigureLogging(_localwriter.queue, level)
+
+
+class LogPipeline:
+    '''
+    跨进程非阻塞日志管道类
+
+    各进程的日志记录通过QueueHandler放入进程内队列，由LogForwarder整批转发到一个multiprocessing.Queue，
+    调用logging的热路径不会等待控制台、磁盘或其他进程的锁；
+    唯一的写日志进程负责写文件和控制台，并按批刷新。
+    '''
+    def __init__(self, filename: str = "my.log", level: int = logging.INFO, console: bool = True,
+                 batchsize: int = 256, flushinterval: float = 0.5):
+        '''
+        初始化方法
+        :param filename: 日志文件路径，为None时不写文件
+        :param level: 日志级别
+        :param console: 是否输出到控制台
+        :param batchsize: 累计多少条记录后刷新
+        :param flushinterval: 最长刷新间隔，单位s
+        '''
+        self.filename       = filename
+        self.level          = level
+        self.console        = console
+        self.batchsize      = batchsize
+        self.flushinterval  = flushinterval
+        # 日志队列，不限长度，放入记录时不会阻塞
+        self.queue          = Queue()
+        self.__process      = None
+
+    def start(self) -> None:
+        '''
+        启动写日志进程，并将当前进程的日志改为发送到日志队列
+        :return: None
+        '''
+        self.__process = Process(target=_LogWriter, name="LogWriter",
+                                 args=(self.queue, self.filename, self.level,
+                                       self.console, self.batchsize, self.flushinterval),
+                                 daemon=True)
+        self.__process.start()
+        ConfigureLogging(self.queue, self.level, self.batchsize)
+
+    def stop(self) -> None:
+        '''
+        停止写日志进程，之前放入队列的记录都会被写出
+        :return: None
+        '''
+        if self.__process is None:
+            return
+        # 停止后的日志不再进入队列；剩余记录转发后放入结束标志，
+        # 与本进程的记录经过同一个管道，写日志进程处理完之前的记录后才会看到它
+        ShutdownLogging()
+        self.queue.put(None)
+        self.__process.join()
+        self.__process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+
+if __name__ == "__main__":
+    # 对比：print加锁、同步写文件、日志管道三种方式输出大量记录时调用方的耗时
+    # wall为调用循环的实际耗时；cpu为调用线程自身的CPU时间，不包括转发线程和写日志进程，
+    # 单核机器上后台线程/进程与调用方分时运行，wall会包含它们的耗时
+    import tempfile
+    from multiprocessing import Lock
+
+    def Bench(name, func):
+        start, cpu = time.perf_counter(), time.thread_time()
+        func()
+        print("%-28s : wall %.3f us/record, cpu %.3f us/record" %
+              (name, (time.perf_counter() - start) / count * 1e6, (time.thread_time() - cpu) / count * 1e6))
+
+    count = 100000
+    tempdir = tempfile.mkdtemp()
+
+    lock = Lock()
+    devnull = open(os.devnull, "w")
+    def PrintUnderLock():
+        for i in range(count):
+            lock.acquire()
+            print(" Recv Sensor Data : ", i, file=devnull)
+            lock.release()
+    Bench("print under lock (devnull)", PrintUnderLock)
+
+    logger = logging.getLogger("bench")
+    logger.propagate = False
+    handler = logging.FileHandler(os.path.join(tempdir, "sync.log"))
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    def SyncFileHandler():
+        for i in range(count):
+            logger.info("Recv Sensor Data : %d", i)
+    Bench("synchronous FileHandler", SyncFileHandler)
+    logger.removeHandler(handler)
+    handler.close()
+
+    def PipelineInfo():
+        for i in range(count):
+            logging.info("Recv Sensor Data : %d", i)
+    def PipelineDebug():
+        for i in range(count):
+            logging.debug("Recv Sensor Data : %d", i)
+    with LogPipeline(os.path.join(tempdir, "pipeline.log"), console=False):
+        Bench("LogPipeline", PipelineInfo)
+        Bench("LogPipeline below level", PipelineDebug)
+    with open(os.path.join(tempdir, "pipeline.log")) as f:
+        print("records written by LogWriter : %d" % sum(1 for _ in f))
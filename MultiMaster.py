@@ -0,0 +1,379 @@
+# Python env   :
+# -*- coding: utf-8 -*-
+# @Time    : 2024/6/5 10:12
+# @Author  : 李清水
+# @File    : MultiMaster.py
+# @Description : 定义了多传感器主机调度类MultiMasterClass和传感器链路类SensorLink
+#                一个事件循环并发轮询多个串口上的传感器，每个传感器可以设置目标采样频率，
+#                需要时可以用RunSharded将链路分配到多个进程中，统计总采样速率
+
+# 异步IO相关库
+import asyncio
+# 有序字典，记录未完成的请求
+from collections import OrderedDict
+# 多进程相关
+from multiprocessing import Process, Queue
+# 时间操作相关
+import time
+# 日志输出相关库
+import logging
+# 使用typing模块提供的复合注解功能
+from typing import List
+# 异步串口主机类
+from AsyncSerial import AsyncSerialClass, AsyncMasterClass
+# 增量统计
+from Statistics import RunningStatistics
+# 固定容量的环形存储
+from Buffer import RingStore
+# 二进制帧协议
+from Frame import FRAME_DATA
+
+# 速率调度落后超过该时间（单位s）时不再补发，直接从当前时刻重新计时
+MAX_BACKLOG = 1.0
+
+
+class SensorLink:
+    '''
+    传感器链路类，记录一个串口上的传感器及其采集状态
+    '''
+    def __init__(self, port: str, rate: float = None, baudrate: int = 115200, binary: bool = False,
+                 window: int = 1, timeout: float = 0.3, retention: int = 10000, statwindow: int = 10):
+        '''
+        初始化方法
+        :param port: 串口设备路径
+        :param rate: 目标采样频率，单位Hz，为None时不限速
+        :param baudrate: 波特率
+        :param binary: 是否与传感器协商使用二进制帧协议
+        :param window: 未完成请求的个数，大于1时为流水线方式，不超过255
+        :param timeout: 等待回复的超时时间，单位s
+        :param retention: 内存中保留的样本个数
+        :param statwindow: 统计窗口长度
+        '''
+        self.port       = port
+        self.rate       = rate
+        self.binary     = binary
+        self.window     = max(1, min(window, 255))
+        self.master     = AsyncMasterClass(port, baudrate, timeout=timeout)
+        # 传感器ID号，未获取时为-1
+        self.id         = -1
+        # 收到的样本个数和丢失回复的请求个数
+        self.count      = 0
+        self.lost       = 0
+        # 链路出错时记录的异常
+        self.error      = None
+        # 开始采集的时刻
+        self.starttime  = None
+        # 样本缓存和增量统计
+        self.datalist   = RingStore(retention)
+        self.statistics = RunningStatistics(statwindow)
+
+    def HandleSample(self, data) -> None:
+        '''
+        处理一个接收到的样本
+        :param data: 传感器数据
+        :return: None
+        '''
+        self.count += 1
+        self.datalist.append(data)
+        self.statistics.push(data)
+
+    def Report(self, now: float = None) -> dict:
+        '''
+        返回该链路的采集情况
+        :param now: 当前时刻，time.perf_counter()
+        :return: 字典
+        '''
+        now = time.perf_counter() if now is None else now
+        elapsed = now - self.starttime if self.starttime is not None else 0.0
+        return {"port": self.port, "id": self.id, "count": self.count, "lost": self.lost,
+                "rate": self.count / elapsed if elapsed > 0 else 0.0,
+                "target": self.rate, "error": repr(self.error) if self.error is not None else None}
+
+
+class MultiMasterClass:
+    '''
+    多传感器主机调度类
+
+    每个传感器链路对应一个协程，所有协程在同一个事件循环中并发运行：
+    等待回复时让出事件循环，因此链路数增加时总吞吐量近似线性增长，直到CPU或链路饱和。
+    每个链路按各自的目标频率以time.perf_counter计算请求时刻，不会产生累计漂移；
+    每处理完一个回复都会让出一次事件循环，事件循环的就绪队列按先进先出执行，
+    不限速的链路也不会占满事件循环，各链路轮流得到调度。
+    '''
+    def __init__(self, links: List[SensorLink] = None, reportinterval: float = 1.0, callback=None):
+        '''
+        初始化方法
+        :param links: 传感器链路列表
+        :param reportinterval: 输出采集统计的间隔，单位s，为None时不输出
+        :param callback: 收到样本后调用的函数callback(link, data)，为None时不调用
+        '''
+        self.links          = list(links) if links is not None else []
+        self.reportinterval = reportinterval
+        self.callback       = callback
+        # 开始采集的时刻
+        self.starttime      = None
+        # 停止标志
+        self.__stopped      = False
+
+    def AddSensor(self, port: str, rate: float = None, **kwargs) -> SensorLink:
+        '''
+        添加一个传感器链路
+        :param port: 串口设备路径
+        :param rate: 目标采样频率，单位Hz，为None时不限速
+        :param kwargs: SensorLink的其他参数
+        :return: SensorLink对象
+        '''
+        link = SensorLink(port, rate, **kwargs)
+        self.links.append(link)
+        return link
+
+    def Stop(self) -> None:
+        '''
+        停止所有链路的采集
+        :return: None
+        '''
+        self.__stopped = True
+
+    async def StartLink(self, link: SensorLink) -> bool:
+        '''
+        打开链路串口，获取传感器ID号，按需协商二进制帧协议
+        :param link: 传感器链路
+        :return: bool，是否成功
+        '''
+        try:
+            await link.master.StartMaster()
+            link.id = await link.master.RecvSensorID()
+            if link.binary and not await link.master.NegotiateBinary():
+                logging.warning("MultiMasterClass-StartLink %s binary protocol refused", link.port)
+        except (OSError, asyncio.TimeoutError) as e:
+            link.error = e
+            logging.error("MultiMasterClass-StartLink %s : %r", link.port, e)
+            return False
+        logging.info("MultiMasterClass-StartLink %s sensor id : %d", link.port, link.id)
+        return True
+
+    async def PollLink(self, link: SensorLink) -> None:
+        '''
+        轮询一个链路：按目标频率发送SENDVALUE_CMD请求，最多保持window个未完成的请求
+        二进制帧协议下按帧序号匹配回复，文本协议下按先进先出匹配
+        :param link: 传感器链路
+        :return: None
+        '''
+        master   = link.master
+        binary   = master.protocol == AsyncSerialClass.BINARY_PROTOCOL
+        period   = 1.0 / link.rate if link.rate else 0.0
+        # 未完成的请求：帧序号 -> 发送时间
+        outstanding = OrderedDict()
+        seq      = 0
+        link.starttime = deadline = time.perf_counter()
+        while not self.__stopped:
+            now = time.perf_counter()
+            # 到达请求时刻时补足未完成的请求
+            while len(outstanding) < link.window and now >= deadline:
+                await master.SendSensorCMD(master.SENDVALUE_CMD, seq=seq)
+                outstanding[seq] = now
+                seq = (seq + 1) & 0xFF
+                if period:
+                    deadline += period
+                    if now - deadline > MAX_BACKLOG:
+                        deadline = now
+            if not outstanding:
+                # 限速：等待下一个请求时刻
+                await asyncio.sleep(deadline - now)
+                continue
+
+            frame = await master.read_frame()
+            if frame is None:
+                # 超时，认为所有未完成的请求都已丢失
+                link.lost += len(outstanding)
+                outstanding.clear()
+                continue
+            frametype, rxseq, values = frame
+            if frametype != FRAME_DATA:
+                continue
+            if binary:
+                if rxseq not in outstanding:
+                    continue
+                # 序号早于rxseq的请求不会再有回复
+                while True:
+                    reqseq, sendtime = outstanding.popitem(last=False)
+                    if reqseq == rxseq:
+                        break
+                    link.lost += 1
+            elif outstanding:
+                outstanding.popitem(last=False)
+            for data in values:
+                link.HandleSample(data)
+                if self.callback is not None:
+                    self.callback(link, data)
+            # 让出事件循环，保证各链路轮流调度
+            await asyncio.sleep(0)
+
+    async def RunLink(self, link: SensorLink) -> None:
+        '''
+        运行一个链路，链路出错时只停止该链路，不影响其他链路
+        :param link: 传感器链路
+        :return: None
+        '''
+        if not await self.StartLink(link):
+            return
+        try:
+            await self.PollLink(link)
+        except OSError as e:
+            link.error = e
+            logging.error("MultiMasterClass-RunLink %s : %r", link.port, e)
+        finally:
+            link.master.StopMaster()
+
+    def Report(self) -> dict:
+        '''
+        返回所有链路的采集情况和总采样速率
+        :return: 字典
+        '''
+        now = time.perf_counter()
+        links = [link.Report(now) for link in self.links]
+        elapsed = now - self.starttime if self.starttime is not None else 0.0
+        samples = sum(item["count"] for item in links)
+        return {"samples": samples, "lost": sum(item["lost"] for item in links),
+                "elapsed": elapsed, "rate": samples / elapsed if elapsed > 0 else 0.0,
+                "links": links}
+
+    async def __Reporter(self) -> None:
+        '''
+        定时输出总采样速率，私有方法
+        :return: None
+        '''
+        lastcount, lasttime = 0, time.perf_counter()
+        while not self.__stopped:
+            await asyncio.sleep(self.reportinterval)
+            now = time.perf_counter()
+            count = sum(link.count for link in self.links)
+            logging.info("MultiMasterClass %d links : %.0f samples/s, lost %d",
+                         len(self.links), (count - lastcount) / (now - lasttime),
+                         sum(link.lost for link in self.links))
+            lastcount, lasttime = count, now
+
+    async def run(self, duration: float = None) -> dict:
+        '''
+        并发运行所有链路
+        :param duration: 运行时间，单位s，为None时一直运行到调用Stop()
+        :return: Report()的结果
+        '''
+        self.__stopped = False
+        self.starttime = time.perf_counter()
+        tasks = [asyncio.ensure_future(self.RunLink(link)) for link in self.links]
+        reporter = None
+        if self.reportinterval:
+            reporter = asyncio.ensure_future(self.__Reporter())
+        try:
+            if duration is None:
+                await asyncio.gather(*tasks)
+            else:
+                await asyncio.wait(tasks, timeout=duration)
+                self.Stop()
+                await asyncio.gather(*tasks)
+        finally:
+            self.Stop()
+            if reporter is not None:
+                reporter.cancel()
+        return self.Report()
+
+
+def _ShardWorker(queue, ports, duration: float, kwargs: dict) -> None:
+    '''
+    RunSharded的子进程入口，在本进程的事件循环中运行分配到的链路，并将结果放入队列
+    :param queue: 结果队列
+    :param ports: (串口设备路径, 目标采样频率)列表
+    :param duration: 运行时间，单位s
+    :param kwargs: SensorLink的其他参数
+    :return: None
+    '''
+    master = MultiMasterClass(reportinterval=None)
+    for port, rate in ports:
+        master.AddSensor(port, rate, **kwargs)
+    queue.put(asyncio.run(master.run(duration)))
+
+def RunSharded(ports, workers: int = 2, duration: float = 10.0, **kwargs) -> dict:
+    '''
+    将链路轮流分配到workers个进程中，每个进程一个事件循环，突破单个CPU核心的限制
+    :param ports: 串口设备路径列表，或(串口设备路径, 目标采样频率)列表
+    :param workers: 进程个数
+    :param duration: 运行时间，单位s
+    :param kwargs: SensorLink的其他参数
+    :return: 合并后的采集情况字典，rate为总采样速率
+    '''
+    ports = [(port, None) if isinstance(port, str) else tuple(port) for port in ports]
+    workers = max(1, min(workers, len(ports)))
+    queue = Queue()
+    processes = [Process(target=_ShardWorker, args=(queue, ports[i::workers], duration, kwargs))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    # 先取结果再join，避免子进程阻塞在队列写入上
+    reports = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    links = [item for report in reports for item in report["links"]]
+    samples = sum(report["samples"] for report in reports)
+    elapsed = max(report["elapsed"] for report in reports)
+    return {"samples": samples, "lost": sum(report["lost"] for report in reports),
+            "elapsed": elapsed, "rate": samples / elapsed if elapsed > 0 else 0.0,
+            "links": links}
+
+
+if __name__ == "__main__":
+    # 用pty对模拟多个传感器：传感器在单独的进程中运行，主机分别用1个和多个进程采集
+    import os
+    import tty
+    from Frame import LineDecoder, EncodeLines
+
+    def FakeSensors(fds):
+        # 模拟传感器：SENDID_CMD回复ID号，SENDVALUE_CMD回复递增的数据
+        async def Sensor(fd, id):
+            loop = asyncio.get_running_loop()
+            decoder = LineDecoder()
+            value = 0
+            while True:
+                ready = loop.create_future()
+                loop.add_reader(fd, ready.set_result, None)
+                await ready
+                loop.remove_reader(fd)
+                try:
+                    decoder.feed(os.read(fd, 65536))
+                except OSError:
+                    return
+                replies = []
+                for cmd in decoder.values():
+                    if cmd == AsyncMasterClass.SENDID_CMD:
+                        replies.append(id)
+                    elif cmd == AsyncMasterClass.SENDVALUE_CMD:
+                        value = (value + 1) & 0x7FFF
+                        replies.append(value)
+                os.write(fd, EncodeLines(replies))
+
+        async def Main():
+            await asyncio.gather(*[Sensor(fd, id) for id, fd in enumerate(fds)])
+        asyncio.run(Main())
+
+    logging.basicConfig(level=logging.WARNING)
+    sensorfds, ports = [], []
+    for _ in range(64):
+        sensorfd, masterfd = os.openpty()
+        tty.setraw(sensorfd)
+        os.set_blocking(sensorfd, False)
+        sensorfds.append(sensorfd)
+        ports.append(os.ttyname(masterfd))
+    # 传感器同样分布在4个进程中，避免模拟端成为瓶颈
+    sensors = [Process(target=FakeSensors, args=(sensorfds[i::4],), daemon=True) for i in range(4)]
+    for sensor in sensors:
+        sensor.start()
+
+    for workers in (1, 2, 4):
+        report = RunSharded(ports, workers=workers, duration=3.0, window=4)
+        print("%d workers, %d links : %.0f samples/s, lost %d" %
+              (workers, len(ports), report["rate"], report["lost"]))
+    # 限速：每个链路目标频率50Hz
+    report = RunSharded([(port, 50) for port in ports], workers=1, duration=3.0)
+    print("rate limited 50Hz x %d links : %.0f samples/s" % (len(ports), report["rate"]))
+    for sensor in sensors:
+        sensor.terminate()
@@ -7,22 +7,47 @@
 
 # 串口相关
 import serial
+# 有序字典，记录未完成的请求；双端队列，保存尚未配对的样本
+from collections import OrderedDict, deque
+# 非阻塞读取队列为空时的异常
+from queue import Empty
 # 并行并发相关
 from threading import Thread
 from multiprocessing import Process
 from multiprocessing import Queue , SimpleQueue
 from multiprocessing import Lock
+from multiprocessing import Event
 # 数学计算相关
 import math
 import random
 # 时间操作相关
 import time
-# 曲线作图相关库
-import pyqtgraph as pg
-from pyqtgraph.Qt import QtCore
 # 使用typing模块提供的复合注解功能
 from typing import List
-
+# 滤波器类、滤波器类型枚举类及注册表
+from Filter import FilterType, FilterRegistry, CreateFilter, MovingAverageArray
+# 增量统计
+from Statistics import RunningStatistics
+# 固定容量的环形存储、共享内存环形缓冲区
+from Buffer import RingStore, SharedRingBuffer
+# 滑动窗口绘图数据
+from Decimate import SlidingWindow
+# 延迟导入Qt，Plot模块导入时不加载Qt
+from Plot import ImportQt
+# 二进制帧协议
+from Frame import EncodeFrame, FrameValue, FrameDecoder, LineDecoder, ReadFrame, LoopSend, RateFromArgs, FRAME_DATA, FRAME_CMD, FRAME_ID
+# 日志输出相关库，控制台输出经日志管道由写日志进程统一完成
+import logging
+from LogPipeline import LogPipeline, ConfigureLogging
+# 分段滚动的样本日志，重启后接着原来的索引继续
+from SampleLog import SampleLogClass
+
+from Archive import ArchiveFileIOClass
+
+# 曲线作图相关库，创建PlotThread时由Plot.ImportQt导入，
+# 子进程和不绘图的程序不加载pyqtgraph和Qt
+pg     = None
+QtCore = None
 
 # 主机多进程类
 class MasterProcess(Process):
@@ -34,7 +59,17 @@ class MasterProcess(Process):
     #   STOP_CMD        - 关闭命令      -1
     #   SENDID_CMD      - 发送ID命令    -2
     #   SENDVALUE_CMD   - 发送数据命令   -3
-    START_CMD, STOP_CMD, SENDID_CMD, SENDVALUE_CMD = (0, 1, 2, 3)
+    #   BINARY_CMD      - 切换二进制帧协议命令 -4
+    START_CMD, STOP_CMD, SENDID_CMD, SENDVALUE_CMD, BINARY_CMD = (0, 1, 2, 3, 4)
+    # 类变量：
+    #   ASCII_PROTOCOL  - 文本协议，每个数值一行  -0
+    #   BINARY_PROTOCOL - 二进制帧协议           -1
+    ASCII_PROTOCOL, BINARY_PROTOCOL = (0, 1)
+    # 类变量：
+    #   POLL_MODE       - 轮询模式，一问一答  -0
+    #   PIPELINE_MODE   - 流水线模式，保持多个未完成请求 -1
+    #   STREAM_MODE     - 流式模式，传感器按频率主动发送 -2
+    ACQ_MODE = {"POLL_MODE": 0, "PIPELINE_MODE": 1, "STREAM_MODE": 2}
 
     def __init__(self,
                  lock,
@@ -44,18 +79,43 @@ class MasterProcess(Process):
                  baudrate:int = 115200,
                  bytesize:int = serial.EIGHTBITS,
                  parity  :str = serial.PARITY_NONE,
-                 stopbits:int = serial.STOPBITS_ONE):
+                 stopbits:int = serial.STOPBITS_ONE,
+                 retention:int = 100000,
+                 spillpath:str = None,
+                 binary:bool = False,
+                 acqmode:int = ACQ_MODE["POLL_MODE"],
+                 window:int = 8,
+                 rate:int = 100,
+                 logqueue = None,
+                 loglevel:int = logging.INFO,
+                 ringbuffer:SharedRingBuffer = None,
+                 samplelogpath:str = None,
+                 archivepath:str = None):
         '''
         MasterProcess初始化函数
-        :param lock: 互斥锁
+        :param lock: 互斥锁，输出已改为通过日志管道，保留该参数以兼容原有调用
         :param Queue: 队列
         :param port: 端口号
         :param baudrate: 波特率
         :param bytesize: 数据位
         :param parity: 校验位
         :param stopbits: 停止位
+        :param retention: 内存中保留的样本个数
+        :param spillpath: 超出保留窗口的旧样本溢写文件路径，为None时丢弃
+        :param binary: 是否在启动后与传感器协商使用二进制帧协议
+        :param acqmode: 采集模式，ACQ_MODE中的值
+        :param window: 流水线模式下未完成请求的个数，不超过255
+        :param rate: 流式模式下请求传感器发送数据的频率，单位Hz，仅二进制帧协议下可以传给传感器
+        :param logqueue: LogPipeline的日志队列，spawn方式启动子进程时用于在子进程中配置日志
+        :param loglevel: 子进程的日志级别
+        :param ringbuffer: 共享内存环形缓冲区，不为None时原始值、滤波值和时间戳写入其中，不再使用Queue和simplequeue
+        :param samplelogpath: 样本日志目录，不为None时每个样本追加到SampleLogClass，重启后索引接着日志中最后一条有效记录继续
+        :param archivepath: 压缩归档文件路径，不为None时每个样本同时写入ArchiveFileIOClass，进程停止时写出块索引；
+                            每次启动重新创建该文件
         '''
         self.lock               = lock
+        self.logqueue           = logqueue
+        self.loglevel           = loglevel
         self.Queue              = Queue
         self.simplequeue        = simplequeue
         self.dev                = serial.Serial()
@@ -68,12 +128,40 @@ class MasterProcess(Process):
         self.dev.timeout        = 0.3
         # 设置写入timeout超时时间
         self.dev.write_timeout  = 0.3
-        # 数据缓存
-        self.datalist           = []
+        # 通信协议，启动时为文本协议
+        self.protocol           = MasterProcess.ASCII_PROTOCOL
+        # 是否协商二进制帧协议
+        self.binary             = binary
+        # 二进制帧解码器
+        self.decoder            = FrameDecoder()
+        # 文本协议解码器，流水线模式下批量解码
+        self.linedecoder        = LineDecoder()
+        # 采集模式
+        self.acqmode            = acqmode
+        # 流水线模式下未完成请求的个数
+        self.window             = max(1, min(window, 255))
+        # 流水线模式下丢失回复的请求个数
+        self.lost               = 0
+        # 流式模式下的发送频率
+        self.rate               = rate
+        # 与PlotThread共享的环形缓冲区
+        self.ringbuffer         = ringbuffer
+        # 样本日志目录，日志对象在子进程的run中打开
+        self.samplelogpath      = samplelogpath
+        self.samplelog          = None
+        # 压缩归档文件路径，归档对象同样在子进程的run中打开
+        self.archivepath        = archivepath
+        self.archive            = None
+        # 文件保存索引计数变量
+        self.index              = 0
+        # 数据缓存，固定容量的环形存储，长时间运行时内存占用不再增长
+        self.datalist           = RingStore(retention, spillpath)
         # 滤波器长度
         self.filterlength       = 3
         # 数据处理类实例
         self.dataprocessobj     = DateProcessClass(self.datalist,self.filterlength)
+        # 停止事件，由父进程调用Stop设置，采集循环每轮检查一次
+        self.stopevent          = Event()
         # Process初始化方法
         Process.__init__(self)
 
@@ -91,11 +179,24 @@ class MasterProcess(Process):
         '''
         self.dev.close()
 
+    def Stop(self):
+        '''
+        请求主机进程停止，在父进程中调用
+        采集循环在当前一轮结束后退出，run中关闭样本日志、环形缓冲区和串口后进程正常结束，
+        调用方随后join等待即可
+        :return: None
+        '''
+        self.stopevent.set()
+
     def __ReadMasterSerial(self):
         '''
         读取主机串口，私有方法
         :return data[int] : 读取的数据
         '''
+        # 二进制帧协议：取出帧中的第一个数值，超时返回-1
+        if self.protocol == MasterProcess.BINARY_PROTOCOL:
+            frame = ReadFrame(self.dev, self.decoder)
+            return frame[2][0] if frame is not None and frame[2] else -1
         # 按行读取
         data = self.dev.readline()
         # 如果接收到字节的情况下，进行处理
@@ -109,12 +210,17 @@ class MasterProcess(Process):
             data = -1
         return data
 
-    def __WriteMasterSerial(self,write_data):
+    def __WriteMasterSerial(self,write_data,frametype:int = FRAME_DATA):
         '''
         写入主机串口，私有方法
         :param write_data: 写入的数据
+        :param frametype: 二进制帧协议下的帧类型
         :return:
         '''
+        # 二进制帧协议：数值打包为一帧发送
+        if self.protocol == MasterProcess.BINARY_PROTOCOL:
+            self.dev.write(EncodeFrame(frametype, [FrameValue(write_data)]))
+            return
         # 非阻塞方式写入
         self.dev.write(write_data.encode())
         # 输出换行符
@@ -145,7 +251,20 @@ class MasterProcess(Process):
         :param cmd : MasterProcess中的类变量
         :return: None
         '''
-        self.__WriteMasterSerial(str(cmd))
+        self.__WriteMasterSerial(str(cmd),FRAME_CMD)
+
+    def NegotiateBinary(self):
+        '''
+        发送BINARY_CMD命令，收到传感器的确认后双方切换为二进制帧协议
+        :return: bool，是否切换成功
+        '''
+        self.SendSensorCMD(self.BINARY_CMD)
+        ack = self.__ReadMasterSerial()
+        if ack == self.BINARY_CMD:
+            self.protocol = MasterProcess.BINARY_PROTOCOL
+            self.decoder  = FrameDecoder()
+            return True
+        return False
 
     def run(self):
         '''
@@ -153,61 +272,200 @@ class MasterProcess(Process):
         :return: None
         '''
 
+        # spawn方式启动的子进程不会继承父进程的日志配置
+        if self.logqueue is not None:
+            ConfigureLogging(self.logqueue, self.loglevel)
+
         # 运行计数变量
-        count = 0
-        # 文件保存索引计数变量
-        index = 0
+        self.count = 0
+        # 文件保存索引计数变量，有样本日志时从日志恢复，只读取每段的尾部
+        if self.samplelogpath is not None:
+            self.samplelog = SampleLogClass(self.samplelogpath)
+            self.index = self.samplelog.nextindex
+            logging.info(" Sample Log Resume Index : %s", self.index)
+        if self.archivepath is not None:
+            self.archive = ArchiveFileIOClass(self.archivepath)
 
         # 打开串口
         self.StartMasterSerial()
 
-        self.lock.acquire()
-        print(" Master Process Started ")
-        self.lock.release()
+        logging.info(" Master Process Started ")
 
         # 发送获取ID指令
         self.SendSensorCMD(self.SENDID_CMD)
         # 获取传感器ID号
         id = self.RecvSensorID()
 
-        self.lock.acquire()
-        print(" Recv Sensor ID : ", id)
-        self.lock.release()
+        logging.info(" Recv Sensor ID : %s", id)
 
-        while True:
-            if count == 9:
-                maxvalue = self.dataprocessobj.DateCalMax()
-                minvalue = self.dataprocessobj.DateCalMin()
-                self.lock.acquire()
-                print("----------------------------------")
-                print("Max Value: ", maxvalue)
-                print("Min Value: ", minvalue)
-                print("----------------------------------")
-                self.lock.release()
-                count = 0
+        # 协商二进制帧协议
+        if self.binary:
+            result = self.NegotiateBinary()
+            logging.info(" Binary Protocol : %s", result)
+
+        try:
+            if self.acqmode == MasterProcess.ACQ_MODE["PIPELINE_MODE"]:
+                self.PipelineLoop()
+            elif self.acqmode == MasterProcess.ACQ_MODE["STREAM_MODE"]:
+                self.StreamLoop()
             else:
-                count = count + 1
+                self.PollLoop()
+        finally:
+            # 写出并关闭样本日志和压缩归档，断开与共享内存的连接（释放由创建方负责），最后关闭串口
+            if self.samplelog is not None:
+                self.samplelog.CloseFile()
+            if self.archive is not None:
+                self.archive.CloseFile()
+            if self.ringbuffer is not None:
+                self.ringbuffer.close()
+            self.StopMasterSerial()
+            logging.info(" Master Process Stopped ")
+
+    def HandleSample(self,data):
+        '''
+        处理一个接收到的传感器数据：送入队列、缓存、滤波，每10个数据输出一次统计量
+        :param data: 传感器数据
+        :return: None
+        '''
+        if self.count == 9:
+            # 统计量由DateFilter增量更新，这里读取为O(1)
+            maxvalue = self.dataprocessobj.DateCalMax()
+            minvalue = self.dataprocessobj.DateCalMin()
+            statistics = self.dataprocessobj.statistics
+            logging.info("----------------------------------\n"
+                         "Max Value: %s\n"
+                         "Min Value: %s\n"
+                         "Window Max/Min Value: %s %s\n"
+                         "Mean/Std Value: %.3f / %.3f\n"
+                         "----------------------------------",
+                         maxvalue, minvalue, statistics.windowmax, statistics.windowmin,
+                         statistics.mean, statistics.std)
+            self.count = 0
+        else:
+            self.count = self.count + 1
+
+        self.datalist.append(data)
+        filterdata,filterdatalist = self.dataprocessobj.DateFilter()
+
+        if self.samplelog is not None:
+            self.samplelog.WriteFile((self.index,), (data,))
+        if self.archive is not None:
+            self.archive.WriteFile((self.index,), (data,))
+        self.index += 1
 
+        if self.ringbuffer is not None:
+            # 直接写入共享内存，缓冲区满时丢弃该行并计入overruns，不阻塞采集
+            self.ringbuffer.push((data, filterdata, time.time()))
+        else:
+            self.Queue.put(data)
+            self.simplequeue.put(filterdata)
+
+        logging.debug("  Recv Sensor Data : %s", data)
+
+    def PollLoop(self):
+        '''
+        轮询模式：每次发送一条SENDVALUE_CMD命令，等待回复后延时0.5s
+        :return: None
+        '''
+        while not self.stopevent.is_set():
             # 发送获取数据指令
             self.SendSensorCMD(self.SENDVALUE_CMD)
 
-            self.lock.acquire()
-            print("Master Send SENDVALUE_CMD")
-            self.lock.release()
+            logging.debug("Master Send SENDVALUE_CMD")
 
             # 接收传感器数据值
             data = self.RecvSensorValue()
-            self.Queue.put(data)
+            self.HandleSample(data)
 
-            self.datalist.append(data)
-            filterdata,filterdatalist = self.dataprocessobj.DateFilter()
-            self.simplequeue.put(filterdata)
+            time.sleep(0.5)
 
-            self.lock.acquire()
-            print("  Recv Sensor Data : ",data)
-            self.lock.release()
+    def StreamLoop(self):
+        '''
+        流式模式：发送START_CMD命令使传感器进入循环模式主动发送数据，主机只需批量接收，
+        没有请求-回复的往返延迟
+        :return: None
+        '''
+        if self.protocol == MasterProcess.BINARY_PROTOCOL:
+            # 二进制帧协议下START_CMD携带发送频率
+            self.dev.write(EncodeFrame(FRAME_CMD, [self.START_CMD, FrameValue(self.rate)]))
+        else:
+            self.SendSensorCMD(self.START_CMD)
+
+        logging.info("Master Send START_CMD")
+
+        while not self.stopevent.is_set():
+            # 一次取走串口中已经到达的全部数据
+            chunk = self.dev.read(max(1, self.dev.in_waiting))
+            if not chunk:
+                continue
+            if self.protocol == MasterProcess.BINARY_PROTOCOL:
+                self.decoder.feed(chunk)
+                for frametype, rxseq, values in self.decoder.frames():
+                    if frametype == FRAME_DATA:
+                        for data in values:
+                            self.HandleSample(data)
+            else:
+                self.linedecoder.feed(chunk)
+                for data in self.linedecoder.values():
+                    self.HandleSample(data)
 
-            time.sleep(0.5)
+        # 停止时让传感器退出循环模式
+        self.SendSensorCMD(self.STOP_CMD)
+
+    def PipelineLoop(self):
+        '''
+        流水线模式：始终保持window个未完成的SENDVALUE_CMD请求，不再逐个等待往返，
+        吞吐量只受链路速度限制
+        二进制帧协议下按帧序号匹配回复，早于回复序号的请求视为丢失；
+        文本协议下串口按顺序传输，按先进先出匹配
+        :return: None
+        '''
+        # 未完成的请求：帧序号 -> 发送时间
+        outstanding = OrderedDict()
+        seq = 0
+        while not self.stopevent.is_set():
+            # 补足未完成的请求，多条命令合并为一次write
+            requests = []
+            while len(outstanding) < self.window:
+                if self.protocol == MasterProcess.BINARY_PROTOCOL:
+                    requests.append(EncodeFrame(FRAME_CMD, [self.SENDVALUE_CMD], seq))
+                else:
+                    requests.append(('%d\r\n' % self.SENDVALUE_CMD).encode())
+                outstanding[seq] = time.perf_counter()
+                seq = (seq + 1) & 0xFF
+            if requests:
+                self.dev.write(b''.join(requests))
+
+            if self.protocol == MasterProcess.BINARY_PROTOCOL:
+                frame = ReadFrame(self.dev, self.decoder)
+                if frame is None:
+                    # 超时，认为所有未完成的请求都已丢失，重新发送
+                    self.lost += len(outstanding)
+                    outstanding.clear()
+                    continue
+                frametype, rxseq, values = frame
+                if frametype != FRAME_DATA or rxseq not in outstanding:
+                    continue
+                # 串口按顺序传输，序号早于rxseq的请求不会再有回复
+                while True:
+                    reqseq, sendtime = outstanding.popitem(last=False)
+                    if reqseq == rxseq:
+                        break
+                    self.lost += 1
+                for data in values:
+                    self.HandleSample(data)
+            else:
+                # 文本协议下-1也是合法的传感器数据，用读取结果是否为空判断超时
+                chunk = self.dev.read(max(1, self.dev.in_waiting))
+                if not chunk:
+                    self.lost += len(outstanding)
+                    outstanding.clear()
+                    continue
+                self.linedecoder.feed(chunk)
+                for data in self.linedecoder.values():
+                    if outstanding:
+                        outstanding.popitem(last=False)
+                    self.HandleSample(data)
 
 class SensorThread(Thread):
     '''
@@ -226,15 +484,23 @@ class SensorThread(Thread):
     #   STOP_CMD        - 关闭命令      -1
     #   SENDID_CMD      - 发送ID命令    -2
     #   SENDVALUE_CMD   - 发送数据命令   -3
-    NONE_CMD, START_CMD, STOP_CMD, SENDID_CMD, SENDVALUE_CMD = (-1, 0, 1, 2, 3)
+    #   BINARY_CMD      - 切换二进制帧协议命令 -4
+    NONE_CMD, START_CMD, STOP_CMD, SENDID_CMD, SENDVALUE_CMD, BINARY_CMD = (-1, 0, 1, 2, 3, 4)
+    # 类变量：
+    #   ASCII_PROTOCOL  - 文本协议，每个数值一行  -0
+    #   BINARY_PROTOCOL - 二进制帧协议           -1
+    ASCII_PROTOCOL, BINARY_PROTOCOL = (0, 1)
 
-    def __init__(self, lock, port: str = "COM11", id: int = 0, state: int = WORK_MODE["RESPOND_MODE"]):
+    def __init__(self, lock, port: str = "COM11", id: int = 0, state: int = WORK_MODE["RESPOND_MODE"],
+                 rate: float = 100.0, batchinterval: float = 0.005):
         '''
         传感器类的初始化
-        :param lock: 互斥锁
+        :param lock: 互斥锁，输出已改为通过日志管道，保留该参数以兼容原有调用
         :param port: 端口号
         :param id: 传感器id
         :param state: 工作状态
+        :param rate: 循环模式下的采样发送频率，单位Hz
+        :param batchinterval: 循环模式下两次写入的最小间隔，单位s，频率较高时多个样本合并为一次写入
         '''
         self.lock = lock
 
@@ -252,6 +518,19 @@ class SensorThread(Thread):
         self.dev.timeout = 0.3
         # 设置写入timeout超时时间
         self.dev.write_timeout = 0.3
+        # 通信协议，启动时为文本协议，收到BINARY_CMD后切换
+        self.protocol       = SensorThread.ASCII_PROTOCOL
+        # 二进制帧解码器
+        self.decoder        = FrameDecoder()
+        # 最近一次收到的命令帧序号，回复时原样带回，供主机匹配请求
+        self.rxseq          = 0
+        # 最近一次收到的命令参数，如START_CMD携带的发送频率
+        self.rxargs         = ()
+        # 循环模式的发送频率和最小写入间隔
+        self.rate           = rate
+        self.batchinterval  = batchinterval
+        # 生成数据的计数变量
+        self.datacount      = 0
 
         # Thread的初始化方法
         Thread.__init__(self)
@@ -275,6 +554,14 @@ class SensorThread(Thread):
         读取传感器串口，私有方法
         :return data[int] : 读取的数据
         '''
+        # 二进制帧协议：取出帧中的第一个数值，超时返回-1
+        if self.protocol == SensorThread.BINARY_PROTOCOL:
+            frame = ReadFrame(self.dev, self.decoder)
+            if frame is None or not frame[2]:
+                return -1
+            self.rxseq  = frame[1]
+            self.rxargs = frame[2][1:]
+            return frame[2][0]
         # 按行读取
         data = self.dev.readline()
         # 如果接收到字节的情况下，进行处理
@@ -288,12 +575,17 @@ class SensorThread(Thread):
             data = -1
         return data
 
-    def __WriteSensorSerial(self,write_data):
+    def __WriteSensorSerial(self,write_data,frametype:int = FRAME_DATA):
         '''
         写入传感器串口，私有方法
         :param write_data: 写入的数据
+        :param frametype: 二进制帧协议下的帧类型
         :return:
         '''
+        # 二进制帧协议：数值打包为一帧发送，带回命令帧的序号
+        if self.protocol == SensorThread.BINARY_PROTOCOL:
+            self.dev.write(EncodeFrame(frametype, [FrameValue(write_data)], self.rxseq))
+            return
         # 非阻塞方式写入
         self.dev.write(write_data.encode())
         # 输出换行符
@@ -307,7 +599,7 @@ class SensorThread(Thread):
         发送传感器ID号
         :return: None
         '''
-        self.__WriteSensorSerial(str(self.sensorid))
+        self.__WriteSensorSerial(str(self.sensorid),FRAME_ID)
 
     def SendSensorValue(self,data):
         '''
@@ -325,50 +617,85 @@ class SensorThread(Thread):
         cmd = self.__ReadSensorSerial()
         return cmd
 
+    def MakeSensorValue(self):
+        '''
+        生成一个模拟的传感器数据：正弦信号叠加均匀噪声
+        :return data[int] : 传感器数据
+        '''
+        # 生成数据
+        self.datacount = self.datacount + 1
+        # 原始信号
+        signal = math.sin(self.datacount) * 10
+        # 模拟噪声
+        noise = random.uniform(0, 5)
+        # 最终数据
+        return int(signal + noise)
+
+    def LoopRun(self):
+        '''
+        循环模式：按rate频率持续主动发送数据，直到收到STOP_CMD命令
+        :return: None
+        '''
+        self.rate = LoopSend(self.dev, self.MakeSensorValue, self.rate, self.batchinterval,
+                             self.protocol == SensorThread.BINARY_PROTOCOL,
+                             lambda: self.sensorstate == SensorThread.WORK_MODE["LOOP_MODE"],
+                             self.__LoopCommand)
+
+    def __LoopCommand(self):
+        '''
+        循环模式下处理主机命令，私有方法
+        :return: 当前的发送频率
+        '''
+        cmd = self.RecvMasterCMD()
+        if cmd == SensorThread.STOP_CMD:
+            # 循环模式下STOP_CMD只停止主动发送，回到响应模式
+            self.sensorstate = SensorThread.WORK_MODE["RESPOND_MODE"]
+        elif cmd == SensorThread.START_CMD:
+            # 运行中收到新的START_CMD，更新发送频率
+            self.rate = RateFromArgs(self.rxargs, self.rate)
+        return self.rate
+
     def run(self):
         '''
         多进程start后运行的方法
         :return: None
         '''
 
-        # 初始化计数变量
-        data_count = 0
         # 开启传感器
         self.StartSensorSerial()
 
-        self.lock.acquire()
-        print(" Sensor Thread Started ")
-        self.lock.release()
+        logging.info(" Sensor Thread Started ")
 
         while True:
+            # 循环模式下主动发送数据，收到STOP_CMD后回到响应模式
+            if self.sensorstate == SensorThread.WORK_MODE["LOOP_MODE"]:
+                self.LoopRun()
+
             # 生成数据
-            data_count = data_count + 1
-            # 原始信号
-            signal = math.sin(data_count) * 10
-            # 模拟噪声
-            noise = random.uniform(0, 5)
-            # 最终数据
-            data = int(signal + noise)
+            data = self.MakeSensorValue()
 
             # 接收命令
             cmd = self.RecvMasterCMD()
 
-            self.lock.acquire()
-            print(" Sensor Recv CMD : ",cmd)
-            self.lock.release()
+            logging.debug(" Sensor Recv CMD : %s", cmd)
 
             # 根据命令进行相关操作
             if cmd == SensorThread.STOP_CMD:
                 # 如果接收到停止命令，停止传感器
-                self.StopSensor()
+                self.StopSensorSerial()
 
-                self.lock.acquire()
                 # 输出提示信息
-                print("Sensor stop work !!!")
-                self.lock.release()
+                logging.info("Sensor stop work !!!")
 
                 return
 
+            elif cmd == SensorThread.START_CMD:
+                # 如果接收到开启命令，进入循环模式，命令参数为发送频率
+                self.rate = RateFromArgs(self.rxargs, self.rate)
+                self.sensorstate = SensorThread.WORK_MODE["LOOP_MODE"]
+
+                logging.info(" Sensor Start Loop Mode : %s Hz", self.rate)
+
             elif cmd == SensorThread.SENDID_CMD:
                 # 如果接收到发送ID命令，发送传感器ID号
                 self.SendSensorID()
@@ -377,32 +704,59 @@ class SensorThread(Thread):
                 # 如果接收到发送数据命令，发送数据
                 self.SendSensorValue(data)
 
-                self.lock.acquire()
                 # 输出提示信息
-                print(" Sensor Send Data : ",data)
-                self.lock.release()
+                logging.debug(" Sensor Send Data : %s", data)
+
+            elif cmd == SensorThread.BINARY_CMD:
+                # 如果接收到切换协议命令，先按文本协议回复确认，再切换为二进制帧协议
+                self.__WriteSensorSerial(str(SensorThread.BINARY_CMD))
+                self.protocol = SensorThread.BINARY_PROTOCOL
+                self.decoder  = FrameDecoder()
+
+                logging.info(" Sensor Switch To Binary Protocol ")
 
             elif cmd == SensorThread.NONE_CMD:
-                self.lock.acquire()
                 # 如果没有接收到指令
-                print("Not Recv cmd!!!")
-                self.lock.release()
+                logging.debug("Not Recv cmd!!!")
 
-            # 延时0.5s
-            time.sleep(0.5)
+            # 响应模式下不再固定延时0.5s：读取命令时的timeout已经起到等待作用，
+            # 收到命令后立即处理下一条，主机可以连续发送多条命令
 
 class PlotThread:
-    def __init__(self,lock,queue,simplequeue,wintitle:str="Basic plotting examples",plottitle:str="Updating plot",width:int=1000,height:int=600):
+    def __init__(self,lock,queue,simplequeue,wintitle:str="Basic plotting examples",plottitle:str="Updating plot",width:int=1000,height:int=600,retention:int=100000,ringbuffer:SharedRingBuffer = None,maxbatch:int = 10000,window:int = None,maxpoints:int = 2000):
         '''
         用于初始化PlotThread类
         :param wintitle:  窗口标题
         :param plottitle: 图层标题
         :param width:     窗口宽度
         :param height:    窗口高度
+        :param retention: 缓存的样本个数
+        :param ringbuffer: 共享内存环形缓冲区，不为None时从中批量读取数据，不再使用queue和simplequeue
+        :param maxbatch:  每次定时更新最多取出的样本个数，避免积压过多时长时间占用Qt事件循环
+        :param window:    滑动窗口长度，只绘制最近window个样本，为None时绘制全部缓存数据
+        :param maxpoints: 滑动窗口模式下每帧绘制的最大点数，超过时按min/max抽取
         '''
         self.lock               = lock
+        self.ringbuffer         = ringbuffer
         self.queue              = queue
         self.simplequeue        = simplequeue
+        self.maxbatch           = maxbatch
+        # 已取出但还没有配对的原始值/滤波值（两个队列中的数据可能不同时到达）
+        self.__rawpending       = deque()
+        self.__filterpending    = deque()
+        # 运行指标：
+        #   ticks       —— 定时更新次数
+        #   drained     —— 最近一次取出的样本个数
+        #   backlog     —— 最近一次取出后仍在等待的样本个数
+        #   maxbacklog  —— backlog的最大值
+        #   lag         —— 最近一次绘制的最新样本距当前的时间，单位s，只有共享内存环形缓冲区带有时间戳
+        #   rendertime  —— 最近一次更新的耗时，单位s
+        self.ticks              = 0
+        self.drained            = 0
+        self.backlog            = 0
+        self.maxbacklog         = 0
+        self.lag                = None
+        self.rendertime         = 0.0
         # Qt应用实例对象
         self.app                = None
         # 窗口对象
@@ -418,10 +772,16 @@ class PlotThread:
         self.filtervalue        = 0
         # 计数变量
         self.__count            = 0
-        # 传感器数据缓存列表
-        self.valuelist          = []
-        # 传感器滤波数据缓存列表
-        self.filtervaluelist    = []
+        # 传感器数据缓存，固定容量的环形存储
+        self.valuelist          = RingStore(retention)
+        # 传感器滤波数据缓存，固定容量的环形存储
+        self.filtervaluelist    = RingStore(retention)
+        # 滑动窗口绘图，直接读取上面两个环形存储
+        self.valuewindow        = None
+        self.filterwindow       = None
+        if window is not None:
+            self.valuewindow    = SlidingWindow(self.valuelist, window, maxpoints)
+            self.filterwindow   = SlidingWindow(self.filtervaluelist, window, maxpoints)
         # 绘图曲线
         self.curve              = None
         # 滤波后绘图曲线
@@ -431,15 +791,15 @@ class PlotThread:
         # 图层标题
         self.plottitle          = plottitle
         # 定时器对象
+        global pg, QtCore
+        pg, QtCore              = ImportQt()
         self.timer              = QtCore.QTimer()
         # 定时时间
         self.time               = 0
         # Qt应用和窗口初始化
         self.appinit()
 
-        self.lock.acquire()
-        print(" PlotClass Object Init Complete ")
-        self.lock.release()
+        logging.info(" PlotClass Object Init Complete ")
 
     def appinit(self):
         '''
@@ -478,17 +838,91 @@ class PlotThread:
         self.filtervalue    = filtervalue
         self.filtervaluelist.append(self.filtervalue)
 
+    def ReadRingBuffer(self, maxcount: int = None) -> int:
+        '''
+        从共享内存环形缓冲区中取出已到达的样本，加入缓存
+        每段连续的行以零拷贝视图按列批量写入缓存后再释放，不逐个反序列化
+        :param maxcount: 最多取出的样本个数，为None时不限制
+        :return: 本次取出的样本个数
+        '''
+        ring = self.ringbuffer
+        total = 0
+        block = ring.view(maxcount)
+        while len(block):
+            self.valuelist.extend(block[:, SharedRingBuffer.RAW])
+            self.filtervaluelist.extend(block[:, SharedRingBuffer.FILTERED])
+            self.value, self.filtervalue = block[-1, SharedRingBuffer.RAW], block[-1, SharedRingBuffer.FILTERED]
+            self.lag = time.time() - float(block[-1, SharedRingBuffer.TIMESTAMP])
+            total += len(block)
+            ring.advance(len(block))
+            block = ring.view(None if maxcount is None else maxcount - total)
+        self.backlog = len(ring)
+        return total
+
+    def DrainQueues(self, maxcount: int = None) -> int:
+        '''
+        非阻塞地取出两个队列中已到达的样本，按到达顺序配对后批量加入缓存
+        原始值先于滤波值放入队列，未配对的样本留到下一次再处理
+        :param maxcount: 最多取出的样本个数，为None时不限制
+        :return: 本次加入缓存的样本个数
+        '''
+        rawpending, filterpending = self.__rawpending, self.__filterpending
+        limit = float('inf') if maxcount is None else maxcount
+        try:
+            while len(rawpending) < limit:
+                rawpending.append(self.queue.get_nowait())
+        except Empty:
+            pass
+        # SimpleQueue没有get_nowait，单一消费者下empty()为False时get()不会阻塞
+        while len(filterpending) < len(rawpending) and not self.simplequeue.empty():
+            filterpending.append(self.simplequeue.get())
+        count = min(len(rawpending), len(filterpending))
+        if count:
+            values = [rawpending.popleft() for _ in range(count)]
+            filtervalues = [filterpending.popleft() for _ in range(count)]
+            self.valuelist.extend(values)
+            self.filtervaluelist.extend(filtervalues)
+            self.value, self.filtervalue = values[-1], filtervalues[-1]
+        try:
+            self.backlog = len(rawpending) + self.queue.qsize()
+        except NotImplementedError:
+            # macOS上multiprocessing.Queue不支持qsize
+            self.backlog = len(rawpending)
+        return count
+
+    def Metrics(self) -> dict:
+        '''
+        返回绘图消费端的运行指标
+        :return: 字典
+        '''
+        return {"ticks": self.ticks, "drained": self.drained, "backlog": self.backlog,
+                "maxbacklog": self.maxbacklog, "lag": self.lag, "rendertime": self.rendertime,
+                "overruns": self.ringbuffer.overruns if self.ringbuffer is not None else 0}
+
     def DataUpdate(self):
         '''
-        用于定时进行曲线更新,这里模拟绘制正弦曲线
+        用于定时进行曲线更新：非阻塞地取出本周期内到达的所有样本（最多maxbatch个），
+        合并为一次setData，生产者晚到时不会阻塞Qt事件循环，生产者较快时也不会逐渐落后
         :return: None
         '''
-        self.value = self.queue.get()
-        self.filtervalue = self.simplequeue.get()
-        self.GetValue(self.value,self.filtervalue)
-        # 将数据转化为图形
-        self.curve.setData(self.valuelist)
-        self.filtercurve.setData(self.filtervaluelist)
+        start = time.perf_counter()
+        self.ticks += 1
+        if self.ringbuffer is not None:
+            self.drained = self.ReadRingBuffer(self.maxbatch)
+        else:
+            self.drained = self.DrainQueues(self.maxbatch)
+        self.maxbacklog = max(self.maxbacklog, self.backlog)
+        # 没有新数据时不重绘
+        if not self.drained:
+            return
+        # 将数据转化为图形，view()零拷贝返回按时间顺序排列的数组
+        if self.valuewindow is None:
+            self.curve.setData(self.valuelist.view())
+            self.filtercurve.setData(self.filtervaluelist.view())
+        else:
+            self.curve.setData(*self.valuewindow.Render())
+            self.filtercurve.setData(*self.filterwindow.Render())
+        self.rendertime = time.perf_counter() - start
 
     def SetUpdate(self,time:int = 100):
         '''
@@ -506,42 +940,105 @@ class PlotThread:
         pg.exec()
 
 class DateProcessClass():
-    def __init__(self, DateList: List[int], FilterLength: int):
+    def __init__(self, DateList: List[int], FilterLength: int,
+                 filtertype: FilterType = FilterType.AVERAGEFILTER, statwindow: int = 10, **params):
         self.DateList = DateList
         self.FilterLength = FilterLength
-        self.TempList = [0] * (self.FilterLength)
+        # 已经完成滤波的数据个数，DateList为RingStore时按累计写入总数计
+        self.__filtertotal = 0
+        # 滤波后数据的增量统计，statwindow为窗口最大/最小值的窗口长度
+        self.statistics = RunningStatistics(statwindow)
+        # 增量流式滤波器，默认为滑动平均，替代原来TempList逐个移位的实现
+        self.SetFilter(filtertype, **params)
+
+    def SetFilter(self, filtertype: FilterType, **params) -> None:
+        '''
+        运行时选择滤波器，不复制DateList中的数据：
+        已经滤波的数据保持不变，之后追加的数据使用新的滤波器
+        :param filtertype: 滤波器类型
+        :param params: 滤波器参数，基于窗口的滤波器默认使用FilterLength
+        :return: None
+        '''
+        cls = FilterRegistry.get(filtertype)
+        if cls is not None and cls.WINDOWED:
+            params.setdefault("FilterLength", self.FilterLength)
+        self.__filter = CreateFilter(filtertype, **params)
+        self.__filterparams = params
+        self.filtertype = filtertype
 
     def DateFilter(self) -> List:
-        # 遍历DateList
-        for index, value in enumerate(self.DateList):
-            # 把每个值都当成传入的新的传感器的值
-            NowValue = value
-            # 表示列表求和的变量
-            sum = 0
-            for i in range(self.FilterLength - 1):
-                # 实现列表的移位操作
-                self.TempList[i] = self.TempList[i + 1]
-                # 实现列表求和
-                sum += self.TempList[i]
-            self.TempList[self.FilterLength - 1] = NowValue
-            sum += self.TempList[self.FilterLength - 1]
-            # 求平均值
-            average = sum / self.FilterLength
-            # 将计算得到的平均值替换原始值
-            self.DateList[index] = average
-        # 计算完成后将TempList中元素清零
-        self.TempList = [0] * (self.FilterLength)
-        return average,self.DateList
+        '''
+        数据滤波，滤波结果原地替换DateList中的原始值，DateList可以是list或RingStore
+        只处理上次调用之后新追加的数据，每个新样本O(1)，
+        多次调用的结果与对整个列表做一次补零滑动平均相同
+        :return: 最新的滤波值, 滤波后的DateList
+        '''
+        # 只对新追加的数据滤波，并将平均值替换原始值
+        start = self.__UnfilteredStart()
+        if start < len(self.DateList):
+            newdata = self.__filter.process(self.DateList[start:])
+            self.DateList[start:] = newdata
+            self.__filtertotal = self.__Total()
+            # 滤波结果同时送入增量统计
+            self.statistics.update(newdata)
+        return self.__filter.value, self.DateList
+
+    def __Total(self) -> int:
+        '''
+        DateList累计写入的数据个数，私有方法
+        list为当前长度，RingStore为包括已被覆盖数据在内的total
+        :return: int
+        '''
+        return getattr(self.DateList, "total", len(self.DateList))
+
+    def __UnfilteredStart(self) -> int:
+        '''
+        返回DateList中尚未滤波数据的起始下标，私有方法
+        列表被清空或截短时，从头开始重新滤波和统计
+        :return: int
+        '''
+        total = self.__Total()
+        if total < self.__filtertotal:
+            self.__filter.reset()
+            self.statistics.reset()
+            self.__filtertotal = 0
+        return max(0, len(self.DateList) - (total - self.__filtertotal))
+
+    def DateFilterArray(self, data=None):
+        '''
+        向量化滤波模式，用于离线处理大批量数据，不修改DateList
+        滑动平均滤波时补零预热方式与DateFilter一致
+        :param data: NumPy数组或支持缓冲区协议的对象，为None时处理DateList
+        :return: 滤波后的float64数组
+        '''
+        if data is None:
+            data = self.DateList
+        if self.filtertype is FilterType.AVERAGEFILTER:
+            return MovingAverageArray(data, self.__filterparams["FilterLength"])
+        # 其他滤波器使用一个新的滤波器对象逐点处理
+        import numpy as np
+        return CreateFilter(self.filtertype, **self.__filterparams).process(np.asarray(data))
 
     def DateCalMax(self) -> int:
-        max_value = max(self.DateList)
+        # 已滤波部分的最大值由增量统计O(1)给出，只需扫描尚未滤波的新数据
+        tail = self.DateList[self.__UnfilteredStart():]
+        if self.statistics.count == 0:
+            return int(max(tail))
+        max_value = max(self.statistics.maximum, max(tail)) if len(tail) else self.statistics.maximum
         return int(max_value)
 
     def DateCalMin(self) -> int:
-        min_value = min(self.DateList)
+        # 已滤波部分的最小值由增量统计O(1)给出，只需扫描尚未滤波的新数据
+        tail = self.DateList[self.__UnfilteredStart():]
+        if self.statistics.count == 0:
+            return int(min(tail))
+        min_value = min(self.statistics.minimum, min(tail)) if len(tail) else self.statistics.minimum
         return int(min_value)
 
 if __name__ == "__main__":
+    # 启动日志管道：各进程、线程的输出由单独的写日志进程写入控制台和my.log
+    logpipeline = LogPipeline("my.log", level=logging.INFO)
+    logpipeline.start()
     # 创建互斥锁
     lock    = Lock()
     # 创建消息队列
@@ -549,16 +1046,31 @@ if __name__ == "__main__":
     # 创建消息队列
     simplequeue = SimpleQueue()
 
+    # 创建共享内存环形缓冲区，MasterProcess写入，PlotThread批量读取
+    ringbuffer  = SharedRingBuffer(65536)
+
     # 创建进程实例
-    m_process = MasterProcess(lock,queue,simplequeue,port = "COM17")
+    m_process = MasterProcess(lock,queue,simplequeue,port = "COM17",logqueue = logpipeline.queue,ringbuffer = ringbuffer)
     # 创建线程实例
     s_thread  = SensorThread(lock,port="COM11", id=0, state=SensorThread.WORK_MODE["RESPOND_MODE"])
     # 创建绘图类实例
-    p_thread  = PlotThread(lock,queue,simplequeue)
+    p_thread  = PlotThread(lock,queue,simplequeue,ringbuffer = ringbuffer)
 
     # 启动进程
     m_process.start()
     # 开启线程，start方法以并发方式执行
     s_thread.start()
-    # 启动p_thread的定时任务
-    p_thread.SetUpdate(600)
+    try:
+        # 启动p_thread的定时任务，关闭绘图窗口后返回
+        p_thread.SetUpdate(600)
+    finally:
+        # 先停止写入环形缓冲区的主机进程，再释放共享内存，最后停止日志管道，之前的日志都会被写出
+        # 主机进程收到停止事件后自行关闭样本日志和串口，超时未退出时才强制结束
+        m_process.Stop()
+        m_process.join(5)
+        if m_process.is_alive():
+            logging.warning("Master process did not stop in time, terminating")
+            m_process.terminate()
+            m_process.join()
+        ringbuffer.close()
+        logpipeline.stop()
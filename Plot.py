@@ -5,28 +5,161 @@
 # @Author  : 李清水
 # @File    : Plot.py
 # @Description : 定义了PlotClass的属性和方法
+#                定义了多通道绘图类MultiChannelPlotClass
+#                支持交互（pyqtgraph）和无界面两种后端，只有选择交互后端时才导入Qt，
+#                无界面后端可导出PNG/SVG快照，或将抽取后的每帧数据流式写入文件
 
-# 曲线作图相关库
-import pyqtgraph as pg
+# 数值计算
 import numpy as np
-from pyqtgraph.Qt import QtCore
+# 帧数据文件打包/解包
+import struct
 # 日志输出相关库
 import logging
+# 数学计算、时间操作、多线程相关
+import math
+import time
+import threading
+# 结构化事件日志
+from EventLog import eventlog
+# 滑动窗口绘图数据和固定容量的环形存储
+from Decimate import SlidingWindow, MinMaxDecimate, DecimateBinSize
+from Buffer import RingStore
 
-# 在配置下日志输出目标文件和日志格式
-LOG_FORMAT="%(asctime)s-%(levelname)s-%(message)s"
-logging.basicConfig(filename='my.log',level=logging.DEBUG,format=LOG_FORMAT)
+
+# 热路径上的事件，只有打开eventlog时才记录
+EV_PLOT_RECV = eventlog.RegisterEvent("PlotRecvData", ("value",), "d")
+
+# 曲线作图相关库，选择交互后端时由ImportQt导入
+pg     = None
+QtCore = None
+
+# 帧数据文件格式：
+#   文件头    MAGIC(4B) | VERSION(1B)
+#   帧记录    TIMESTAMP(float64) | CURVE(4B) | N(4B) | N个float64的x | N个float64的y
+FRAME_MAGIC   = b'PLTF'
+FRAME_VERSION = 1
+FRAME_HEADER  = struct.Struct('<dII')
+
+
+def ImportQt():
+    '''
+    导入pyqtgraph和Qt，只在第一次调用时真正导入
+    :return: (pyqtgraph, QtCore)，供其他模块中的绘图类使用
+    '''
+    global pg, QtCore
+    if pg is None:
+        import pyqtgraph
+        from pyqtgraph.Qt import QtCore as qtcore
+        pg, QtCore = pyqtgraph, qtcore
+    return pg, QtCore
+
+
+class HeadlessCurve:
+    '''
+    无界面后端的曲线，只保存数据和位置，接口与pyqtgraph的PlotDataItem相同
+    '''
+    def __init__(self, pen=None):
+        self.pen = pen
+        self.x   = None
+        self.y   = None
+        self.pos = (0, 0)
+
+    def setData(self, *args):
+        '''
+        设置曲线数据，保存数据的副本，传入RingStore的零拷贝视图时之后的写入不会改变已保存的曲线
+        :param args: (y)或(x, y)
+        :return: None
+        '''
+        if len(args) == 1:
+            self.y = np.array(args[0], dtype=np.float64)
+            self.x = np.arange(self.y.shape[0], dtype=np.float64)
+        else:
+            self.x = np.array(args[0], dtype=np.float64)
+            self.y = np.array(args[1], dtype=np.float64)
+
+    def setPos(self, x, y):
+        self.pos = (x, y)
+
+
+class HeadlessPlot:
+    '''
+    无界面后端的图层，接口与pyqtgraph的PlotItem相同
+    '''
+    def __init__(self, title: str = None, row: int = 0, col: int = 0):
+        self.title  = title
+        self.row    = row
+        self.col    = col
+        self.curves = []
+
+    def plot(self, pen=None) -> HeadlessCurve:
+        curve = HeadlessCurve(pen)
+        self.curves.append(curve)
+        return curve
+
+    def setXLink(self, plot) -> None:
+        pass
+
+
+class HeadlessLayout:
+    '''
+    无界面后端的窗口，接口与pyqtgraph的GraphicsLayoutWidget相同
+    '''
+    def __init__(self, title: str = None, width: int = 1000, height: int = 600):
+        self.title  = title
+        self.width  = width
+        self.height = height
+        self.plots  = []
+
+    def resize(self, width: int, height: int) -> None:
+        self.width, self.height = width, height
+
+    def addPlot(self, title: str = None, row: int = None, col: int = None) -> HeadlessPlot:
+        plot = HeadlessPlot(title, len(self.plots) if row is None else row, 0 if col is None else col)
+        self.plots.append(plot)
+        return plot
+
+
+def ReadFrames(path: str):
+    '''
+    读取StreamFrames写入的帧数据文件
+    :param path: 文件路径
+    :return: 生成器，每帧为(时间戳, 曲线编号, x, y)
+    '''
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(FRAME_MAGIC):
+        raise ValueError("Not a frame file", path)
+    offset = len(FRAME_MAGIC) + 1
+    while offset + FRAME_HEADER.size <= len(data):
+        timestamp, index, n = FRAME_HEADER.unpack_from(data, offset)
+        offset += FRAME_HEADER.size
+        x = np.frombuffer(data, dtype=np.float64, count=n, offset=offset)
+        y = np.frombuffer(data, dtype=np.float64, count=n, offset=offset + 8 * n)
+        offset += 16 * n
+        yield timestamp, index, x, y
 
 class PlotClass:
+    # 类变量：
+    #   INTERACTIVE_BACKEND - 交互后端，pyqtgraph窗口和Qt事件循环 -0
+    #   HEADLESS_BACKEND    - 无界面后端，不导入Qt，按需导出快照或帧数据 -1
+    INTERACTIVE_BACKEND, HEADLESS_BACKEND = (0, 1)
+
     # 绘图类初始化
-    def __init__(self,wintitle:str="Basic plotting examples",plottitle:str="Updating plot",width:int=1000,height:int=600):
+    def __init__(self,wintitle:str="Basic plotting examples",plottitle:str="Updating plot",width:int=1000,height:int=600,window:int=None,maxpoints:int=2000,backend:int=INTERACTIVE_BACKEND):
         '''
         用于初始化Plot类
         :param wintitle:  窗口标题
         :param plottitle: 图层标题
         :param width:     窗口宽度
         :param height:    窗口高度
+        :param window:    滑动窗口长度，只绘制最近window个样本，为None时绘制全部历史数据
+        :param maxpoints: 滑动窗口模式下每帧绘制的最大点数，超过时按min/max抽取
+        :param backend:   绘图后端，INTERACTIVE_BACKEND或HEADLESS_BACKEND
         '''
+        if backend not in (PlotClass.INTERACTIVE_BACKEND, PlotClass.HEADLESS_BACKEND):
+            raise ValueError("Invalid backend", backend)
+        # 绘图后端
+        self.backend    = backend
         # Qt应用实例对象
         self.app        = None
         # 窗口对象
@@ -42,20 +175,33 @@ class PlotClass:
         self.__count    = 0
         # 传感器数据缓存列表
         self.valuelist  = []
+        # 滑动窗口绘图：缓存改为固定容量的环形存储，每帧的绘制量固定
+        self.slidingwindow = None
+        if window is not None:
+            self.valuelist     = RingStore(window)
+            self.slidingwindow = SlidingWindow(self.valuelist, window, maxpoints)
         # 绘图曲线
         self.curve      = None
+        # 所有曲线，曲线编号为其下标
+        self.curves     = []
         # 图层对象
         self.plotob     = None
         # 图层标题
         self.plottitle  = plottitle
-        # 定时器对象
-        self.timer = QtCore.QTimer()
+        # 定时器对象，无界面后端由SetUpdate按时间循环调用DataUpdate
+        self.timer = None
+        if backend == PlotClass.INTERACTIVE_BACKEND:
+            ImportQt()
+            self.timer = QtCore.QTimer()
         # 定时时间
         self.time  = 0
+        # 无界面后端的定时循环是否运行
+        self.running    = False
+        # 帧数据文件
+        self.stream     = None
         # Qt应用和窗口初始化
         self.appinit()
 
-        print("PLOT INIT SUCCESS")
         logging.info("PLOT INIT SUCCESS")
 
     # 应用程序初始化
@@ -64,6 +210,12 @@ class PlotClass:
         用于qt应用程序初始化，添加窗口、曲线和图层
         :return: None
         '''
+        if self.backend == PlotClass.HEADLESS_BACKEND:
+            self.win = HeadlessLayout(self.title, self.width, self.height)
+            self.plotob = self.win.addPlot(title=self.plottitle)
+            self.curve = self.plotob.plot(pen='y')
+            self.curves = [self.curve]
+            return
         # 创建一个Qt应用，并返回该应用的实例对象
         self.app = pg.mkQApp("Plotting Example")
         # 生成多面板图形
@@ -80,6 +232,7 @@ class PlotClass:
         self.plotob = self.win.addPlot(title=self.plottitle)
         # 添加曲线
         self.curve = self.plotob.plot(pen='y')
+        self.curves = [self.curve]
 
     # 接收数据
     def GetValue(self,value):
@@ -90,8 +243,9 @@ class PlotClass:
         '''
         self.value = value
         self.valuelist.append(value)
-        print("PLOT RECV DATA : "+str(self.value))
-        logging.info("PLOT RECV DATA : "+str(self.value))
+        logging.debug("PLOT RECV DATA : %s", self.value)
+        if EV_PLOT_RECV.enabled:
+            EV_PLOT_RECV.emit(self.value)
 
     # 更新曲线数据
     def DataUpdate(self):
@@ -105,7 +259,91 @@ class PlotClass:
         self.value = np.sin(self.__count)
         self.GetValue(self.value)
         # 将数据转化为图形
-        self.curve.setData(self.valuelist)
+        self.RenderCurve()
+
+    # 绘制曲线
+    def RenderCurve(self):
+        '''
+        将缓存的数据绘制到曲线上，滑动窗口模式下只绘制抽取后的窗口数据
+        :return: None
+        '''
+        if self.slidingwindow is None:
+            self.curve.setData(self.valuelist)
+            if self.stream is not None:
+                self.WriteFrame(0, None, self.valuelist)
+        else:
+            x, y = self.slidingwindow.Render()
+            self.curve.setData(x, y)
+            if self.stream is not None:
+                self.WriteFrame(0, x, y)
+
+    # 写入一帧数据
+    def WriteFrame(self, index: int, x, y):
+        '''
+        将一条曲线本帧的数据追加到帧数据文件
+        :param index: 曲线编号
+        :param x: x数据，为None时为0,1,2...
+        :param y: y数据
+        :return: None
+        '''
+        y = np.asarray(y, dtype=np.float64)
+        x = np.arange(y.shape[0], dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64)
+        self.stream.write(FRAME_HEADER.pack(time.time(), index, y.shape[0]))
+        self.stream.write(x.tobytes())
+        self.stream.write(y.tobytes())
+
+    # 开始流式写入帧数据
+    def StreamFrames(self, path: str):
+        '''
+        之后每次绘制时把每条曲线的数据（滑动窗口模式下为抽取后的数据）追加到文件，
+        可用ReadFrames读取
+        :param path: 文件路径，已有内容会被覆盖
+        :return: None
+        '''
+        self.StopStream()
+        self.stream = open(path, "wb", buffering=1 << 20)
+        self.stream.write(FRAME_MAGIC + bytes([FRAME_VERSION]))
+
+    # 停止流式写入帧数据
+    def StopStream(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    # 导出快照
+    def Snapshot(self, path: str):
+        '''
+        将当前曲线导出为图片，格式由扩展名决定（.png或.svg）
+        交互后端使用pyqtgraph的导出器，无界面后端使用matplotlib的Agg画布（需要安装matplotlib）
+        :param path: 文件路径
+        :return: None
+        '''
+        svg = path.lower().endswith(".svg")
+        if self.backend == PlotClass.INTERACTIVE_BACKEND:
+            import pyqtgraph.exporters
+            exporter = pg.exporters.SVGExporter if svg else pg.exporters.ImageExporter
+            exporter(self.win.scene()).export(path)
+            return
+        try:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+        except ImportError as e:
+            raise ImportError("Headless snapshots require matplotlib") from e
+        plots = self.win.plots
+        rows = max(plot.row for plot in plots) + 1
+        cols = max(plot.col for plot in plots) + 1
+        figure = Figure(figsize=(self.win.width / 100, self.win.height / 100), dpi=100)
+        FigureCanvasAgg(figure)
+        for plot in plots:
+            axes = figure.add_subplot(rows, cols, plot.row * cols + plot.col + 1)
+            if plot.title:
+                axes.set_title(plot.title)
+            for curve in plot.curves:
+                if curve.y is None:
+                    continue
+                axes.plot(curve.x + curve.pos[0], curve.y + curve.pos[1], linewidth=0.8,
+                          color=curve.pen if isinstance(curve.pen, str) else None)
+        figure.savefig(path, format="svg" if svg else "png")
 
     # 设置定时更新
     def SetUpdate(self,time:int = 100):
@@ -114,13 +352,302 @@ class PlotClass:
         :param time: 定时的时间
         :return: None
         '''
+        if self.backend == PlotClass.HEADLESS_BACKEND:
+            self.time = time
+            self.__RunHeadless(time / 1000)
+            return
         # 定时器结束，触发DataUpdate方法
         self.timer.timeout.connect(self.DataUpdate)
         # 启动定时器
         self.timer.start(time)
         # 定时时间
         self.time = time
-        print("PLOT SET UPDATA")
         logging.info("PLOT SET UPDATA")
         # 进入主事件循环并等待
-        pg.exec()
\ No newline at end of file
+        pg.exec()
+
+    # 无界面后端的定时循环
+    def __RunHeadless(self, interval: float):
+        '''
+        按固定间隔调用DataUpdate，直到调用Stop，私有方法
+        :param interval: 间隔，单位s
+        :return: None
+        '''
+        self.running = True
+        deadline = time.perf_counter()
+        while self.running:
+            self.DataUpdate()
+            deadline += interval
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # 落后时不补帧
+                deadline = time.perf_counter()
+
+    # 停止定时更新
+    def Stop(self):
+        '''
+        停止定时更新
+        :return: None
+        '''
+        self.running = False
+        if self.timer is not None:
+            self.timer.stop()
+
+class MultiChannelPlotClass(PlotClass):
+    '''
+    多通道绘图类，继承自PlotClass
+
+    所有通道的数据保存在一个二维数组中，每行为一个通道，长度为2*window，
+    与RingStore相同采用镜像写入，任意通道最近window个样本都是一段连续内存，可以零拷贝读取；
+    数据到达（PushVector/PushBlock/PushChannel）只写数组并标记通道，
+    绘制由定时器按maxfps频率触发，只重绘有新数据的通道，点数超过maxpoints时按min/max抽取，
+    因此刷新频率与数据到达频率无关。
+    支持两种布局：
+        STACKED_LAYOUT —— 所有通道画在一个图层中，每个通道用setPos上下错开，不复制数据
+        GRID_LAYOUT    —— 每个通道一个图层，按网格排列，x轴联动
+    '''
+    # 类变量：
+    #   STACKED_LAYOUT - 堆叠布局 -0
+    #   GRID_LAYOUT    - 网格布局 -1
+    STACKED_LAYOUT, GRID_LAYOUT = (0, 1)
+
+    def __init__(self, channels: int = 64, window: int = 2000, layout: int = STACKED_LAYOUT,
+                 maxfps: float = 30.0, maxpoints: int = 1000, spacing: float = 1.0,
+                 wintitle: str = "Multi-channel plotting", plottitle: str = "Channels",
+                 width: int = 1200, height: int = 900, backend: int = PlotClass.INTERACTIVE_BACKEND):
+        '''
+        初始化方法
+        :param channels:  通道数
+        :param window:    每个通道显示的样本个数
+        :param layout:    布局，STACKED_LAYOUT或GRID_LAYOUT
+        :param maxfps:    最大刷新频率，单位Hz
+        :param maxpoints: 每个通道每帧绘制的最大点数，超过时按min/max抽取
+        :param spacing:   堆叠布局下相邻通道的纵向间距
+        :param wintitle:  窗口标题
+        :param plottitle: 图层标题
+        :param width:     窗口宽度
+        :param height:    窗口高度
+        :param backend:   绘图后端，INTERACTIVE_BACKEND或HEADLESS_BACKEND
+        '''
+        if layout not in (MultiChannelPlotClass.STACKED_LAYOUT, MultiChannelPlotClass.GRID_LAYOUT):
+            raise ValueError("Invalid layout", layout)
+        self.channels   = channels
+        self.window     = window
+        self.layout     = layout
+        self.maxfps     = maxfps
+        self.maxpoints  = maxpoints
+        self.spacing    = spacing
+        # 区间长度按窗口固定，窗口写满后每帧每个通道的点数和计算量不变
+        self.binsize    = DecimateBinSize(window, maxpoints)
+        # 镜像缓冲区，每行为一个通道
+        self.data       = np.zeros((channels, 2 * window), dtype=np.float64)
+        # 每个通道下一个写入的位置、保存的样本个数和累计样本总数
+        self.pos        = np.zeros(channels, dtype=np.int64)
+        self.count      = np.zeros(channels, dtype=np.int64)
+        self.total      = np.zeros(channels, dtype=np.int64)
+        # 有新数据、需要重绘的通道
+        self.dirty      = np.zeros(channels, dtype=bool)
+        # 绘制时在锁内复制数据的目标数组，每帧重复使用
+        self.__scratch  = np.empty((channels, window), dtype=np.float64)
+        # 数据写入线程与绘制线程之间的互斥锁
+        self.lock       = threading.Lock()
+        # 每个通道的曲线和图层
+        self.curves     = []
+        self.plots      = []
+        # 刷新指标：已绘制帧数、最近一帧耗时(s)、最近一秒的实际帧率
+        self.frames     = 0
+        self.frametime  = 0.0
+        self.fps        = 0.0
+        self.__fpsstart = time.perf_counter()
+        self.__fpsframes = 0
+        PlotClass.__init__(self, wintitle, plottitle, width, height, backend=backend)
+
+    def appinit(self):
+        '''
+        用于qt应用程序初始化，按布局添加窗口、图层和每个通道的曲线
+        :return: None
+        '''
+        if self.backend == PlotClass.HEADLESS_BACKEND:
+            self.win = HeadlessLayout(self.title, self.width, self.height)
+            pen = lambda ch: None
+        else:
+            self.app = pg.mkQApp("Plotting Example")
+            self.win = pg.GraphicsLayoutWidget(show=True, title=self.title)
+            self.win.resize(self.width, self.height)
+            # 通道较多时关闭抗锯齿
+            pg.setConfigOptions(antialias=False)
+            pen = lambda ch: pg.intColor(ch, self.channels)
+        if self.layout == MultiChannelPlotClass.STACKED_LAYOUT:
+            self.plotob = self.win.addPlot(title=self.plottitle)
+            self.plots = [self.plotob]
+            for ch in range(self.channels):
+                curve = self.plotob.plot(pen=pen(ch))
+                # 纵向偏移由曲线的位置实现，数据本身不需要加偏移
+                curve.setPos(0, ch * self.spacing)
+                self.curves.append(curve)
+        else:
+            cols = int(math.ceil(math.sqrt(self.channels)))
+            for ch in range(self.channels):
+                plot = self.win.addPlot(row=ch // cols, col=ch % cols)
+                if self.plots:
+                    plot.setXLink(self.plots[0])
+                self.plots.append(plot)
+                self.curves.append(plot.plot(pen=pen(ch)))
+            self.plotob = self.plots[0]
+        self.curve = self.curves[0]
+
+    def PushVector(self, vector) -> None:
+        '''
+        每个通道各写入一个样本
+        :param vector: 长度为channels的样本向量
+        :return: None
+        '''
+        with self.lock:
+            rows = np.arange(self.channels)
+            pos = self.pos
+            self.data[rows, pos] = vector
+            self.data[rows, pos + self.window] = vector
+            pos += 1
+            pos[pos == self.window] = 0
+            np.minimum(self.count + 1, self.window, out=self.count)
+            self.total += 1
+            self.dirty[:] = True
+
+    def PushBlock(self, block) -> None:
+        '''
+        每个通道各写入n个样本
+        :param block: 形状为(channels, n)的数组
+        :return: None
+        '''
+        block = np.asarray(block, dtype=np.float64)
+        for ch in range(self.channels):
+            self.PushChannel(ch, block[ch])
+
+    def PushChannel(self, ch: int, values) -> None:
+        '''
+        向一个通道写入若干样本，各通道可以以不同的频率到达
+        :param ch: 通道号
+        :param values: 样本序列
+        :return: None
+        '''
+        values = np.asarray(values, dtype=np.float64).ravel()
+        window = self.window
+        with self.lock:
+            if values.shape[0] > window:
+                # 只有最近window个样本会被显示
+                self.total[ch] += values.shape[0] - window
+                values = values[-window:]
+            row = self.data[ch]
+            start = 0
+            while start < values.shape[0]:
+                pos = int(self.pos[ch])
+                size = min(window - pos, values.shape[0] - start)
+                chunk = values[start:start + size]
+                row[pos:pos + size] = chunk
+                row[pos + window:pos + window + size] = chunk
+                pos += size
+                self.pos[ch] = 0 if pos == window else pos
+                start += size
+            self.count[ch] = min(window, int(self.count[ch]) + values.shape[0])
+            self.total[ch] += values.shape[0]
+            self.dirty[ch] = True
+
+    def ChannelView(self, ch: int):
+        '''
+        按时间顺序返回一个通道保存的样本，零拷贝
+        :param ch: 通道号
+        :return: (一维float64数组视图, 第一个样本的绝对下标)
+        '''
+        count = int(self.count[ch])
+        end = int(self.pos[ch]) + self.window
+        return self.data[ch, end - count:end], int(self.total[ch]) - count
+
+    def GetValue(self, value):
+        '''
+        接收一组传感器数据，每个通道一个样本
+        :param value: 长度为channels的样本向量
+        :return: None
+        '''
+        self.value = value
+        self.PushVector(value)
+
+    def DataUpdate(self):
+        '''
+        定时刷新：只重绘有新数据的通道
+        :return: None
+        '''
+        start = time.perf_counter()
+        scratch = self.__scratch
+        with self.lock:
+            channels = np.flatnonzero(self.dirty)
+            self.dirty[:] = False
+            # 锁内只把需要绘制的数据复制到预先分配的数组中，抽取在释放锁之后进行，
+            # 写入线程最多等待一次内存复制，不会被整轮抽取阻塞
+            views = []
+            for row, ch in enumerate(channels):
+                data, first = self.ChannelView(ch)
+                scratch[row, :data.shape[0]] = data
+                views.append((ch, data.shape[0], first))
+        for row, (ch, count, first) in enumerate(views):
+            data = scratch[row, :count]
+            if count > self.maxpoints:
+                x, y = MinMaxDecimate(data, self.maxpoints, first, self.binsize)
+            else:
+                # scratch下一帧会被覆盖，曲线需要保存自己的副本
+                x, y = np.arange(first, first + count, dtype=np.float64), data.copy()
+            self.curves[ch].setData(x, y)
+            if self.stream is not None:
+                self.WriteFrame(ch, x, y)
+        self.frames += 1
+        self.__fpsframes += 1
+        now = time.perf_counter()
+        self.frametime = now - start
+        if now - self.__fpsstart >= 1.0:
+            self.fps = self.__fpsframes / (now - self.__fpsstart)
+            self.__fpsstart, self.__fpsframes = now, 0
+
+    def SetUpdate(self, time: int = None):
+        '''
+        设置定时刷新任务，刷新间隔由maxfps决定
+        :param time: 定时的时间，单位ms，为None时为1000/maxfps
+        :return: None
+        '''
+        if time is None:
+            time = max(1, int(1000 / self.maxfps))
+        PlotClass.SetUpdate(self, time)
+
+
+if __name__ == "__main__":
+    # 64通道、总采样率10kHz的模拟数据，界面按30FPS刷新
+    # 加参数--headless时不打开窗口：运行3秒，帧数据写入frames.bin，最后导出snapshot.png
+    import sys
+    # 日志只在入口程序中配置
+    from LogPipeline import DefaultLogging
+    DefaultLogging("my.log")
+    headless = "--headless" in sys.argv
+    channels, rate = 64, 10000
+    plot = MultiChannelPlotClass(channels, window=2000, layout=MultiChannelPlotClass.STACKED_LAYOUT, maxfps=30,
+                                 backend=PlotClass.HEADLESS_BACKEND if headless else PlotClass.INTERACTIVE_BACKEND)
+
+    def Producer():
+        # 每10ms每个通道写入rate/channels/100个样本
+        block = max(1, rate // channels // 100)
+        phase = np.arange(channels)[:, None]
+        n = 0
+        while True:
+            t = (n + np.arange(block)) * 0.01
+            plot.PushBlock(0.4 * np.sin(t + phase) + 0.05 * np.random.standard_normal((channels, block)))
+            n += block
+            time.sleep(0.01)
+
+    threading.Thread(target=Producer, daemon=True).start()
+    if headless:
+        plot.StreamFrames("frames.bin")
+        threading.Timer(3.0, plot.Stop).start()
+    plot.SetUpdate()
+    if headless:
+        plot.StopStream()
+        print("frames : %d, fps : %.1f, last frame : %.2f ms" % (plot.frames, plot.fps, plot.frametime * 1e3))
+        plot.Snapshot("snapshot.png")
@@ -0,0 +1,403 @@
+# Python env   :
+# -*- coding: utf-8 -*-
+# @Time    : 2024/6/15 9:30
+# @Author  : 李清水
+# @File    : SampleLog.py
+# @Description : 定义了分段滚动的样本日志类SampleLogClass
+#                样本只追加写入，每条记录定长并带CRC，段文件按大小或时间滚动，封存时写入索引尾部；
+#                重新打开时只读取每段的尾部和最后一段的最后几条记录，
+#                以O(段数)的代价找到最后一条有效记录，采集进程重启后可以立即接着原来的索引继续
+
+# 日志输出相关库
+import logging
+# 文件和目录操作
+import os
+# 记录打包/解包
+import struct
+# CRC校验
+import zlib
+# 时间操作相关
+import time
+# 具体实现需要的依赖库
+import numpy as np
+
+# 段文件格式：
+#   段头      MAGIC(4B) | VERSION(1B) | 段编号(4B) | 创建时间(float64)
+#   记录      INDEX(int64) | TIMESTAMP(float64) | VALUE(float64) | CRC32(4B)，CRC覆盖前24字节
+#   索引尾部  每indexinterval条记录一项：记录序号(4B) | INDEX(int64) | TIMESTAMP(float64)
+#   尾部信息  索引项数(4B) | 记录数(4B) | 首/末INDEX | 首/末TIMESTAMP | CRC32(4B) | END_MAGIC(4B)
+#            CRC覆盖索引项和尾部信息中CRC之前的部分；只有写完尾部信息的段才是封存的段
+SEGMENT_MAGIC   = b'SLOG'
+SEGMENT_VERSION = 1
+SEGMENT_END     = b'SEND'
+SEGMENT_HEADER  = struct.Struct('<4sBId')
+RECORD          = struct.Struct('<qdd')
+RECORD_SIZE     = RECORD.size + 4
+FOOTER_ENTRY    = struct.Struct('<Iqd')
+TRAILER         = struct.Struct('<IIqqddI4s')
+# 记录的numpy结构化类型，用于批量读取
+RECORD_DTYPE    = np.dtype([("index", "<i8"), ("timestamp", "<f8"), ("value", "<f8"), ("crc", "<u4")])
+
+
+def SegmentPath(path: str, segmentid: int) -> str:
+    '''
+    返回段文件路径
+    :param path: 日志目录
+    :param segmentid: 段编号
+    :return: 文件路径
+    '''
+    return os.path.join(path, "segment_%08d.log" % segmentid)
+
+
+def ReadTrailer(f, size: int):
+    '''
+    读取并校验段文件的尾部
+    :param f: 以二进制方式打开的段文件
+    :param size: 文件大小
+    :return: (记录数, 首INDEX, 末INDEX, 首TIMESTAMP, 末TIMESTAMP, 索引项数组)，不是封存的段时为None
+    '''
+    if size < SEGMENT_HEADER.size + TRAILER.size:
+        return None
+    f.seek(size - TRAILER.size)
+    trailer = f.read(TRAILER.size)
+    entries, count, firstindex, lastindex, firsttime, lasttime, crc, magic = TRAILER.unpack(trailer)
+    footersize = entries * FOOTER_ENTRY.size
+    if magic != SEGMENT_END or size != SEGMENT_HEADER.size + count * RECORD_SIZE + footersize + TRAILER.size:
+        return None
+    f.seek(size - TRAILER.size - footersize)
+    footer = f.read(footersize)
+    if zlib.crc32(footer + trailer[:TRAILER.size - 8]) != crc:
+        return None
+    table = np.frombuffer(footer, dtype=np.dtype([("record", "<u4"), ("index", "<i8"), ("timestamp", "<f8")]))
+    return count, firstindex, lastindex, firsttime, lasttime, table
+
+
+class SampleLogClass:
+    '''
+    分段滚动的样本日志类，接口与FileIOClass相同
+
+    样本以定长记录追加到当前段，当前段超过maxbytes字节或创建超过maxage秒后封存并开始新的一段；
+    封存时写入稀疏索引尾部，之后的段不再修改。进程崩溃时只有最后一段可能没有尾部或有写了一半的记录，
+    重新打开时从最后一条记录向前校验CRC，截断到最后一条有效记录后继续追加。
+    '''
+    def __init__(self, path: str, maxbytes: int = 64 << 20, maxage: float = None, maxsegments: int = None,
+                 indexinterval: int = 1024, flushrows: int = 4096, flushinterval: float = 1000):
+        '''
+        初始化方法，打开已有日志并恢复最后一条有效记录
+        :param path: 日志目录，不存在时创建
+        :param maxbytes: 每段的最大字节数
+        :param maxage: 每段最长的时间，单位s，为None时只按大小滚动
+        :param maxsegments: 最多保留的段数，超过时删除最旧的段，为None时全部保留
+        :param indexinterval: 索引尾部每多少条记录记录一项
+        :param flushrows: 每写入多少行刷新一次，为0时不按行数刷新
+        :param flushinterval: 距离上次刷新超过多少毫秒时刷新，为0时不按时间刷新
+        '''
+        self.path          = path
+        self.maxbytes      = maxbytes
+        self.maxage        = maxage
+        self.maxsegments   = maxsegments
+        self.indexinterval = indexinterval
+        self.flushrows     = flushrows
+        self.flushinterval = flushinterval / 1000
+        self.pendingrows   = 0
+        self.flushtime     = time.monotonic()
+        # 封存段的信息：段编号 -> (记录数, 首INDEX, 末INDEX, 首TIMESTAMP, 末TIMESTAMP, 索引项数组)
+        self.segments      = {}
+        # 当前段的编号、文件、创建时间、记录数、首条记录和索引项
+        self.segmentid     = 0
+        self.file          = None
+        self.created       = 0.0
+        self.count         = 0
+        self.first         = None
+        self.entries       = []
+        # 最后一条有效记录的INDEX和TIMESTAMP，没有记录时为None
+        self.lastindex     = None
+        self.lasttime      = None
+        # 恢复时截断的字节数
+        self.truncated     = 0
+        os.makedirs(path, exist_ok=True)
+        self.__Recover()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.CloseFile()
+        return False
+
+    @property
+    def closed(self) -> bool:
+        return self.file is None
+
+    @property
+    def nextindex(self) -> int:
+        '''
+        重启后应使用的下一个INDEX
+        :return: int
+        '''
+        return 0 if self.lastindex is None else self.lastindex + 1
+
+    def SegmentIds(self) -> list:
+        '''
+        按编号顺序列出目录中的段
+        :return: 段编号列表
+        '''
+        ids = []
+        for name in os.listdir(self.path):
+            if name.startswith("segment_") and name.endswith(".log"):
+                ids.append(int(name[len("segment_"):-len(".log")]))
+        return sorted(ids)
+
+    def __Recover(self) -> None:
+        '''
+        读取每段的尾部，最后一段没有尾部时找到最后一条有效记录并继续追加，私有方法
+        :return: None
+        '''
+        ids = self.SegmentIds()
+        for segmentid in ids:
+            filepath = SegmentPath(self.path, segmentid)
+            size = os.path.getsize(filepath)
+            with open(filepath, "rb") as f:
+                info = ReadTrailer(f, size)
+            if info is not None:
+                self.segments[segmentid] = info
+                if info[0]:
+                    self.lastindex, self.lasttime = info[2], info[4]
+            elif segmentid == ids[-1]:
+                self.__ReopenSegment(segmentid, size)
+                return
+            else:
+                # 只有最后一段可能没有封存，中间的段损坏时保留文件但不再读取
+                logging.warning("SampleLog segment %d has no valid footer, skipped", segmentid)
+        self.__NewSegment(ids[-1] + 1 if ids else 0)
+
+    def __ReopenSegment(self, segmentid: int, size: int) -> None:
+        '''
+        重新打开没有封存的最后一段：从最后一条完整记录向前校验CRC，截断后继续追加，私有方法
+        :param segmentid: 段编号
+        :param size: 文件大小
+        :return: None
+        '''
+        filepath = SegmentPath(self.path, segmentid)
+        self.file = open(filepath, "r+b", buffering=1 << 20)
+        header = self.file.read(SEGMENT_HEADER.size)
+        if len(header) < SEGMENT_HEADER.size or header[:4] != SEGMENT_MAGIC:
+            # 段头没有写完，整段重建
+            self.file.close()
+            self.truncated += size
+            self.__NewSegment(segmentid)
+            return
+        _, _, _, self.created = SEGMENT_HEADER.unpack(header)
+        count = (size - SEGMENT_HEADER.size) // RECORD_SIZE
+        while count:
+            self.file.seek(SEGMENT_HEADER.size + (count - 1) * RECORD_SIZE)
+            record = self.file.read(RECORD_SIZE)
+            if zlib.crc32(record[:RECORD.size]) == struct.unpack_from('<I', record, RECORD.size)[0]:
+                break
+            count -= 1
+        end = SEGMENT_HEADER.size + count * RECORD_SIZE
+        self.truncated += size - end
+        self.file.truncate(end)
+        self.file.seek(end)
+        self.segmentid = segmentid
+        self.count = count
+        if count:
+            # 恢复首条记录、最后一条记录和索引项，只读取索引间隔上的记录
+            records = np.memmap(filepath, dtype=RECORD_DTYPE, mode="r", offset=SEGMENT_HEADER.size, shape=(count,))
+            self.first = (int(records[0]["index"]), float(records[0]["timestamp"]))
+            self.lastindex, self.lasttime = int(records[-1]["index"]), float(records[-1]["timestamp"])
+            for record in range(0, count, self.indexinterval):
+                self.entries.append((record, int(records[record]["index"]), float(records[record]["timestamp"])))
+            del records
+        if self.truncated:
+            logging.warning("SampleLog truncated %d bytes of torn records in segment %d", self.truncated, segmentid)
+        logging.info("SampleLog resume segment %d with %d records, next index %d", segmentid, count, self.nextindex)
+
+    def __NewSegment(self, segmentid: int) -> None:
+        '''
+        创建新的一段并写入段头，私有方法
+        :param segmentid: 段编号
+        :return: None
+        '''
+        self.segmentid = segmentid
+        self.created = time.time()
+        self.count = 0
+        self.first = None
+        self.entries = []
+        self.file = open(SegmentPath(self.path, segmentid), "w+b", buffering=1 << 20)
+        self.file.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, segmentid, self.created))
+        if self.maxsegments is not None:
+            ids = sorted(self.segments)
+            for oldid in ids[:max(0, len(ids) + 1 - self.maxsegments)]:
+                os.remove(SegmentPath(self.path, oldid))
+                del self.segments[oldid]
+
+    def __SealSegment(self) -> None:
+        '''
+        写入索引尾部并关闭当前段，私有方法
+        :return: None
+        '''
+        footer = b''.join(FOOTER_ENTRY.pack(*entry) for entry in self.entries)
+        if self.count:
+            firstindex, firsttime = self.first
+            lastindex, lasttime = self.lastindex, self.lasttime
+        else:
+            firstindex = lastindex = 0
+            firsttime = lasttime = 0.0
+        prefix = TRAILER.pack(len(self.entries), self.count, firstindex, lastindex, firsttime, lasttime,
+                              0, SEGMENT_END)[:TRAILER.size - 8]
+        crc = zlib.crc32(footer + prefix)
+        self.file.write(footer + prefix + struct.pack('<I4s', crc, SEGMENT_END))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+        table = np.frombuffer(footer, dtype=np.dtype([("record", "<u4"), ("index", "<i8"), ("timestamp", "<f8")]))
+        self.segments[self.segmentid] = (self.count, firstindex, lastindex, firsttime, lasttime, table)
+
+    def WriteFile(self, index, data, timestamp=None) -> None:
+        '''
+        追加一批样本
+        :param index: 传感器索引序列
+        :param data: 传感器数据序列
+        :param timestamp: 时间戳，为None时为当前时间
+        :return: None
+        '''
+        if self.closed:
+            raise ValueError("SampleLog is closed", self.path)
+        if timestamp is None:
+            timestamp = time.time()
+        if self.maxage is not None and self.count and time.time() - self.created >= self.maxage:
+            self.Rotate()
+        records = bytearray()
+        pack, crc32 = RECORD.pack, zlib.crc32
+        limit = (self.maxbytes - SEGMENT_HEADER.size) // RECORD_SIZE
+        for i, value in zip(index, data):
+            if self.count >= limit:
+                if records:
+                    self.file.write(records)
+                    records = bytearray()
+                self.Rotate()
+            record = pack(i, timestamp, value)
+            records += record
+            records += crc32(record).to_bytes(4, "little")
+            if self.count % self.indexinterval == 0:
+                self.entries.append((self.count, i, timestamp))
+            if self.count == 0:
+                self.first = (i, timestamp)
+            self.count += 1
+            self.lastindex, self.lasttime = i, timestamp
+            self.pendingrows += 1
+        self.file.write(records)
+        if self.flushrows and self.pendingrows >= self.flushrows:
+            self.Flush()
+        elif self.flushinterval and time.monotonic() - self.flushtime >= self.flushinterval:
+            self.Flush()
+
+    def Rotate(self) -> None:
+        '''
+        封存当前段并开始新的一段
+        :return: None
+        '''
+        self.__SealSegment()
+        self.__NewSegment(self.segmentid + 1)
+
+    def Flush(self) -> None:
+        '''
+        将缓冲区写入文件
+        :return: None
+        '''
+        if not self.closed:
+            self.file.flush()
+        self.pendingrows = 0
+        self.flushtime   = time.monotonic()
+
+    def Sync(self) -> None:
+        '''
+        刷新缓冲区并同步到磁盘（fsync）
+        :return: None
+        '''
+        self.Flush()
+        if not self.closed:
+            os.fsync(self.file.fileno())
+
+    def CloseFile(self) -> None:
+        '''
+        刷新并关闭当前段，当前段不封存，下次打开时继续追加；可以重复调用
+        :return: None
+        '''
+        if not self.closed:
+            self.Sync()
+            self.file.close()
+            self.file = None
+
+    def ReadRange(self, start: int = None, stop: int = None):
+        '''
+        按INDEX范围读取封存的段和当前段中的记录，用段尾部的首/末INDEX跳过不相关的段，
+        段内用索引项定位，要求同一段内INDEX递增
+        :param start: 下界，为None时不限制
+        :param stop: 上界（不包含），为None时不限制
+        :return: RECORD_DTYPE结构化数组
+        '''
+        self.Flush()
+        parts = []
+        segments = [(segmentid,) + info[:3] + (info[5],) for segmentid, info in sorted(self.segments.items())]
+        if not self.closed and self.count:
+            table = np.array(self.entries, dtype=[("record", "<u4"), ("index", "<i8"), ("timestamp", "<f8")])
+            segments.append((self.segmentid, self.count, self.first[0], self.lastindex, table))
+        for segmentid, count, firstindex, lastindex, table in segments:
+            if not count or (start is not None and lastindex < start) or (stop is not None and firstindex >= stop):
+                continue
+            # 用索引项确定需要读取的记录范围
+            low = 0 if start is None else int(table["record"][max(0, np.searchsorted(table["index"], start, "right") - 1)])
+            high = count
+            if stop is not None:
+                position = np.searchsorted(table["index"], stop, "left")
+                if position < len(table):
+                    high = int(table["record"][position])
+            records = np.fromfile(SegmentPath(self.path, segmentid), dtype=RECORD_DTYPE, count=high - low,
+                                  offset=SEGMENT_HEADER.size + low * RECORD_SIZE)
+            mask = np.ones(records.shape[0], dtype=bool)
+            if start is not None:
+                mask &= records["index"] >= start
+            if stop is not None:
+                mask &= records["index"] < stop
+            parts.append(records[mask])
+        return np.concatenate(parts) if parts else np.empty(0, dtype=RECORD_DTYPE)
+
+
+if __name__ == "__main__":
+    # 写入多段后模拟崩溃（最后一段写了半条记录），对比重新打开的耗时与全量扫描的耗时
+    import shutil
+    import tempfile
+
+    tempdir = tempfile.mkdtemp()
+    path = os.path.join(tempdir, "samples")
+    count, batch = 2000000, 1000
+    log = SampleLogClass(path, maxbytes=4 << 20)
+    start = time.perf_counter()
+    for i in range(0, count, batch):
+        log.WriteFile(range(i, i + batch), [j % 100 for j in range(i, i + batch)])
+    writetime = time.perf_counter() - start
+    log.Flush()
+    # 模拟崩溃：不封存当前段，并在末尾留下半条记录
+    log.file.write(b'\x01' * (RECORD_SIZE // 2))
+    log.file.flush()
+    log.file.close()
+
+    start = time.perf_counter()
+    log = SampleLogClass(path, maxbytes=4 << 20)
+    resumetime = time.perf_counter() - start
+    # 全量扫描至少要读取所有段文件
+    start = time.perf_counter()
+    for segmentid in log.SegmentIds():
+        with open(SegmentPath(path, segmentid), "rb") as f:
+            f.read()
+    scantime = time.perf_counter() - start
+    print("write  : %d records in %d segments, %.2f s" % (count, len(log.SegmentIds()), writetime))
+    print("resume : next index %d, truncated %d bytes, %.2f ms (reading all segments %.2f ms)" %
+          (log.nextindex, log.truncated, resumetime * 1e3, scantime * 1e3))
+    records = log.ReadRange(1234500, 1234600)
+    print("range  : %d records, first %d last %d" % (len(records), records["index"][0], records["index"][-1]))
+    log.CloseFile()
+    shutil.rmtree(tempdir)
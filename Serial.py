@@ -11,14 +11,27 @@ import serial
 import serial.tools.list_ports
 # 日志输出相关库
 import logging
+# 二进制帧协议
+from Frame import EncodeFrame, FrameValue, FrameDecoder, LineDecoder, ReadFrame, FRAME_DATA
+# 结构化事件日志
+from EventLog import eventlog
 
-# 在配置下日志输出目标文件和日志格式
-LOG_FORMAT="%(asctime)s-%(levelname)s-%(message)s"
-logging.basicConfig(filename='my.log',level=logging.DEBUG,format=LOG_FORMAT)
+# 批量读取时单次最多读取的字节数
+READ_BULK_SIZE = 65536
+
+
+# 热路径上的事件，只有打开eventlog时才记录
+EV_SERIAL_READ      = eventlog.RegisterEvent("SerialRead", ("value",))
+EV_SERIAL_READBULK  = eventlog.RegisterEvent("SerialReadBulk", ("bytes", "values"))
+EV_SERIAL_WRITE     = eventlog.RegisterEvent("SerialWrite", ("frametype", "length"))
 
 class SerialClass:
     # 限定SerialClass对象只能绑定以下属性
-    __slots__ = ('dev','_SerialClass__devstate')
+    __slots__ = ('dev','_SerialClass__devstate','_SerialClass__protocol','_SerialClass__decoder','_SerialClass__linedecoder')
+    # 类变量：
+    #   ASCII_PROTOCOL  - 文本协议，每个数值一行  -0
+    #   BINARY_PROTOCOL - 二进制帧协议           -1
+    ASCII_PROTOCOL, BINARY_PROTOCOL = (0, 1)
     # 初始化
     # 使用默认参数
     def __init__(self,
@@ -41,8 +54,13 @@ class SerialClass:
         # 表示串口设备的状态-打开或者关闭
         # 初始化时为关闭
         self.__devstate         = False
+        # 通信协议，初始化时为文本协议，协商后可切换为二进制帧协议
+        self.__protocol         = SerialClass.ASCII_PROTOCOL
+        # 二进制帧解码器
+        self.__decoder          = FrameDecoder()
+        # 文本协议解码器，保存批量读取时不完整的最后一行
+        self.__linedecoder      = LineDecoder()
 
-        print("SerialClass init")
         logging.info("SerialClass init")
 
     # 取值方法
@@ -50,45 +68,105 @@ class SerialClass:
     def devstate(self):
         return self.__devstate
 
+    # 取值方法
+    @property
+    def protocol(self):
+        return self.__protocol
+
+    # 切换通信协议
+    def SetProtocol(self,protocol:int):
+        if protocol not in (SerialClass.ASCII_PROTOCOL, SerialClass.BINARY_PROTOCOL):
+            raise ValueError("Invalid protocol", protocol)
+        self.__protocol = protocol
+        # 切换协议时丢弃旧协议下未解码的数据
+        self.__decoder      = FrameDecoder()
+        self.__linedecoder  = LineDecoder()
+        logging.info("SerialClass-SetProtocol %d", protocol)
+
     # 打开串口
     def OpenSerial(self):
-        print("SerialClass-OpenSerial")
         logging.info("SerialClass-OpenSerial")
         self.dev.open()
         self.__devstate = True
 
     # 关闭串口
     def CloseSerial(self):
-        print("SerialClass-CloseSerial")
         logging.info("SerialClass-CloseSerial")
         self.dev.close()
         self.__devstate = False
 
     # 串口读取
     def ReadSerial(self):
-        print("SerialClass-ReadSerial")
-        logging.info("SerialClass-ReadSerial")
+        logging.debug("SerialClass-ReadSerial")
         if self.__devstate:
-            # 未设置timeout时，按照阻塞方式读取
-            # 设置timeout时，等到超时到期并返回在此之前收到的所有字节
-            # 按行读取
-            data = self.dev.readline()
-            # 如果接收到字节的情况下，进行处理
-            if data != b'':
-                # 收到为二进制数据
-                # 用utf-8编码将二进制数据解码为unicode字符串
-                # 字符串转为int类型
-                data = int(data.decode('utf-8', 'replace'))
-            # 否则，设置data为-1
-            else:
-                data = -1
+            data = self.__ReadValue()
+            if EV_SERIAL_READ.enabled:
+                EV_SERIAL_READ.emit(data)
             return data
 
+    # 读取一个数值
+    def __ReadValue(self):
+        # 二进制帧协议：取出帧中的第一个数值，超时返回-1
+        if self.__protocol == SerialClass.BINARY_PROTOCOL:
+            frame = self.ReadFrame()
+            return frame[2][0] if frame is not None and frame[2] else -1
+        # 先取批量读取时留在缓冲区中的完整行
+        data = self.__linedecoder.next()
+        if data is not None:
+            return data
+        # 未设置timeout时，按照阻塞方式读取
+        # 设置timeout时，等到超时到期并返回在此之前收到的所有字节
+        # 按行读取
+        line = self.dev.readline()
+        # 如果接收到字节的情况下，进行处理
+        # 收到为二进制数据，int()可以直接将其转为int类型
+        if line != b'':
+            self.__linedecoder.feed(line)
+            data = self.__linedecoder.next()
+        # 否则，设置data为-1
+        return -1 if data is None else data
+
+    # 串口批量读取
+    def ReadSerialBulk(self,maxbytes:int = READ_BULK_SIZE):
+        '''
+        批量读取，一次取走串口接收缓冲区中已经到达的所有数据并解码
+        接收缓冲区为空时，最多阻塞timeout等待第一个字节
+        :param maxbytes: 单次最多读取的字节数
+        :return: 解码得到的整数列表，超时时为空列表
+        '''
+        if not self.__devstate:
+            return []
+        waiting = self.dev.in_waiting
+        if waiting:
+            chunk = self.dev.read(min(waiting, maxbytes))
+        else:
+            # 等待第一个字节，随后取走同时到达的数据
+            chunk = self.dev.read(1)
+            if chunk:
+                waiting = self.dev.in_waiting
+                if waiting:
+                    chunk += self.dev.read(min(waiting, maxbytes - 1))
+        if self.__protocol == SerialClass.BINARY_PROTOCOL:
+            self.__decoder.feed(chunk)
+            values = [value for frame in self.__decoder.frames() for value in frame[2]]
+        else:
+            self.__linedecoder.feed(chunk)
+            values = self.__linedecoder.values()
+        # 每批只记录一次事件
+        if EV_SERIAL_READBULK.enabled:
+            EV_SERIAL_READBULK.emit(len(chunk), len(values))
+        return values
+
     # 串口写入
-    def WriteSerial(self,write_data):
-        print("SerialClass-WriteSerial")
-        logging.info("SerialClass-WriteSerial")
+    def WriteSerial(self,write_data,frametype:int = FRAME_DATA):
+        logging.debug("SerialClass-WriteSerial")
+        if EV_SERIAL_WRITE.enabled:
+            EV_SERIAL_WRITE.emit(frametype, len(str(write_data)))
         if self.__devstate:
+            # 二进制帧协议：数值打包为一帧发送
+            if self.__protocol == SerialClass.BINARY_PROTOCOL:
+                self.WriteFrame(frametype, [FrameValue(write_data)])
+                return
             # 非阻塞方式写入
             self.dev.write(write_data.encode())
             # 输出换行符
@@ -97,6 +175,25 @@ class SerialClass:
             # \r\n表示换行回车
             self.dev.write('\r\n'.encode())
 
+    # 读取一帧二进制数据
+    def ReadFrame(self):
+        '''
+        读取一帧二进制数据
+        :return: (帧类型, 帧序号, 数值元组)，超时时返回None
+        '''
+        return ReadFrame(self.dev, self.__decoder)
+
+    # 写入一帧二进制数据
+    def WriteFrame(self,frametype:int,values,seq:int = 0):
+        '''
+        写入一帧二进制数据
+        :param frametype: 帧类型
+        :param values: 数值序列
+        :param seq: 帧序号
+        :return: None
+        '''
+        self.dev.write(EncodeFrame(frametype, values, seq))
+
     def RetSerialState(self):
         if self.dev.isOpen():
             self.__devstate = True
@@ -112,7 +209,7 @@ class DevClass(SerialClass):
     # 开启设备
     def StartDev(self):
         super().OpenSerial()
-        print("START Dev :" + self.dev.port)
+        logging.info("START Dev :%s", self.dev.port)
 
     def ReadSerial(self,byte_size):
         if super().RetSerialState():
@@ -0,0 +1,120 @@
+# Python env   :
+# -*- coding: utf-8 -*-
+# @Time    : 2024/5/22 15:36
+# @Author  : 李清水
+# @File    : Statistics.py
+# @Description : 定义了RunningStatistics类，对数据流做增量式统计
+#                供DateProcessClass、MasterProcess使用，只依赖标准库
+
+# 具体实现需要的依赖库
+import math
+from collections import deque
+# 使用typing模块提供的复合注解功能
+from typing import Iterable
+
+
+class RunningStatistics:
+    '''
+    增量统计类，每输入一个样本更新一次统计量：
+        maximum/minimum     —— 全局最大/最小值，O(1)
+        windowmax/windowmin —— 最近window个样本的最大/最小值，
+                               使用单调队列实现，均摊O(1)
+        mean/variance/std   —— 均值、方差、标准差，使用Welford算法，
+                               数值稳定，不需要保存历史数据
+    '''
+    def __init__(self, window: int = 10):
+        '''
+        初始化方法
+        :param window: 滑动窗口长度，用于计算窗口最大/最小值
+        '''
+        if window < 1:
+            raise ValueError("window must be >= 1", window)
+        self.window = window
+        self.reset()
+
+    def reset(self) -> None:
+        '''
+        清空所有统计量
+        :return: None
+        '''
+        # 样本总数
+        self.count      = 0
+        # 全局最大/最小值
+        self.maximum    = None
+        self.minimum    = None
+        # 均值及偏差平方和（Welford算法）
+        self.mean       = 0.0
+        self.__m2       = 0.0
+        # 单调队列，保存(样本序号, 样本值)
+        # __maxqueue中的值单调递减，队首为窗口最大值
+        # __minqueue中的值单调递增，队首为窗口最小值
+        self.__maxqueue = deque()
+        self.__minqueue = deque()
+
+    def push(self, sample) -> None:
+        '''
+        输入一个新的样本，更新所有统计量
+        :param sample: 样本值
+        :return: None
+        '''
+        index = self.count
+        self.count = index + 1
+
+        # 全局最大/最小值
+        if index == 0:
+            self.maximum = self.minimum = sample
+        elif sample > self.maximum:
+            self.maximum = sample
+        elif sample < self.minimum:
+            self.minimum = sample
+
+        # Welford算法更新均值和偏差平方和
+        delta = sample - self.mean
+        self.mean += delta / self.count
+        self.__m2 += delta * (sample - self.mean)
+
+        # 单调队列：从队尾弹出不可能再成为窗口最值的样本
+        maxqueue = self.__maxqueue
+        while maxqueue and maxqueue[-1][1] <= sample:
+            maxqueue.pop()
+        maxqueue.append((index, sample))
+        minqueue = self.__minqueue
+        while minqueue and minqueue[-1][1] >= sample:
+            minqueue.pop()
+        minqueue.append((index, sample))
+        # 从队首移除已经滑出窗口的样本
+        expired = index - self.window
+        if maxqueue[0][0] <= expired:
+            maxqueue.popleft()
+        if minqueue[0][0] <= expired:
+            minqueue.popleft()
+
+    def update(self, samples: Iterable) -> None:
+        '''
+        依次输入一批样本
+        :param samples: 样本序列
+        :return: None
+        '''
+        push = self.push
+        for sample in samples:
+            push(sample)
+
+    @property
+    def windowmax(self):
+        # 最近window个样本的最大值，没有样本时为None
+        return self.__maxqueue[0][1] if self.__maxqueue else None
+
+    @property
+    def windowmin(self):
+        # 最近window个样本的最小值，没有样本时为None
+        return self.__minqueue[0][1] if self.__minqueue else None
+
+    @property
+    def variance(self) -> float:
+        # 总体方差
+        return self.__m2 / self.count if self.count else 0.0
+
+    @property
+    def std(self) -> float:
+        # 总体标准差
+        return math.sqrt(self.variance)
@@ -16,9 +16,11 @@ import logging
 from enum import Enum
 # 引用自定义模块
 import FileIO
-from FileIO import FileIOClass
+from FileIO import FileIOClass, AsyncFileIOClass
 from Plot   import PlotClass
 from Serial import SerialClass
+from Frame  import FRAME_CMD, FRAME_ID, LoopSend, RateFromArgs
+from EventLog import eventlog
 # 并行并发相关
 from threading import Thread
 from threading import Lock
@@ -29,9 +31,14 @@ import random
 # 时间操作相关
 import time
 
-# 日志设置
-LOG_FORMAT="%(asctime)s-%(levelname)s-%(message)s"
-logging.basicConfig(filename='my.log',level=logging.DEBUG,format=LOG_FORMAT)
+
+# 热路径上的事件，只有打开eventlog时才记录
+EV_SENSOR_SEND_ID   = eventlog.RegisterEvent("SensorSendID", ("sensorid",))
+EV_SENSOR_SEND      = eventlog.RegisterEvent("SensorSendData", ("sensorid", "data"))
+EV_SENSOR_RECV_CMD  = eventlog.RegisterEvent("SensorRecvCMD", ("sensorid", "cmd"))
+EV_MASTER_RECV      = eventlog.RegisterEvent("MasterRecvData", ("data",))
+EV_MASTER_SEND_CMD  = eventlog.RegisterEvent("MasterSendCMD", ("cmd",))
+EV_MASTER_PLOT      = eventlog.RegisterEvent("MasterPlotUpdate", ("value",), "d")
 
 # 定义一个ID号非法的异常
 class InvalidIDError(Exception):
@@ -53,10 +60,19 @@ class SensorClass(SerialClass,Thread):
     #   STOP_CMD        - 关闭命令      -1
     #   SENDID_CMD      - 发送ID命令    -2
     #   SENDVALUE_CMD   - 发送数据命令   -3
-    NONE_CMD,START_CMD,STOP_CMD,SENDID_CMD,SENDVALUE_CMD = (-1,0,1,2,3)
+    #   BINARY_CMD      - 切换二进制帧协议命令 -4
+    NONE_CMD,START_CMD,STOP_CMD,SENDID_CMD,SENDVALUE_CMD,BINARY_CMD = (-1,0,1,2,3,4)
 
     # 类的初始化
-    def __init__(self,port:str = "COM11",id:int = 0,state:int = WORK_MODE["RESPOND_MODE"]):
+    def __init__(self,port:str = "COM11",id:int = 0,state:int = WORK_MODE["RESPOND_MODE"],rate:float = 100.0,batchinterval:float = 0.005):
+        '''
+        传感器类的初始化
+        :param port: 端口号
+        :param id: 传感器id
+        :param state: 工作状态
+        :param rate: 循环模式下的采样发送频率，单位Hz
+        :param batchinterval: 循环模式下两次写入的最小间隔，单位s，频率较高时多个样本合并为一次写入
+        '''
         try:
             # 判断输入端口号是否为str类型
             if type(port) is not str:
@@ -72,89 +88,133 @@ class SensorClass(SerialClass,Thread):
             self.sensorvalue = 0
             self.sensorid    = id
             self.sensorstate = state
-            print("Sensor Init")
+            # 循环模式的发送频率和最小写入间隔
+            self.rate          = rate
+            self.batchinterval = batchinterval
+            # 最近一次收到的命令参数，如START_CMD携带的发送频率
+            self.cmdargs       = ()
+            # 生成数据的计数变量
+            self.datacount     = 0
             logging.info("Sensor Init")
             # Thread的初始化方法
             Thread.__init__(self)
         except TypeError:
             # 当发生异常时，输出如下语句，提醒用户重新输入端口号
-            print("Input error com, Please try new com number")
+            logging.warning("Input error com, Please try new com number")
         except InvalidIDError as e:
             # 当发生异常时，输出如下语句，提醒用户重新输入ID号
-            print("Input error ID, Please try id : 0~99")
-            print(e.args)
+            logging.warning("Input error ID, Please try id : 0~99 %s", e.args)
 
     @staticmethod
     # 判断传感器ID号是否正确：这里判断ID号是否在0到99之间
     def IsTrueID(id:int = 0):
         if id >= 0 and id <= 99:
-            print("Sensor ID True")
+            logging.info("Sensor ID True")
             return True
         else:
-            print("Sensor ID False")
+            logging.info("Sensor ID False")
             return False
 
     # 传感器上电初始化
     def InitSensor(self):
         # 传感器上电初始化工作
         # 同时输出ID号以及状态
-        print("Sensor %d Init complete : %d"%(self.sensorid,self.sensorstate))
-        logging.info("Sensor %d Init complete : %d"%(self.sensorid,self.sensorstate))
+        logging.info("Sensor %d Init complete : %d", self.sensorid, self.sensorstate)
 
     # 开启传感器
     def StartSensor(self):
         super().OpenSerial()
-        print("Sensor %d start serial %s "%(self.sensorid,self.dev.port))
-        logging.info("Sensor %d start serial %s "%(self.sensorid,self.dev.port))
+        logging.info("Sensor %d start serial %s ", self.sensorid, self.dev.port)
 
     # 停止传感器
     def StopSensor(self):
         super().CloseSerial()
-        print("Sensor %d close serial %s " % (self.sensorid, self.dev.port))
-        logging.info("Sensor %d close serial %s " % (self.sensorid, self.dev.port))
+        logging.info("Sensor %d close serial %s ", self.sensorid, self.dev.port)
 
     # 发送传感器ID号
     def SendSensorID(self):
-        super().WriteSerial(str(self.sensorid))
-        print("Sensor %d send id "%self.sensorid)
-        logging.info("Sensor %d send id "%self.sensorid)
+        super().WriteSerial(str(self.sensorid),FRAME_ID)
+        logging.info("Sensor %d send id ", self.sensorid)
+        if EV_SENSOR_SEND_ID.enabled:
+            EV_SENSOR_SEND_ID.emit(self.sensorid)
 
     # 发送传感器数据
     def SendSensorValue(self,data):
         # 发送数据
         super().WriteSerial(str(data))
-        print("Sensor %d send data  %d" % (self.sensorid,data))
-        logging.info("Sensor %d send data  %d" % (self.sensorid,data))
+        logging.debug("Sensor %d send data  %d", self.sensorid, data)
+        if EV_SENSOR_SEND.enabled:
+            EV_SENSOR_SEND.emit(self.sensorid, data)
 
     # 接收主机指令
     def RecvMasterCMD(self):
-        cmd = super().ReadSerial()
-        print("Sensor %d recv cmd %d " % (self.sensorid,cmd))
-        logging.info("Sensor %d recv cmd %d " % (self.sensorid,cmd))
+        if self.protocol == SerialClass.BINARY_PROTOCOL:
+            # 二进制帧协议下命令帧可以携带参数
+            frame = super().ReadFrame()
+            if frame is None or not frame[2]:
+                cmd, self.cmdargs = SensorClass.NONE_CMD, ()
+            else:
+                cmd, self.cmdargs = frame[2][0], frame[2][1:]
+        else:
+            cmd = super().ReadSerial()
+        logging.debug("Sensor %d recv cmd %d ", self.sensorid, cmd)
+        if EV_SENSOR_RECV_CMD.enabled:
+            EV_SENSOR_RECV_CMD.emit(self.sensorid, cmd)
         return cmd
 
+    # 生成模拟的传感器数据
+    def MakeSensorValue(self):
+        # 生成数据
+        self.datacount = self.datacount + 1
+        # 原始信号
+        signal      = math.sin(self.datacount) * 10
+        # 模拟噪声
+        noise       = random.uniform(0, 5)
+        # 最终数据
+        return int(signal + noise)
+
+    # 循环模式，按频率主动发送数据
+    def LoopRun(self):
+        '''
+        循环模式：按rate频率持续主动发送数据，直到收到STOP_CMD命令
+        :return: None
+        '''
+        logging.info("Sensor %d start loop mode : %s Hz", self.sensorid, self.rate)
+        self.rate = LoopSend(self.dev, self.MakeSensorValue, self.rate, self.batchinterval,
+                             self.protocol == SerialClass.BINARY_PROTOCOL,
+                             lambda: self.sensorstate == SensorClass.WORK_MODE["LOOP_MODE"],
+                             self.__LoopCommand)
+        logging.info("Sensor %d stop loop mode", self.sensorid)
+
+    # 循环模式下处理主机命令
+    def __LoopCommand(self):
+        cmd = self.RecvMasterCMD()
+        if cmd == SensorClass.STOP_CMD:
+            # 循环模式下STOP_CMD只停止主动发送，回到响应模式
+            self.sensorstate = SensorClass.WORK_MODE["RESPOND_MODE"]
+        elif cmd == SensorClass.START_CMD:
+            # 运行中收到新的START_CMD，更新发送频率
+            self.rate = RateFromArgs(self.cmdargs, self.rate)
+        return self.rate
+
     # 多线程中用以表示线程活动的方法
     # run 方法中的所有代码（或者在这一方法内部调用的代码）都在一个单独的线程中运行。
     def run(self):
         # 声明全局变量，互斥锁
         global lock
 
-        # 初始化计数变量
-        data_count = 0
         # 初始化传感器
         self.InitSensor()
         # 开启传感器
         self.StartSensor()
 
         while True:
+            # 循环模式下主动发送数据，收到STOP_CMD后回到响应模式
+            if self.sensorstate == SensorClass.WORK_MODE["LOOP_MODE"]:
+                self.LoopRun()
+
             # 生成数据
-            data_count  = data_count + 1
-            # 原始信号
-            signal      = math.sin(data_count) * 10
-            # 模拟噪声
-            noise       = random.uniform(0, 5)
-            # 最终数据
-            data        = int(signal + noise)
+            data        = self.MakeSensorValue()
 
             # 获取互斥锁
             lock.acquire()
@@ -167,17 +227,26 @@ class SensorClass(SerialClass,Thread):
                 # 如果接收到停止命令，停止传感器
                 self.StopSensor()
                 # 输出提示信息
-                print("Sensor stop work !!!")
+                logging.info("Sensor stop work !!!")
                 return
+            elif cmd == SensorClass.START_CMD:
+                # 如果接收到开启命令，进入循环模式，命令参数为发送频率
+                self.rate = RateFromArgs(self.cmdargs, self.rate)
+                self.sensorstate = SensorClass.WORK_MODE["LOOP_MODE"]
             elif cmd == SensorClass.SENDID_CMD:
                 # 如果接收到发送ID命令，发送传感器ID号
                 self.SendSensorID()
             elif cmd == SensorClass.SENDVALUE_CMD:
                 # 如果接收到发送数据命令，发送数据
                 self.SendSensorValue(data)
+            elif cmd == SensorClass.BINARY_CMD:
+                # 如果接收到切换协议命令，先按当前协议回复确认，再切换为二进制帧协议
+                super().WriteSerial(str(SensorClass.BINARY_CMD))
+                self.SetProtocol(SerialClass.BINARY_PROTOCOL)
+                logging.info("Sensor %d switch to binary protocol", self.sensorid)
             elif cmd == SensorClass.NONE_CMD:
                 # 如果没有接收到指令
-                print("Not Recv cmd!!!")
+                logging.debug("Not Recv cmd!!!")
 
             # 释放互斥锁
             lock.release()
@@ -201,6 +270,7 @@ class CMD(Enum):
     STOP_CMD        =   1
     SENDID_CMD      =   2
     SENDVALUE_CMD   =   3
+    BINARY_CMD      =   4
 
 class MasterClass(SerialClass,PlotClass):
     '''
@@ -227,28 +297,46 @@ class MasterClass(SerialClass,PlotClass):
     #   STOP_CMD        - 关闭命令      -1
     #   SENDID_CMD      - 发送ID命令    -2
     #   SENDVALUE_CMD   - 发送数据命令   -3
-    START_CMD, STOP_CMD, SENDID_CMD, SENDVALUE_CMD = (0, 1, 2, 3)
+    #   BINARY_CMD      - 切换二进制帧协议命令 -4
+    START_CMD, STOP_CMD, SENDID_CMD, SENDVALUE_CMD, BINARY_CMD = (0, 1, 2, 3, 4)
 
     # 类的初始化
-    def __init__(self,state:int = IDLE_STATE,port:str = "COM17",wintitle:str="Basic plotting examples",plottitle:str="Updating plot",width:int=1000,height:int=600):
+    def __init__(self,state:int = IDLE_STATE,port:str = "COM17",wintitle:str="Basic plotting examples",plottitle:str="Updating plot",width:int=1000,height:int=600,backend:int = PlotClass.INTERACTIVE_BACKEND,savepath:str = None):
+        '''
+        主机类初始化
+        :param state: 主机工作状态
+        :param port: 主机端口号
+        :param wintitle: 窗口标题
+        :param plottitle: 图层标题
+        :param width: 窗口宽度
+        :param height: 窗口高度
+        :param backend: 绘图后端，INTERACTIVE_BACKEND或HEADLESS_BACKEND
+        :param savepath: 样本保存的csv文件路径，为None时不保存；文件打开失败时抛出异常
+        '''
 
         # 分别调用不同父类的__init__方法
         SerialClass.__init__(self,port)
-        PlotClass.__init__(self,wintitle,plottitle,width,height)
+        PlotClass.__init__(self,wintitle,plottitle,width,height,backend=backend)
         self.valuequeue   = queue.Queue(10)
         self.__masterstatue = state
         # 初始化完成的标志量
         self.INIT_FLAG = False
-        # 文件保存路径
-        self.savepath = "G:\\Python面向对象编程\\Demo\\file.csv"
-        # 创建FileIOClass类的实例化对象
-        self.fileio = FileIOClass(self.savepath)
-        print("MASTER INIT SUCCESSS")
+        # 文件保存路径，为None时不保存样本
+        self.savepath = savepath
+        # 创建FileIOClass类的实例化对象，由后台写线程写入，采集路径不等待磁盘
+        self.fileio = None
+        if savepath is not None:
+            self.fileio = AsyncFileIOClass(FileIOClass(savepath))
+            if backend == PlotClass.INTERACTIVE_BACKEND:
+                # 关闭窗口退出事件循环时写完剩余样本并关闭文件
+                self.app.aboutToQuit.connect(self.CloseFile)
+        # 已保存的样本索引
+        self.sampleindex = 0
         logging.info("MASTER INIT SUCCESSS")
 
     @classmethod
     def MasterInfo(cls):
-        print("Info : "+str(cls))
+        logging.info("Info : %s", cls)
 
     # 开启主机
     def StartMaster(self):
@@ -258,20 +346,32 @@ class MasterClass(SerialClass,PlotClass):
         :return: 无返回值
         '''
         super().OpenSerial()
-        print("START MASTER :"+self.dev.port)
-        logging.info("START MASTER :"+self.dev.port)
+        logging.info("START MASTER :%s", self.dev.port)
 
     # 停止主机
     def StopMaster(self):
+        self.CloseFile()
         super().CloseSerial()
-        print("CLOSE MASTER :" + self.dev.port)
-        logging.info("CLOSE MASTER :" + self.dev.port)
+        logging.info("CLOSE MASTER :%s", self.dev.port)
+
+    # 关闭样本文件
+    def CloseFile(self):
+        '''
+        写完队列中剩余的样本并关闭样本文件，之后不再保存样本，可以重复调用
+        :return: None
+        '''
+        if self.fileio is None:
+            return
+        fileio, self.fileio = self.fileio, None
+        try:
+            fileio.CloseFile()
+        except Exception:
+            logging.exception("MASTER CLOSE FILE FAILED : %s", self.savepath)
 
     # 接收传感器ID号
     def RecvSensorID(self):
         sensorid = super().ReadSerial()
-        print("MASTER RECIEVE ID : " + str(sensorid))
-        logging.info("MASTER RECIEVE ID : " + str(sensorid))
+        logging.info("MASTER RECIEVE ID : %s", sensorid)
         return sensorid
 
     # 接收传感器数据
@@ -285,19 +385,35 @@ class MasterClass(SerialClass,PlotClass):
             if data >= setvalue:
                 raise InvalidSensorValueError(data,setvalue)
 
-            print("MASTER RECIEVE DATA : " + str(data))
-            logging.info("MASTER RECIEVE DATA : " + str(data))
+            logging.debug("MASTER RECIEVE DATA : %s", data)
+            if EV_MASTER_RECV.enabled:
+                EV_MASTER_RECV.emit(data)
             self.valuequeue.put(data)
         except InvalidSensorValueError as e:
-            print("invalid sensor value",e.args)
-            print("value offset is : ",e.cal_offset())
+            logging.warning("invalid sensor value %s, value offset is : %s", e.args, e.cal_offset())
         return data
 
     # 主机发送命令
     def SendSensorCMD(self,cmd):
-        super().WriteSerial(str(cmd))
-        print("MASTER SEND CMD : " + str(cmd))
-        logging.info("MASTER SEND CMD : " + str(cmd))
+        super().WriteSerial(str(cmd),FRAME_CMD)
+        logging.debug("MASTER SEND CMD : %s", cmd)
+        if EV_MASTER_SEND_CMD.enabled:
+            EV_MASTER_SEND_CMD.emit(cmd)
+
+    # 协商切换为二进制帧协议
+    def NegotiateBinary(self):
+        '''
+        发送BINARY_CMD命令，收到传感器的确认后双方切换为二进制帧协议
+        :return: bool，是否切换成功
+        '''
+        self.SendSensorCMD(self.BINARY_CMD)
+        ack = super().ReadSerial()
+        if ack == self.BINARY_CMD:
+            self.SetProtocol(SerialClass.BINARY_PROTOCOL)
+            logging.info("MASTER SWITCH TO BINARY PROTOCOL")
+            return True
+        logging.info("MASTER BINARY PROTOCOL REFUSED : %s", ack)
+        return False
 
     # 主机返回工作状态-
     def RetMasterStatue(self):
@@ -307,11 +423,25 @@ class MasterClass(SerialClass,PlotClass):
     def DataUpdate(self):
         self.SendSensorCMD(self.SENDVALUE_CMD)
         self.value = self.RecvSensorValue()
-        self.WriteSerial("Recv:"+str(self.value))
+        # 文本回显只在文本协议下发送，二进制帧协议下传感器会把收到的帧当作命令
+        if self.protocol == SerialClass.ASCII_PROTOCOL:
+            self.WriteSerial("Recv:"+str(self.value))
         self.GetValue(self.value)
-        self.curve.setData(self.valuelist)
-        print("PLOT UPDATA : " + str(self.value))
-        logging.info("PLOT UPDATA : " + str(self.value))
+        # 保存样本：只放入后台写线程的队列
+        if self.fileio is not None:
+            try:
+                self.fileio.WriteFile((self.sampleindex,), (self.value,))
+            except Exception:
+                # 写线程已经停止：只记录一次并停止保存，不在之后的每次定时更新中重复抛出
+                logging.exception("MASTER STOP RECORDING : %s", self.savepath)
+                self.CloseFile()
+        self.sampleindex += 1
+        self.RenderCurve()
+        logging.debug("PLOT UPDATA : %s", self.value)
+        if EV_MASTER_PLOT.enabled:
+            EV_MASTER_PLOT.emit(self.value)
 
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    # 日志只在入口程序中配置：经进程内的写日志线程异步写入my.log和控制台
+    from LogPipeline import DefaultLogging
+    DefaultLogging("my.log")